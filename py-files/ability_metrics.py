@@ -0,0 +1,864 @@
+'''
+Ability-based metrics of the follow-up wave (homophily, Coleman index,
+classroom segregation, high-ability nominations, inter-ability ties).
+Each function takes the parsed wave DataFrame and returns the frame the
+corresponding script in py-files/ writes to output-files/, so the same
+parse can be shared by several metrics. Nominations are taken from the
+edges of the wave's nomination graph (nomination_graph.py), with the row
+each tie was written on for the nominator's ability.
+'''
+
+import numpy as np
+import pandas as pd
+
+from metric_cache import cached_metric
+from nomination_graph import build_nomination_graph, detect_schema, nomination_columns, to_id_array
+from profiling import profiled, step
+
+
+def present(df: pd.DataFrame, columns: list) -> list:
+
+    '''
+    Keep the columns of `columns` that exist in `df` (e.g. s_merge_id is
+    not shipped with every wave file).
+    '''
+
+    return [c for c in columns if c in df.columns]
+
+
+def select_columns(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+
+    '''
+    Copy of `df` restricted to `columns`, in file order, like
+    `pd.read_csv(..., usecols=columns)` would load them.
+    '''
+
+    return df[[c for c in df.columns if c in columns]].copy()
+
+
+ABILITY_COLUMNS = ["high_math", "high_raven", "high_bangla", "high_eyes"]
+ABILITY_CODES = {"yes": 1, "no": 0}
+
+
+def ability_codes(df: pd.DataFrame, columns: list = ("high_math",)) -> np.ndarray:
+
+    '''
+    Ability codes of each row of `df`: `codes[r, j]` is 1 (high), 0 (low)
+    or NaN for row r on ability `columns[j]`.
+    '''
+
+    return np.column_stack([df[c].map(ABILITY_CODES).to_numpy(dtype="float64", na_value=np.nan)
+                            for c in columns])
+
+
+def lookup_ability(codes: np.ndarray, rows) -> np.ndarray:
+
+    '''
+    Ability codes (per-row `codes`, see ability_codes) of the rows `rows`,
+    any shape, -1 for no row: shape rows.shape + codes.shape[1:], NaN for
+    -1. Rows come from the nomination graph (`graph.edge_rows` for the
+    nominator, `graph.first_row[dst]` for the nominee) or from student ids
+    (student_rows).
+    '''
+
+    rows = np.asarray(rows)
+    out = np.full(rows.shape + codes.shape[1:], np.nan)
+    out[rows >= 0] = codes[rows[rows >= 0]]
+
+    return out
+
+
+def edge_abilities(graph, codes: np.ndarray, relation: str) -> tuple:
+
+    '''
+    Nominations of `relation` with the ability of both ends:
+    (nominator rows, nominee nodes, nominator codes, nominee codes). The
+    nominator's ability is the one on the row the tie was written on, the
+    nominee's the one on their first row.
+    '''
+
+    _, dst = graph.edges(relation)
+    rows = graph.edge_rows[relation]
+
+    return rows, dst, lookup_ability(codes, rows), lookup_ability(codes, graph.first_row[dst])
+
+
+def student_row_table(df: pd.DataFrame,
+                      id_column: str = "fs_student_id",
+                      keep: str = "first") -> tuple:
+
+    '''
+    Row lookup of the students of `df` by id, for ids that are not graph
+    nodes (e.g. students without a classroom): (sorted student ids, row of
+    each). A student listed twice keeps their `keep` ("first" or "last") row.
+    '''
+
+    ids = to_id_array(df[id_column])
+    kept = np.flatnonzero(~pd.Series(ids).duplicated(keep=keep).to_numpy() & (ids >= 0))
+    order = np.argsort(ids[kept], kind="stable")
+
+    return ids[kept][order], kept[order]
+
+
+def student_rows(table: tuple, ids) -> np.ndarray:
+
+    '''
+    Row of each of `ids` in the student row table, -1 for missing or
+    unknown ids. `ids` is a column or, for a frame of nomination slots, one
+    column per slot (the result then has one column per slot too).
+    '''
+
+    sorted_ids, rows = table
+    if isinstance(ids, pd.DataFrame):
+        ids = np.column_stack([to_id_array(ids[c]) for c in ids.columns])
+    else:
+        ids = to_id_array(ids)
+
+    if len(sorted_ids) == 0:
+        return np.full(ids.shape, -1, dtype=np.int64)
+
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+
+    return np.where((ids >= 0) & (sorted_ids[pos] == ids), rows[pos], -1)
+
+
+@profiled()
+@cached_metric()
+def in_degree_homophily(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Same-ability homophily from the perspective of who *gets* nominated:
+      - in_low_low_acad_math, in_high_high_acad_math, ... (counts)
+      - in_low_low_acad_math_b, ... (binary indicators)
+      - in_low_low_acad_math_perc, ... (shares of nominators with known ability)
+      - etc. (same for emot)
+    '''
+
+    # 1) Keep minimal columns
+    step("1) keep columns")
+    usecols = [
+        "fs_classroom", "fs_student_id", "s_merge_id",
+        "high_math",
+        "academic_1","academic_2","academic_3",
+        "emot_1","emot_2","emot_3"
+    ]
+    df = select_columns(df, usecols)
+
+    # 2) Convert 'yes'/'no' -> 1 (high) / 0 (low)
+    step("2) ability codes")
+    map_yes_no = {"yes": 1, "no": 0}
+    df["is_high"] = df["high_math"].map(map_yes_no)
+
+    # Unique students (first row of each fs_student_id)
+    df_unique = df[present(df, ["fs_student_id","is_high","s_merge_id","fs_classroom"])].drop_duplicates("fs_student_id")
+
+    # 3) Nominations as graph edges: each tie's nominator row and nominee
+    #    node, the nominee's ability being the one on their first row
+    step("3) nomination edges")
+    graph = build_nomination_graph(df, relations=["academic", "emot"])
+    own = df["is_high"].to_numpy(dtype="float64", na_value=np.nan)
+
+    # 4) For each nominee, count how many times they are nominated "low->low",
+    #    "high->high", ignoring missing ability
+    step("4) count per nominee")
+    counts = {}
+    for domain, relation in [("acad", "academic"), ("emot", "emot")]:
+        _, dst, nominator_is_high, nominee_is_high = edge_abilities(graph, own, relation)
+        flags = {
+            "low_low_flag": (nominee_is_high == 0) & (nominator_is_high == 0),
+            "high_high_flag": (nominee_is_high == 1) & (nominator_is_high == 1),
+            # Whether the nominator's ability is known for each tie
+            "nominator_known": ~np.isnan(nominator_is_high),
+        }
+        for name, flag in flags.items():
+            counts[f"{name}_{domain}"] = np.bincount(dst, weights=flag, minlength=graph.n_nodes)
+
+    # 5) Counts (float, as the per-nominee pivot gave them) of each unique
+    #    student; students never nominated get 0
+    step("5) merge nominees")
+    node = graph.row_node[np.flatnonzero(~df["fs_student_id"].duplicated().to_numpy())]
+    df_nominees = df_unique.reset_index(drop=True)
+    for name, values in counts.items():
+        df_nominees[name] = np.where(node >= 0, values[np.maximum(node, 0)], 0.0)
+
+    df_nominees["in_low_low_acad_math"]   = df_nominees["low_low_flag_acad"]
+    df_nominees["in_low_low_emot_math"]   = df_nominees["low_low_flag_emot"]
+    df_nominees["in_high_high_acad_math"] = df_nominees["high_high_flag_acad"]
+    df_nominees["in_high_high_emot_math"] = df_nominees["high_high_flag_emot"]
+
+    # Binary indicators: 1 if count > 0
+    for level, code in [("low_low", 0), ("high_high", 1)]:
+        for domain in ["acad", "emot"]:
+            df_nominees[f"in_{level}_{domain}_math_b"] = np.where(
+                (df_nominees["is_high"] == code) & (df_nominees[f"in_{level}_{domain}_math"] > 0),
+                1, 0
+            )
+
+    # Denominator: how many nominators have known ability?
+    df_nominees["in_valid_acad_nominators"] = df_nominees["nominator_known_acad"]
+    df_nominees["in_valid_emot_nominators"] = df_nominees["nominator_known_emot"]
+
+    # Fractions: (# same-ability nominators) / (# valid nominators) if the
+    # nominee has that ability, else NaN
+    for level, code in [("low_low", 0), ("high_high", 1)]:
+        for domain in ["acad", "emot"]:
+            df_nominees[f"in_{level}_{domain}_math_perc"] = np.where(
+                df_nominees["is_high"] == code,
+                df_nominees[f"in_{level}_{domain}_math"] / df_nominees[f"in_valid_{domain}_nominators"],
+                np.nan
+            )
+
+    # 6) Final output columns
+    step("6) output columns")
+    out_cols = present(df_nominees, ["fs_student_id", "s_merge_id", "fs_classroom"]) + [
+        # Basic counts
+        "in_low_low_acad_math","in_low_low_emot_math",
+        "in_high_high_acad_math","in_high_high_emot_math",
+        # Binary
+        "in_low_low_acad_math_b","in_low_low_emot_math_b",
+        "in_high_high_acad_math_b","in_high_high_emot_math_b",
+        # Fractions
+        "in_low_low_acad_math_perc","in_low_low_emot_math_perc",
+        "in_high_high_acad_math_perc","in_high_high_emot_math_perc"
+    ]
+
+    return df_nominees[out_cols].copy()
+
+
+@profiled()
+@cached_metric()
+def same_ability_homophily(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Same-ability homophily from the perspective of the nominator:
+      low_low_acad_math, low_low_emot_math, high_high_acad_math, high_high_emot_math
+      low_low_acad_math_b, low_low_emot_math_b, ...
+      low_low_acad_math_perc, etc.
+    '''
+
+    # 1) Keep needed columns
+    step("1) keep columns")
+    usecols = [
+        "fs_classroom", "fs_student_id", "s_merge_id",
+        "high_math",
+        "academic_1","academic_2","academic_3",
+        "emot_1","emot_2","emot_3"
+    ]
+    df = select_columns(df, usecols)
+
+    # 2) Convert high_math from 'yes'/'no' to numeric (1=high, 0=low)
+    step("2) ability codes")
+    map_yes_no = {"yes": 1, "no": 0}
+    df["is_high"] = df["high_math"].map(map_yes_no)
+
+    # 3) Nominations as graph edges: each tie's nominator row and nominee
+    #    node, the friend's ability being the one on their first row
+    step("3) nomination edges")
+    graph = build_nomination_graph(df, relations=["academic", "emot"])
+    own = df["is_high"].to_numpy(dtype="float64", na_value=np.nan)
+
+    # 4) Count how many same-ability ties in academic/emotional for each row,
+    #    and how many friends have *known* ability (ignore missing ability)
+    step("4) same-ability ties")
+    for domain, relation in [("acad", "academic"), ("emot", "emot")]:
+        rows, _, nominator, friend = edge_abilities(graph, own, relation)
+        for level, code in [("low_low", 0), ("high_high", 1)]:
+            same = (nominator == code) & (friend == code)
+            df[f"{level}_{domain}_math"] = np.bincount(rows, weights=same, minlength=len(df)).astype(np.int64)
+        df[f"valid_{domain}_friend_count"] = np.bincount(rows, weights=~np.isnan(friend),
+                                                         minlength=len(df)).astype(np.int64)
+
+    # 5) Binary indicators: 1 if a student has at least 1 same-ability friend
+    step("5) binary indicators")
+    for level, code in [("low_low", 0), ("high_high", 1)]:
+        for domain in ["acad", "emot"]:
+            df[f"{level}_{domain}_math_b"] = np.where(
+                (df["is_high"] == code) & (df[f"{level}_{domain}_math"] > 0), 1, 0
+            )
+
+    # 6) Share of nominated friends who match the student's own ability
+    step("6) shares")
+    for level, code in [("low_low", 0), ("high_high", 1)]:
+        for domain in ["acad", "emot"]:
+            df[f"{level}_{domain}_math_perc"] = np.where(
+                df["is_high"] == code,
+                df[f"{level}_{domain}_math"] / df[f"valid_{domain}_friend_count"],
+                np.nan
+            )
+
+    # 7) Final DataFrame
+    step("7) output columns")
+    out_cols = present(df, ["fs_classroom","fs_student_id","s_merge_id"]) + [
+        "low_low_acad_math","low_low_emot_math",
+        "high_high_acad_math","high_high_emot_math",
+        "low_low_acad_math_b","low_low_emot_math_b",
+        "high_high_acad_math_b","high_high_emot_math_b",
+        "low_low_acad_math_perc","low_low_emot_math_perc",
+        "high_high_acad_math_perc","high_high_emot_math_perc"
+    ]
+
+    return df[out_cols].copy()
+
+
+@profiled()
+@cached_metric()
+def coleman_homophily(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Classroom-level Coleman homophily index for low/high math ability,
+    on academic and emotional ties.
+    '''
+
+    usecols = [
+        "fs_classroom", "fs_student_id", "high_math",
+        "academic_1", "academic_2", "academic_3",
+        "emot_1", "emot_2", "emot_3"
+    ]
+    df = select_columns(df, usecols)
+
+    # Convert 'yes'/'no' to binary (1 for high ability, 0 for low ability)
+    df["is_high"] = df["high_math"].map({"yes": 1, "no": 0})
+
+    # Count number of low-low and high-high ties for each student, over the
+    # graph edges (nominator row, nominee node with their first-row ability)
+    graph = build_nomination_graph(df, relations=["academic", "emot"])
+    own = df["is_high"].to_numpy(dtype="float64", na_value=np.nan)
+    for domain, relation in [("acad", "academic"), ("emot", "emot")]:
+        rows, _, nominator, friend = edge_abilities(graph, own, relation)
+        for level, code in [("low_low", 0), ("high_high", 1)]:
+            same = (nominator == code) & (friend == code)
+            df[f"{level}_{domain}"] = np.bincount(rows, weights=same, minlength=len(df)).astype(np.int64)
+
+    # Count total academic and emotional friendships
+    df["acad_friend_count"] = df[["academic_1", "academic_2", "academic_3"]].notna().sum(axis=1)
+    df["emot_friend_count"] = df[["emot_1", "emot_2", "emot_3"]].notna().sum(axis=1)
+
+    # Compute classroom-level aggregates
+    agg = df.groupby("fs_classroom").agg(
+        total_student_number=("fs_student_id", "count"),
+        low_math_student_number=("is_high", lambda x: (x == 0).sum()),
+        high_math_student_number=("is_high", lambda x: (x == 1).sum()),
+        low_low_acad_sum=("low_low_acad", "sum"),
+        low_low_emot_sum=("low_low_emot", "sum"),
+        high_high_acad_sum=("high_high_acad", "sum"),
+        high_high_emot_sum=("high_high_emot", "sum"),
+        acad_ties=("acad_friend_count", "sum"),
+        emot_ties=("emot_friend_count", "sum")
+    ).reset_index()
+
+    # Compute the shares
+    agg["low_math_share"] = agg["low_math_student_number"] / agg["total_student_number"]
+    agg["high_math_share"] = agg["high_math_student_number"] / agg["total_student_number"]
+
+    agg["low_low_share_acad"] = agg["low_low_acad_sum"] / agg["acad_ties"]
+    agg["low_low_share_emot"] = agg["low_low_emot_sum"] / agg["emot_ties"]
+    agg["high_high_share_acad"] = agg["high_high_acad_sum"] / agg["acad_ties"]
+    agg["high_high_share_emot"] = agg["high_high_emot_sum"] / agg["emot_ties"]
+
+    # Handle cases where the share is undefined (i.e., classrooms without both types of students)
+    agg.loc[agg["low_math_student_number"] == 0, ["low_low_share_acad", "low_low_share_emot"]] = np.nan
+    agg.loc[agg["high_math_student_number"] == 0, ["high_high_share_acad", "high_high_share_emot"]] = np.nan
+
+    # Compute homophily indices
+    agg["homophily_low_acad"] = (agg["low_low_share_acad"] - agg["low_math_share"]) / (1 - agg["low_math_share"])
+    agg["homophily_low_emot"] = (agg["low_low_share_emot"] - agg["low_math_share"]) / (1 - agg["low_math_share"])
+    agg["homophily_high_acad"] = (agg["high_high_share_acad"] - agg["high_math_share"]) / (1 - agg["high_math_share"])
+    agg["homophily_high_emot"] = (agg["high_high_share_emot"] - agg["high_math_share"]) / (1 - agg["high_math_share"])
+
+    out_cols = [
+        "fs_classroom", "total_student_number", "low_math_student_number", "high_math_student_number",
+        "low_low_share_acad", "low_low_share_emot",
+        "high_high_share_acad", "high_high_share_emot",
+        "low_math_share", "high_math_share",
+        "homophily_low_acad", "homophily_low_emot",
+        "homophily_high_acad", "homophily_high_emot"
+    ]
+
+    return agg[out_cols]
+
+
+@profiled()
+@cached_metric()
+def cross_ability_ratio(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Per classroom, share of emotional nominations that go to a student
+    of the other math ability (`cross_ability_ratio`).
+    '''
+
+    # 1) Keep columns
+    step("1) keep columns")
+    df = select_columns(df, ["fs_student_id","fs_classroom","high_math",
+                             "emot_1","emot_2","emot_3"])
+
+    # 2) Convert 'yes'/'no' to 1/0, if necessary
+    step("2) ability codes")
+    map_bool = {"yes": 1, "no": 0}
+    df["high_math"] = df["high_math"].map(map_bool)
+
+    # 3) Emotional nominations as graph edges: each tie's nominator row and
+    #    nominee node, the nominee's ability being the one on their first row
+    step("3) nomination edges")
+    graph = build_nomination_graph(df, relations=["emot"])
+    own = df["high_math"].to_numpy(dtype="float64", na_value=np.nan)
+    rows, _, nominator_high_math, friend_high_math = edge_abilities(graph, own, "emot")
+
+    # 4) Count cross-ability nominations per nominator row
+    #    cross_ability=1 if nominator's high_math != friend's high_math, else 0
+    step("4) cross-ability flags")
+    known = ~np.isnan(friend_high_math)
+    cross = np.bincount(rows[known], weights=nominator_high_math[known] != friend_high_math[known],
+                        minlength=len(df))
+
+    # 5) Group by classroom (nominator's classroom), compute:
+    #      x+y = sum of cross_ability
+    #      n   = total nominations in that classroom (any filled slot)
+    step("5) groupby classroom")
+    per_row = pd.DataFrame({"cross_ability": cross,
+                            "nominations": df[["emot_1","emot_2","emot_3"]].notna().sum(axis=1).to_numpy()})
+    grouped = per_row.groupby(df["fs_classroom"].to_numpy(), dropna=False).sum()
+    grouped = grouped[grouped["nominations"] > 0]
+    cross_sum = grouped["cross_ability"]         # (x + y)
+    total_noms = grouped["nominations"]          # n
+
+    # 6) Create results DataFrame with ratio
+    step("6) ratio")
+    results = pd.DataFrame({
+        "fs_classroom": cross_sum.index,
+        "cross_ability_count": cross_sum.values,
+        "total_nominations": total_noms.values
+    })
+    results["cross_ability_ratio"] = results["cross_ability_count"] / results["total_nominations"]
+
+    return results[["fs_classroom","cross_ability_ratio"]]
+
+
+@profiled()
+@cached_metric()
+def cross_ability_ratios(df: pd.DataFrame,
+                         relations: list = None,
+                         abilities: list = None) -> pd.DataFrame:
+
+    '''
+    Cross-ability ratio of every relation (emot, academic on the follow-up
+    wave, friend, support on the endline) and every ability (math, raven,
+    bangla, eyes, those the wave has) in one pass, one row per classroom:
+      - cross_ability_ratio_{relation}_{ability}: share of the nominations
+        that go to a student of the other ability
+      - nominations_{relation}_{ability}: nominations counted, i.e. with
+        the ability of both the nominator and the nominee known
+
+    Unlike cross_ability_ratio, a nomination where either ability is
+    missing counts in neither the numerator nor the denominator.
+    '''
+
+    schema = detect_schema(df.columns)
+    classroom, student = schema["classroom"], schema["student"]
+    relations = list(relations or schema["relations"])
+    abilities = list(abilities or [c[len("high_"):] for c in ABILITY_COLUMNS if c in df.columns])
+    ability_cols = [f"high_{a}" for a in abilities]
+
+    # 1) Ability of each nominator (own row) and of each nominee (first row
+    #    of the nominated student), as (rows, abilities) / (rows, slots, abilities)
+    step("1) abilities", rows=len(df))
+    table = student_row_table(df, id_column=student)
+    own = ability_codes(df, ability_cols)
+
+    # 2) Cross-ability and known nominations per row, relation and ability
+    step("2) cross-ability flags")
+    counts = {}
+    for relation in relations:
+        slots = nomination_columns(df.columns, schema["relations"][relation])
+        nominee = lookup_ability(own, student_rows(table, df[slots]))
+        known = ~np.isnan(nominee) & ~np.isnan(own)[:, None, :]
+        cross = known & (nominee != own[:, None, :])
+        for j, ability_name in enumerate(abilities):
+            counts[f"cross_{relation}_{ability_name}"] = cross[:, :, j].sum(axis=1)
+            counts[f"nominations_{relation}_{ability_name}"] = known[:, :, j].sum(axis=1)
+
+    # 3) One groupby over the nominator's classroom for all combinations
+    step("3) groupby classroom")
+    totals = pd.DataFrame(counts).groupby(df[classroom].to_numpy(), dropna=False).sum()
+
+    out = {classroom: totals.index.to_numpy()}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for relation in relations:
+            for ability_name in abilities:
+                key = f"{relation}_{ability_name}"
+                n = totals[f"nominations_{key}"].to_numpy()
+                out[f"cross_ability_ratio_{key}"] = np.where(n > 0, totals[f"cross_{key}"].to_numpy() / n, np.nan)
+                out[f"nominations_{key}"] = n
+
+    return pd.DataFrame(out)
+
+
+def friend_count_arrays(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Per classroom, how many low/high math students nominated 1, 2 or 3
+    emotional friends (`low_1` .. `high_3`).
+    '''
+
+    df = select_columns(df, ["fs_classroom","fs_student_id","high_math","emot_1","emot_2","emot_3"])
+
+    # If 'high_math' is 'yes'/'no', convert to 1/0
+    map_bool = {"yes": 1, "no": 0}
+    df["high_math"] = df["high_math"].map(map_bool)
+
+    # Count how many friends (0–3) each student nominated
+    df["n_friends"] = df[["emot_1","emot_2","emot_3"]].notna().sum(axis=1)
+
+    # Create a boolean for high-ability
+    df["is_high"] = (df["high_math"] == 1)
+
+    # Group by (fs_classroom, is_high, n_friends) and pivot into wide form
+    grouped = df.groupby(["fs_classroom","is_high","n_friends"]).size().reset_index(name="count")
+    pivoted = grouped.pivot_table(index="fs_classroom",
+                                  columns=["is_high","n_friends"],
+                                  values="count",
+                                  fill_value=0)
+
+    # Rename columns: (False,1)->'low_1', (True,3)->'high_3', etc.
+    pivoted.columns = [
+        f"{'high' if is_high else 'low'}_{n}"
+        for (is_high, n) in pivoted.columns
+    ]
+    pivoted = pivoted.reset_index()
+
+    # Ensure all columns exist (some classes might not have any students with 1,2,3 friends)
+    for col in ["low_1","low_2","low_3","high_1","high_2","high_3"]:
+        if col not in pivoted.columns:
+            pivoted[col] = 0
+
+    return pivoted
+
+
+def binomial_table(n_max: int, k_max: int) -> np.ndarray:
+
+    '''
+    Table of C(n, k) for 0 <= n <= n_max, 0 <= k <= k_max, built with the
+    hockey-stick rule C(n, k) = sum_{m<n} C(m, k-1). Values are integers,
+    exact in float64 for the small k used here (k < number of slots).
+    '''
+
+    table = np.zeros((n_max + 1, k_max + 1))
+    table[:, 0] = 1
+    for k in range(1, k_max + 1):
+        table[1:, k] = np.cumsum(table[:-1, k - 1])
+
+    return table
+
+
+def lookup_binomial(table: np.ndarray, n, k: int) -> np.ndarray:
+
+    '''
+    C(n, k) read from `table` for an array of n (0 where n < 0).
+    '''
+
+    return np.where(n >= 0, table[np.clip(n, 0, None), k], 0.)
+
+
+def compute_den(n_r, n_h):
+    # (1, 2, 3) * (n_r + n_h) summed over slots: total nominations per classroom
+    return np.sum(np.arange(1, n_r.shape[-1] + 1) * (n_r + n_h), axis=-1)
+
+
+def compute_p(n_r_sum, n_h_sum, table):
+
+    '''
+    p[c, i, j] for every classroom c: C(n_r, j) C(n_h - 1, i - j) / C(n_r + n_h - 1, i)
+    for j < i, 0 where the denominator is zero.
+    '''
+
+    n_slots = table.shape[1]
+    p = np.zeros((len(n_r_sum), n_slots, n_slots))
+    for i in range(n_slots):
+        den = lookup_binomial(table, n_r_sum + n_h_sum - 1, i)
+        for j in range(i):
+            num = lookup_binomial(table, n_r_sum, j) * lookup_binomial(table, n_h_sum - 1, i - j)
+            p[:, i, j] = np.where(den > 0, num / np.where(den > 0, den, 1), 0)
+
+    return p
+
+
+def compute_num(n_r, n_h, p_r, p_h):
+    sum = np.zeros(len(n_r))
+    for x in range(n_r.shape[1]):
+        for y in range(x):
+            sum += n_r[:, x] * p_r[:, x, y] * (y+1)
+            sum += n_h[:, x] * p_h[:, x, y] * (y+1)
+
+    return sum
+
+
+def compute_mu_batch(low_arrays: np.ndarray, high_arrays: np.ndarray) -> np.ndarray:
+
+    '''
+    Theoretical mu for all classrooms at once. `low_arrays` and
+    `high_arrays` are (num_classrooms, slots) counts of low/high students
+    nominating 1..slots friends. Classrooms without low or without high
+    nominators get NaN.
+    '''
+
+    low_arrays = np.asarray(low_arrays, dtype=np.int64).reshape(-1, np.shape(low_arrays)[-1])
+    high_arrays = np.asarray(high_arrays, dtype=np.int64).reshape(-1, np.shape(high_arrays)[-1])
+
+    mu = np.full(len(low_arrays), np.nan)
+    valid = (low_arrays.max(axis=1, initial=0) > 0) & (high_arrays.max(axis=1, initial=0) > 0)
+    n_r, n_h = low_arrays[valid], high_arrays[valid]
+    if not len(n_r):
+        return mu
+
+    n_r_sum, n_h_sum = n_r.sum(axis=1), n_h.sum(axis=1)
+    table = binomial_table(int((n_r_sum + n_h_sum).max()), n_r.shape[1] - 1)
+
+    p_r = compute_p(n_r_sum, n_h_sum, table)
+    p_h = compute_p(n_h_sum, n_r_sum, table)
+
+    mu[valid] = compute_num(n_r, n_h, p_r, p_h) / compute_den(n_r, n_h)
+
+    return mu
+
+
+def compute_mu_cross_batch(low_arrays: np.ndarray, high_arrays: np.ndarray) -> np.ndarray:
+
+    '''
+    Mu of classroom-segregation-actual.py for all classrooms at once. Unlike
+    compute_mu_batch, a student naming i = 1..slots friends draws j = 1..i
+    of them from the other ability group:
+    p[c, i-1, j-1] = C(n_other, j) C(n_own - 1, i - j) / C(n_other + n_own - 1, i).
+    Classrooms without low or without high nominators get NaN.
+    '''
+
+    low_arrays = np.asarray(low_arrays, dtype=np.int64).reshape(-1, np.shape(low_arrays)[-1])
+    high_arrays = np.asarray(high_arrays, dtype=np.int64).reshape(-1, np.shape(high_arrays)[-1])
+
+    mu = np.full(len(low_arrays), np.nan)
+    valid = (low_arrays.max(axis=1, initial=0) > 0) & (high_arrays.max(axis=1, initial=0) > 0)
+    n_r, n_h = low_arrays[valid], high_arrays[valid]
+    if not len(n_r):
+        return mu
+
+    n_slots = n_r.shape[1]
+    n_r_sum, n_h_sum = n_r.sum(axis=1), n_h.sum(axis=1)
+    table = binomial_table(int((n_r_sum + n_h_sum).max()), n_slots)
+
+    def p(other, own, i, j):
+        den = lookup_binomial(table, other + own - 1, i)
+        num = lookup_binomial(table, other, j) * lookup_binomial(table, own - 1, i - j)
+        return np.where(den > 0, num / np.where(den > 0, den, 1), 0)
+
+    # Same summation order as the scalar loop, for identical floats
+    num = np.zeros(len(n_r))
+    for i in range(1, n_slots + 1):
+        for j in range(1, i + 1):
+            num += n_r[:, i - 1] * p(n_h_sum, n_r_sum, i, j) * j
+            num += n_h[:, i - 1] * p(n_r_sum, n_h_sum, i, j) * j
+
+    mu[valid] = num / compute_den(n_r, n_h)
+
+    return mu
+
+
+def compute_mu(n_r, n_h):
+
+    '''
+    Theoretical mu of a single classroom (see compute_mu_batch).
+    '''
+
+    return compute_mu_batch(np.atleast_2d(n_r), np.atleast_2d(n_h))[0]
+
+
+@profiled()
+@cached_metric()
+def segregation_theoretical(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Per classroom, the low/high friend-count arrays and the theoretical
+    cross-ability share `mu` under random nomination.
+    '''
+
+    pivoted = friend_count_arrays(df)
+
+    # Convert to NumPy arrays, shape = (num_classrooms, 3)
+    low_arrays = pivoted[["low_1","low_2","low_3"]].to_numpy(dtype=int)
+    high_arrays = pivoted[["high_1","high_2","high_3"]].to_numpy(dtype=int)
+
+    mu = compute_mu_batch(low_arrays, high_arrays)
+
+    # Store each array row in one CSV cell as a list
+    pivoted["low_array"] = list(low_arrays.tolist())
+    pivoted["high_array"] = list(high_arrays.tolist())
+    pivoted["mu"] = list(mu.tolist())
+
+    return pivoted[["fs_classroom","low_array","high_array","mu"]]
+
+
+HIGH_NOMINATION_FRIEND_TYPES = {
+    "acad": ["academic_1", "academic_2", "academic_3"],
+    "emot": ["emot_1", "emot_2", "emot_3"]
+}
+HIGH_NOMINATION_RELATIONS = {"acad": "academic", "emot": "emot"}
+
+
+@profiled()
+@cached_metric()
+def high_nomination_tables(df: pd.DataFrame) -> tuple:
+
+    '''
+    Both high-nomination outputs from one edge table:
+    (high_nomination_counts frame, high_nomination_counts_v2 frame).
+
+    The nominations are the edges of the wave's nomination graph (nominator
+    row, nominee student), and the counts received by each student are
+    summed with bincount:
+      - v1: nominations received from anyone (`high_nominated_{type}`),
+        from high (`_h`) and from other (`_l`) students, for nominees who
+        are high on their first row
+      - v2: nominations received from students not coded "yes"
+        (`high_nominated_{type}_l`) and their % of all nominations received
+        (`_perc`), for students high on their own row
+    '''
+
+    graph = build_nomination_graph(df, relations=list(HIGH_NOMINATION_RELATIONS.values()))
+    row_student = graph.row_node
+    n_students = graph.n_nodes
+
+    # Ability of each row (1/0/NaN)
+    own = ability_codes(df)[:, 0]
+    is_high = (df["high_math"] == "yes").to_numpy().astype(int)
+
+    step("edges and counts", rows=len(df))
+    v1_counts, v2_counts = {}, {}
+    for friend_type, relation in HIGH_NOMINATION_RELATIONS.items():
+        # Edges (nominator row, nominee student) to students of the wave,
+        # with the nominator's and the nominee's ability
+        src, dst, nominator, nominee = edge_abilities(graph, own, relation)
+
+        total = np.bincount(dst, minlength=n_students)
+        from_low = np.bincount(dst, weights=is_high[src] == 0, minlength=n_students)
+
+        to_high = nominee == 1
+        high_total = np.bincount(dst[to_high], minlength=n_students)
+        high_h = np.bincount(dst[to_high], weights=np.nan_to_num(nominator[to_high]),
+                             minlength=n_students)
+        v1_counts[friend_type] = (high_total, high_h)
+        v2_counts[friend_type] = (total, from_low)
+
+    step("v1 output")
+    # Per row: the counts of its student (0 for rows without a student id),
+    # appended to a copy of the input as the merge on a row id produced them
+    counts = {}
+    for friend_type, (high_total, high_h) in v1_counts.items():
+        total = np.where(row_student >= 0, high_total[row_student], 0)
+        high = np.where(row_student >= 0, high_h[row_student], 0)
+        counts[f"high_nominated_{friend_type}"] = total.astype(int)
+        counts[f"high_nominated_{friend_type}_h"] = high.astype(int)
+        counts[f"high_nominated_{friend_type}_l"] = (total - high).astype(int)
+
+    usecols = ["fs_student_id", "high_math"] + [c for cols in HIGH_NOMINATION_FRIEND_TYPES.values() for c in cols]
+    left = select_columns(df, usecols).reset_index(drop=True)
+    right = df.reset_index(drop=True)
+    right["high_math"] = right["high_math"].map(ABILITY_CODES)
+    right = pd.concat([right, pd.DataFrame(counts)], axis=1)
+    overlap = [c for c in left.columns if c in right.columns]
+    v1 = pd.concat([left.rename(columns={c: f"{c}_x" for c in overlap}),
+                    right.rename(columns={c: f"{c}_y" for c in overlap})], axis=1)
+
+    step("v2 output")
+    v2 = df[present(df, ["fs_student_id", "s_merge_id", "high_math"])].copy()
+    high_rows = is_high == 1
+    for friend_type, (total, from_low) in v2_counts.items():
+        # Float counts, as the merge on the nominated students gave them
+        received = np.where(row_student >= 0, total[row_student], 0).astype("float64")
+        low = np.where(row_student >= 0, from_low[row_student], 0).astype("float64")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            perc = np.where(received > 0, low / received * 100, 0)
+        v2[f"high_nominated_{friend_type}_l"] = np.where(high_rows, low, 0)
+        v2[f"high_nominated_{friend_type}_l_perc"] = np.where(high_rows, perc, 0)
+
+    return v1, v2
+
+
+@profiled()
+def high_nomination_counts(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Per student, nominations received while being high-ability, split by
+    the nominator's ability, appended to the input columns:
+      - high_nominated_acad, high_nominated_acad_h, high_nominated_acad_l
+      - high_nominated_emot, high_nominated_emot_h, high_nominated_emot_l
+    '''
+
+    return high_nomination_tables(df)[0]
+
+
+@profiled()
+def high_nomination_counts_v2(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    Per student, nominations received from low-ability students while
+    being high-ability, as a count and as a % of all nominations received:
+    high_nominated_acad_l(_perc), high_nominated_emot_l(_perc).
+    '''
+
+    return high_nomination_tables(df)[1]
+
+
+INTER_ABILITY_FRIEND_TYPES = {
+    "emot": ["emot_1", "emot_2", "emot_3"],
+    "acad": ["academic_1", "academic_2", "academic_3"]
+}
+
+
+@profiled()
+@cached_metric()
+def lowhigh_inter_ability(df: pd.DataFrame,
+                          abilities: list = ("math", "raven", "bangla", "eyes")) -> pd.DataFrame:
+
+    '''
+    Per low-ability student, whether they nominate at least one high-ability
+    friend and the share of such friends, for every ability dimension
+    (math, raven, bangla, eyes) and friend type (emot, acad), appended to
+    the input columns as `lowhigh_inter_{friend_type}_{ability}(_perc)`.
+
+    Students who are not high ("yes") count as low, high students get
+    (0, 0) and missing student ids NaN. Friends count when they are
+    students of the wave (ability looked up on the student's last row);
+    with no such friend both values are NaN. All abilities are computed
+    at once on a (students x slots x abilities) array.
+    '''
+
+    df = df.copy()
+
+    table = student_row_table(df, keep="last")
+    codes = ability_codes(df, [f"high_{a}" for a in abilities])
+
+    own = student_rows(table, df["fs_student_id"])
+    missing = (own < 0)[:, None]
+    high = lookup_ability(codes, own) == 1     # (students, abilities)
+
+    for friend_type, friend_cols in INTER_ABILITY_FRIEND_TYPES.items():
+        friends = student_rows(table, df[friend_cols])
+        valid = friends >= 0                   # (students, slots)
+        n_valid = valid.sum(axis=1)[:, None]
+        high_friends = (lookup_ability(codes, friends) == 1).sum(axis=1)
+
+        undefined = missing | (~high & (n_valid == 0))
+        indicator = np.where(undefined, np.nan, np.where(high, 0, high_friends > 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percentage = np.where(undefined, np.nan, np.where(high, 0, high_friends / n_valid))
+
+        for j, ability_name in enumerate(abilities):
+            # Integer columns when no value is missing (and, for the share,
+            # when every student is high), as the row-wise version produced.
+            df[f"lowhigh_inter_{friend_type}_{ability_name}"] = (
+                indicator[:, j] if undefined[:, j].any() else indicator[:, j].astype(np.int64))
+            df[f"lowhigh_inter_{friend_type}_{ability_name}_perc"] = (
+                percentage[:, j] if not high[:, j].all() else percentage[:, j].astype(np.int64))
+
+    # Same column order as the row-wise version (ability, then friend type)
+    new_cols = [f"lowhigh_inter_{t}_{a}{p}" for a in abilities
+                for t in INTER_ABILITY_FRIEND_TYPES for p in ("", "_perc")]
+
+    return df[[c for c in df.columns if c not in new_cols] + new_cols]
@@ -0,0 +1,263 @@
+'''
+Benchmarks of the datafy functions and of every metric (the computation
+behind each script in py-files/, see roc_network.METRICS) on synthetic
+waves of growing size (see synthetic_waves.py).
+
+Each target is timed (wall and CPU time, median of --repeat runs) and
+then run once more under tracemalloc for its peak memory. Results are
+written as a JSON list or CSV table of records tagged with the git
+commit, so runs on two commits can be compared:
+
+    python py-files/benchmark.py run --sizes 1k,10k,100k --output bench-base.json
+    python py-files/benchmark.py run --sizes 1k,10k,100k --output bench-new.json
+    python py-files/benchmark.py compare bench-base.json bench-new.json
+
+A target slower than --budget seconds at one size is skipped at the
+larger ones (status 'skipped'), so a 10M run does not stall on the
+row-wise metrics.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import datafy
+from ingest import load_wave
+from metric_cache import metric_cache_disabled
+from nomination_graph import build_nomination_graph
+from roc_network import METRICS, WAVE_FILE
+from synthetic_waves import generate_wave
+
+
+def parse_size(text: str) -> int:
+
+    '''
+    '10k' -> 10000, '1M' -> 1000000, '2500' -> 2500.
+    '''
+
+    text = text.strip()
+    scale = {'k': 10 ** 3, 'K': 10 ** 3, 'm': 10 ** 6, 'M': 10 ** 6}.get(text[-1:], 1)
+
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def git_commit() -> str:
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def measure(fn, repeat: int) -> dict:
+
+    '''
+    Median and minimum wall time, median CPU time, then peak traced
+    memory of a separate run.
+    '''
+
+    wall, cpu = [], []
+    for _ in range(repeat):
+        w, c = time.perf_counter(), time.process_time()
+        result = fn()
+        wall.append(time.perf_counter() - w)
+        cpu.append(time.process_time() - c)
+    del result
+
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    rows = len(result[0] if isinstance(result, tuple) else result) if result is not None else None
+
+    return {'wall_s': statistics.median(wall), 'wall_min_s': min(wall),
+            'cpu_s': statistics.median(cpu), 'peak_mb': peak / 2 ** 20, 'rows_out': rows}
+
+
+def wave_targets(wave: str, path: str, out_dir: str) -> list:
+
+    '''
+    (target name, function) pairs for a synthetic wave written at `path`.
+    Targets run in order and later ones reuse the earlier parses.
+    '''
+
+    state = {}
+
+    def load():
+        state['ds'] = load_wave(path)
+        return state['ds']
+
+    def graph():
+        state['graph'] = build_nomination_graph(state['ds'])
+        return state['graph'].student_ids
+
+    targets = [('load', load), ('graph', graph)]
+
+    if wave == 'endline':
+        def paired():
+            state['paired'] = datafy.get_paired_ds(state['ds'], 'friend_')
+            return state['paired']
+
+        def reciprocal():
+            state['reciprocal'] = datafy.get_reciprocal_friendship_ds(state['paired'])
+            return state['reciprocal']
+
+        targets += [
+            ('datafy.get_isolated_child_inwards_per_class',
+             lambda: datafy.get_isolated_child_inwards_per_class(state['ds'], 'friend_')),
+            ('datafy.get_paired_ds', paired),
+            ('datafy.get_reciprocal_friendship_ds', reciprocal),
+            ('datafy.get_reciprocity_total_nominations_frak',
+             lambda: datafy.get_reciprocity_total_nominations_frak(state['paired'], state['reciprocal'])),
+            ('datafy.get_isolated_outwards_info',
+             lambda: datafy.get_isolated_outwards_info(state['ds'], 'friend_')),
+        ]
+
+    columns = pd.read_csv(path, nrows=0).columns
+    for name, spec in METRICS.items():
+        if any(c not in columns for c in spec['requires']):
+            continue
+
+        def metric(spec=spec, output=os.path.join(out_dir, f'{name}.csv')):
+            inputs = [state['ds'] if i == 'ds' else state['graph'] for i in spec['inputs']]
+            result = spec['compute'](wave, *inputs)
+            result.to_csv(output, index=False)
+            return result
+
+        targets.append((f'metric.{name}', metric))
+
+    return targets
+
+
+def run_benchmarks(sizes: list, waves: list, repeat: int = 3, budget: float = 60.0,
+                   seed: int = 0, log=print) -> list:
+
+    '''
+    Benchmark every target on synthetic waves of each size. Returns the
+    list of result records.
+    '''
+
+    context = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+    records, too_slow = [], set()
+    with tempfile.TemporaryDirectory() as tmp, metric_cache_disabled():
+        for n in sorted(sizes):
+            for wave in waves:
+                path = os.path.join(tmp, WAVE_FILE.format(wave=wave))
+                generate_wave(wave, n, seed=seed).to_csv(path, index=False)
+
+                for target, fn in wave_targets(wave, path, tmp):
+                    record = dict(context, n_students=n, wave=wave, target=target, repeat=repeat)
+                    # Parses the later targets depend on always run
+                    if (wave, target) in too_slow and target not in ('load', 'graph'):
+                        records.append(dict(record, status='skipped'))
+                        continue
+
+                    record.update(measure(fn, repeat), status='ok')
+                    records.append(record)
+                    log(f"{wave:<10} {n:>10,} {target:<50} {record['wall_s']:9.3f} s "
+                        f"{record['peak_mb']:9.1f} MB")
+                    if record['wall_s'] > budget:
+                        too_slow.add((wave, target))
+
+    return records
+
+
+def write_records(records: list, path: str):
+
+    if path.endswith('.csv'):
+        pd.DataFrame(records).to_csv(path, index=False)
+    else:
+        with open(path, 'w') as f:
+            json.dump(records, f, indent=1)
+
+
+def read_records(path: str) -> pd.DataFrame:
+
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    with open(path) as f:
+        return pd.DataFrame(json.load(f))
+
+
+def compare(base_path: str, new_path: str) -> pd.DataFrame:
+
+    '''
+    Per (wave, target, size): wall time and peak memory of both runs and
+    their new/base ratios.
+    '''
+
+    keys = ['wave', 'target', 'n_students']
+    base = read_records(base_path)
+    new = read_records(new_path)
+    base, new = (r[r['status'] == 'ok'][keys + ['wall_s', 'peak_mb']] for r in (base, new))
+    merged = base.merge(new, on=keys, suffixes=('_base', '_new'))
+    merged['wall_ratio'] = merged['wall_s_new'] / merged['wall_s_base']
+    merged['peak_ratio'] = merged['peak_mb_new'] / merged['peak_mb_base']
+
+    return merged.sort_values(keys).reset_index(drop=True)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='benchmark', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='benchmark all targets on synthetic waves')
+    run.add_argument('--sizes', default='1k,10k,100k',
+                     help="comma-separated numbers of students, e.g. '1k,100k,1M,10M'")
+    run.add_argument('--waves', default='endline,follow_up')
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--budget', type=float, default=60.0,
+                     help='skip a target at larger sizes once it takes longer than this (seconds)')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', default='bench.json', help='.json or .csv results file')
+
+    cmp = commands.add_parser('compare', help='compare two result files')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--output', help='also write the comparison as CSV')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        table = compare(args.base, args.new)
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(table)
+        if args.output:
+            table.to_csv(args.output, index=False)
+        return
+
+    records = run_benchmarks([parse_size(s) for s in args.sizes.split(',')],
+                             args.waves.split(','), args.repeat, args.budget, args.seed)
+    write_records(records, args.output)
+    print(f"Done. {len(records)} results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
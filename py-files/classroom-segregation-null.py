@@ -0,0 +1,21 @@
+from segregation_null import simulate_cross_ability_null
+from ingest import load_wave
+from profiling import stage
+
+# Guarded: the simulation runs classrooms in worker processes
+if __name__ == "__main__":
+
+    # 1) Load the follow-up wave
+    df = load_wave("/workspaces/ROC-network-analysis/input-files/roc_network_data_follow_up.csv")
+
+    # 2) Per classroom: observed cross-ability ratio against 10,000 random rewirings
+    #    of the emotional nominations (same classroom, same number of nominations)
+    final_df = simulate_cross_ability_null(df, n_draws=10000, seed=0)
+
+    # 3) Write to CSV
+    with stage("to_csv", rows=len(final_df)):
+        final_df.to_csv("/workspaces/ROC-network-analysis/output-files/classroom_segregation_null.csv", index=False)
+
+    print("Done. 'classroom_segregation_null.csv' saved.")
+    print("Sample output:")
+    print(final_df.head())
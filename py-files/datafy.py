@@ -5,7 +5,12 @@ final manipulated dataset, after validation tools have been run.
 
 import pandas as pd
 
+from metric_cache import cached_metric
+from profiling import profiled
 
+
+@profiled()
+@cached_metric()
 def get_isolated_child_inwards_per_class(ds: pd.DataFrame,
                                       #get_peers_outside_class_warning,
                                       target_variable:str):
@@ -25,47 +30,50 @@ def get_isolated_child_inwards_per_class(ds: pd.DataFrame,
     #   print("The calculations will be performed anyways. Check input dataset.")
 
     import numpy as np
-    import itertools
     import pandas as pd
+    from nomination_graph import build_nomination_graph
 
-    num_nodes = [1,2,3]
-    isolated_students_list = []
+    graph = build_nomination_graph(ds, relations={target_variable: target_variable})
 
-    classIdsKeys= [c for c in ds.classroom_id.unique()]
-    classDct = dict(zip(classIdsKeys, [None]*len(classIdsKeys)))
+    # In-degree once over the edge array: nominations from other peers of
+    # the same class (self-nominations do not count).
+    src, dst = graph.edges(target_variable, within_classroom=True)
+    other = src != dst
+    in_degree = np.bincount(dst[other], minlength=graph.n_nodes)
 
-    for c in ds.classroom_id.unique():
-        isolated_peer_count = 0
-        class_ = ds[ds['classroom_id']==c]
-        # Assumed that each student_id is unique per row
-        class_composition = [s for s in class_.student_id.unique()]
-        class_size = len(class_composition)
+    ## Making sure isolation is defined per class.
+    class_digit = ds['classroom_id'].astype(str).str[3].to_numpy()
+    student_digit = ds['student_id'].astype(str).str[3].to_numpy()
+    same_class_digit = class_digit[graph.first_row] == student_digit[graph.first_row]
 
-        for s in class_composition:
-                fl = []
-                for n in num_nodes:
-                        i = class_[class_['student_id']!=s][f'{target_variable}{n}'].dropna().to_list()
-                        fl.append(i)
+    isolated = (in_degree == 0) & same_class_digit
 
-                other_peers = set(list(itertools.chain(*fl)))
+    # Already percentages.
+    isolated_frak = np.round(graph.classroom_sum(isolated)/graph.classroom_sizes(),6)
 
-                ## Making sure isolation is defined per class.
-                if s not in other_peers and float(str(c)[3])==float(str(s)[3]):
-                        isolated_students_list.append(s)
-                        isolated_peer_count +=1
-            # Already percentages.
-        classDct[c] = np.round(isolated_peer_count/class_size,6)
+    # Keep the order in which classes and students appear in ds.
+    rows = np.flatnonzero(graph.row_node >= 0)
+    _, class_first_row = np.unique(graph.node_classroom[graph.row_node[rows]], return_index=True)
+    class_first_row = rows[class_first_row]
+    class_order = np.argsort(class_first_row, kind='stable')
+    class_rank = np.empty_like(class_order)
+    class_rank[class_order] = np.arange(len(class_order))
 
-    isolated_frak_ds = pd.DataFrame({'classroom_id': classDct.keys(),'isolated_f_%': classDct.values()})
+    isolated_nodes = np.flatnonzero(isolated)
+    isolated_nodes = isolated_nodes[np.lexsort((graph.first_row[isolated_nodes],
+                                                class_rank[graph.node_classroom[isolated_nodes]]))]
 
-    isolated_frak_ds = pd.DataFrame({'classroom_id': classDct.keys(),'isolated_f_%': classDct.values()})
+    isolated_frak_ds = pd.DataFrame({'classroom_id': ds['classroom_id'].to_numpy()[class_first_row[class_order]],
+                                     'isolated_f_%': isolated_frak[class_order]})
 
-    isolated_student_id_df = pd.DataFrame(isolated_students_list,columns=['student_id'])
+    isolated_student_id_df = pd.DataFrame(ds['student_id'].to_numpy()[graph.first_row[isolated_nodes]],columns=['student_id'])
     isolated_student_id_df[f'inwards_isolation_flag_{target_variable}']=1
 
     return isolated_frak_ds,isolated_student_id_df
 
 
+@profiled()
+@cached_metric()
 def get_paired_ds(ds:pd.DataFrame,
                   target_variable:str) -> pd.DataFrame:
 
@@ -75,31 +83,26 @@ def get_paired_ds(ds:pd.DataFrame,
     '''
 
     import numpy as np
-    import math
-    import itertools
     import pandas as pd
+    from nomination_graph import nomination_columns
 
-    num_nodes = [1,2,3]
-    #Indeed a pair but need to track class.
-    start_end_nodes_ds = []
-
-    for _, row in ds.iterrows():
-        start_node = row['student_id']
-        c = row['classroom_id']
+    target_columns = nomination_columns(ds.columns, target_variable)
+    end_nodes = ds[target_columns].to_numpy(dtype='float64', na_value=np.nan)
 
-        for n in num_nodes:
-            end_node = [row[f'{target_variable}{n}']][0]
+    #To be pair IFF end node is not void. Row-major order keeps, per student,
+    #the slot order of the nominations.
+    rows, _ = np.nonzero(~np.isnan(end_nodes))
 
-            #To be pair IFF end node is not void.
-            if not math.isnan(end_node):
-                triple = (c,start_node,end_node)
-                start_end_nodes_ds.append(triple)
-
-    start_end_nodes_ds = pd.DataFrame(start_end_nodes_ds,columns=['classroom_id','start_node','end_node'])
+    #Indeed a pair but need to track class.
+    start_end_nodes_ds = pd.DataFrame({'classroom_id': ds['classroom_id'].to_numpy()[rows],
+                                       'start_node': ds['student_id'].to_numpy()[rows],
+                                       'end_node': end_nodes[~np.isnan(end_nodes)]})
 
     return start_end_nodes_ds
 
 
+@profiled()
+@cached_metric()
 def get_reciprocal_friendship_ds(paired_ds: pd.DataFrame) -> pd.DataFrame:
 
     '''
@@ -108,26 +111,39 @@ def get_reciprocal_friendship_ds(paired_ds: pd.DataFrame) -> pd.DataFrame:
     means cardinality is doubled per each row).
     '''
 
+    import numpy as np
     import pandas as pd
 
-    # Find reciprocal pairs
-    reciprocal_pairs = []
-    visited = set()
-
-    for _, row in paired_ds.iterrows():
-        start_node = row['start_node']
-        end_node = row['end_node']
-        pair = (start_node, end_node)
-        reverse_pair = (end_node, start_node)
-
-        if reverse_pair in visited:
-            reciprocal_pairs.append(pair)
-
-        visited.add(pair)
-
-    reciprocal_pairs_df = pd.DataFrame(reciprocal_pairs, columns=['start_node', 'end_node'])
-    reciprocal_pairs_df = reciprocal_pairs_df.merge(paired_ds, on=['start_node', 'end_node'])
-    reciprocal_pairs_df = reciprocal_pairs_df[['classroom_id','start_node','end_node']]
+    # Pack each (start_node, end_node) pair into one int64 key over dense
+    # node codes (10-digit ids do not fit two to an int64).
+    start, end = paired_ds['start_node'].to_numpy(), paired_ds['end_node'].to_numpy()
+    nodes, codes = np.unique(np.concatenate([start, end]), return_inverse=True)
+    start_code, end_code = codes[:len(start)].astype(np.int64), codes[len(start):].astype(np.int64)
+    keys = start_code*len(nodes) + end_code
+    reverse_keys = end_code*len(nodes) + start_code
+
+    # A pair is reciprocal when its reverse pair was already visited, i.e. the
+    # first occurrence of the reverse key comes before it.
+    unique_keys, first_seen = np.unique(keys, return_index=True)
+    pos = np.minimum(np.searchsorted(unique_keys, reverse_keys), max(len(unique_keys)-1,0))
+    found = unique_keys[pos] == reverse_keys if len(unique_keys) else np.zeros(len(keys), bool)
+    reciprocal = np.flatnonzero(found & (first_seen[pos] < np.arange(len(keys))))
+
+    # Join back on (start_node, end_node) to recover classroom_id: every
+    # reciprocal pair matches all the paired_ds rows with the same key.
+    sorter = np.argsort(keys, kind='stable')
+    lo = np.searchsorted(keys[sorter], keys[reciprocal], side='left')
+    hi = np.searchsorted(keys[sorter], keys[reciprocal], side='right')
+    counts = hi - lo
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    matched = sorter[np.repeat(lo, counts) + offsets]
+
+    # Nodes take the common dtype of a paired_ds row (float64 as soon as one
+    # column is float, e.g. end_node), as when pairs were read row by row.
+    node_dtype = paired_ds.iloc[:0].to_numpy().dtype
+    reciprocal_pairs_df = pd.DataFrame({'classroom_id': paired_ds['classroom_id'].to_numpy()[matched],
+                                        'start_node': np.repeat(start[reciprocal], counts).astype(node_dtype),
+                                        'end_node': np.repeat(end[reciprocal], counts).astype(node_dtype)})
 
     # Assuming that each individual does not write more than one a friend at each row, given
     # reciprocity.
@@ -136,6 +152,8 @@ def get_reciprocal_friendship_ds(paired_ds: pd.DataFrame) -> pd.DataFrame:
     return reciprocal_pairs_df
 
 
+@profiled()
+@cached_metric()
 def get_reciprocity_total_nominations_frak(paired_ds: pd.DataFrame,
                                            reciprocity_ds: pd.DataFrame
                                            ) -> pd.DataFrame:
@@ -169,52 +187,40 @@ def get_reciprocity_total_nominations_frak(paired_ds: pd.DataFrame,
     return class_size_df
 
 
+@profiled()
+@cached_metric()
 def get_isolated_outwards_info(ds: pd.DataFrame,
-                         target_variable:str) -> pd.DataFrame:   
+                         target_variable:str) -> pd.DataFrame:
+
+    '''
+    Computes, per class, the number and share of students who do not
+    nominate anyone on target_variable (all `{target_variable}{n}` slots
+    empty, whatever the number of slots), plus the list of those students.
+    A student listed on several rows is judged on its first row.
+    '''
 
     import pandas as pd
+    from nomination_graph import nomination_columns
 
-    meas_dict = {
-        "classroom_id": [],
-        "student_count": [],
-        "isolated_o": [],
-        "isolated_share_o":[]
-        }
-    
-    isolated_students_dict = {
-    "classroom_id": [],
-    "student_id": []
-    }
-    
-    numb_nodes = [1, 2, 3]
-
-    for class_id in list(ds.classroom_id.unique()):
-        view_0, student_list= ds[ds.loc[:,'classroom_id']==class_id], list(ds[ds.loc[:,'classroom_id']==class_id].student_id.unique())
-        isolated_count,student_count = 0,len(student_list)
-        for s in student_list:
-            view_1 = view_0[view_0.loc[:,'student_id']==s]
-            if sum([[view_1[f'{target_variable}{n}'].isna() for n in numb_nodes][0].reset_index(drop=True)[0] for n in numb_nodes]) == max(numb_nodes):
-                isolated_count += 1
-                for keys in isolated_students_dict:
-                    if keys =='classroom_id': 
-                        isolated_students_dict[keys].append(class_id)
-                    elif keys =='student_id':
-                        isolated_students_dict[keys].append(s)
-
-        for keys in meas_dict:
-            if keys =='classroom_id': 
-                meas_dict[keys].append(class_id)
-            elif keys =='student_count': 
-                meas_dict[keys].append(student_count)
-            elif keys =='isolated_o': 
-                meas_dict[keys].append(isolated_count)
-            else:
-                meas_dict[keys].append(0)
-
-    output_df = pd.DataFrame.from_dict(meas_dict)
+    target_columns = nomination_columns(ds.columns, target_variable)
+
+    students = ds[['classroom_id','student_id']].copy()
+    students['isolated_o'] = ds[target_columns].isna().all(axis=1)
+    students = students.dropna(subset=['classroom_id','student_id'])
+    students = students.drop_duplicates(subset=['classroom_id','student_id'])
+
+    grouped = students.groupby('classroom_id', sort=False)
+
+    output_df = pd.DataFrame({
+        "student_count": grouped.size(),
+        "isolated_o": grouped['isolated_o'].sum(),
+        "isolated_share_o": 0
+        }).reset_index()
     output_df["isolated_share_o"]=output_df["isolated_o"]/output_df["student_count"]
 
-    output_df_isolated_o = pd.DataFrame.from_dict(isolated_students_dict)
+    # Isolated students listed class by class, in order of appearance.
+    students = students.iloc[pd.factorize(students['classroom_id'])[0].argsort(kind='stable')]
+    output_df_isolated_o = students.loc[students['isolated_o'],['classroom_id','student_id']].reset_index(drop=True)
 
     return output_df,output_df_isolated_o
 ## END
\ No newline at end of file
@@ -0,0 +1,246 @@
+'''
+Metrics computed on the compiled nomination graph (see
+nomination_graph.py). Each function takes a NominationGraph (and the
+wave DataFrame where per-row output is needed) and returns the
+DataFrame the corresponding script writes to output-files/.
+'''
+
+import numpy as np
+import pandas as pd
+
+from nomination_graph import NominationGraph, nomination_columns, sorted_unique
+from packed_adjacency import MAX_WORDS, PackedAdjacency, n_words
+from profiling import profiled
+
+
+# Holland-Leinhardt triad types, in the usual census order.
+TRIAD_TYPES = ('003', '012', '102', '021D', '021U', '021C', '111D', '111U',
+               '030T', '030C', '201', '120D', '120U', '120C', '210', '300')
+
+# Triad type (1-based position in TRIAD_TYPES) of each 6-bit code of a
+# triad (v, u, w): v->u = 1, u->v = 2, v->w = 4, w->v = 8, u->w = 16,
+# w->u = 32 (Batagelj & Mrvar, 2001).
+TRICODES = (1, 2, 2, 3, 2, 4, 6, 8, 2, 6, 5, 7, 3, 8, 7, 11, 2, 6, 4, 8, 5, 9,
+            9, 13, 6, 10, 9, 14, 7, 14, 12, 15, 2, 5, 6, 7, 6, 9, 10, 14, 4, 9,
+            9, 12, 8, 13, 14, 15, 3, 7, 8, 11, 7, 12, 14, 15, 8, 14, 13, 15,
+            11, 15, 15, 16)
+
+
+def locate(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+
+    '''
+    Position of each value in the sorted key array `keys`, -1 if absent.
+    '''
+
+    if len(keys) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+
+    return np.where(keys[pos] == values, pos, -1)
+
+
+def contains(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+
+    '''
+    Flag the values present in the sorted key array `keys`.
+    '''
+
+    return locate(keys, values) >= 0
+
+
+def reciprocated_mask(graph: NominationGraph, src, dst) -> np.ndarray:
+
+    '''
+    Flag the ties (src[i], dst[i]) whose reverse tie is also present.
+    Ties are matched on packed int64 (src, dst) keys.
+    '''
+
+    n = graph.n_nodes
+    keys = sorted_unique(src.astype(np.int64) * n + dst)
+
+    return contains(keys, dst.astype(np.int64) * n + src)
+
+
+def neighbours(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray):
+
+    '''
+    CSR rows of `nodes`, flattened: (position in `nodes`, neighbour) pairs.
+    '''
+
+    counts = indptr[nodes + 1] - indptr[nodes]
+    owner = np.repeat(np.arange(len(nodes)), counts)
+    starts = np.repeat(indptr[nodes] - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+
+    return owner, indices[starts + np.arange(len(owner))]
+
+
+@profiled()
+def isolation_reciprocity(graph: NominationGraph,
+                          relations=None) -> pd.DataFrame:
+
+    '''
+    Per classroom: share of students nominated by nobody
+    (`isolate_in_{r}`) and share of ties that are reciprocated
+    (`reciprocity_share_{r}`), `r` being the first letter of the
+    relation. Only ties within the nominator's classroom count,
+    repeated ties are counted once and self-nominations are dropped.
+
+    Classrooms are bit-packed (see packed_adjacency.py) unless one is too
+    large, in which case ties are matched on packed (src, dst) keys.
+    '''
+
+    relations = list(relations or graph.relations)
+    sizes = graph.classroom_sizes()
+    out = {graph.schema['classroom']: graph.classroom_ids}
+    packed = n_words(graph) <= MAX_WORDS
+
+    isolated, reciprocity = {}, {}
+    for relation in relations:
+        if packed:
+            bits = PackedAdjacency.from_graph(graph, relation)
+            nominated = ~bits.in_isolated()
+            ties = graph.classroom_sum(bits.out_degree())
+            mutual = graph.classroom_sum(bits.reciprocated())
+        else:
+            src, dst = graph.edges(relation, within_classroom=True, unique=True, drop_self=True)
+            nominated = np.bincount(dst, minlength=graph.n_nodes) > 0
+            ties = np.bincount(graph.node_classroom[src], minlength=graph.n_classrooms)
+            mutual = np.bincount(graph.node_classroom[src], weights=reciprocated_mask(graph, src, dst),
+                                 minlength=graph.n_classrooms)
+
+        not_nominated = graph.classroom_sum(~nominated)
+        isolated[relation] = np.where(sizes > 0, not_nominated / np.maximum(sizes, 1), 0)
+        reciprocity[relation] = np.where(ties > 0, mutual / np.maximum(ties, 1), 0)
+
+    for relation in relations:
+        out[f'isolate_in_{relation[0]}'] = isolated[relation]
+    for relation in relations:
+        out[f'reciprocity_share_{relation[0]}'] = reciprocity[relation]
+
+    return pd.DataFrame(out)
+
+
+@profiled()
+def isolatedness(ds: pd.DataFrame,
+                 graph: NominationGraph,
+                 relations=None) -> pd.DataFrame:
+
+    '''
+    Per student row, appended to a copy of `ds`:
+    `isolated_{relation}_in` is 1 if nobody nominates the student and
+    `isolated_{relation}_out` is 1 if the student nominates nobody.
+    '''
+
+    relations = list(relations or graph.relations)
+    out = ds.copy()
+    row_node = graph.row_node
+    known = row_node >= 0
+
+    for relation in relations:
+        nominated = graph.in_degree(relation) > 0
+        out[f'isolated_{relation}_in'] = np.where(known, ~nominated[row_node], True).astype(int)
+
+    for relation in relations:
+        cols = nomination_columns(ds.columns, graph.schema['relations'][relation])
+        out[f'isolated_{relation}_out'] = ds[cols].isnull().all(axis=1).astype(int)
+
+    return out
+
+
+@profiled()
+def triad_census(graph: NominationGraph,
+                 relations=None) -> pd.DataFrame:
+
+    '''
+    Per classroom and relation: the dyad census (`dyad_mutual_{r}`,
+    `dyad_asymmetric_{r}`, `dyad_null_{r}`), the 16-type triad census
+    (`triad_{type}_{r}`, see TRIAD_TYPES) and the transitivity of the
+    undirected ties (closed over connected triples). Only ties within the
+    nominator's classroom count, repeated ties are counted once and
+    self-nominations are dropped (a triad has three distinct students).
+
+    All classrooms are done at once on packed int64 (src, dst) keys,
+    visiting only the triads that contain a tie (Batagelj & Mrvar, 2001);
+    the empty triads (003) are the remainder.
+    '''
+
+    relations = list(relations or graph.relations)
+    n = graph.n_nodes
+    sizes = graph.classroom_sizes().astype(np.int64)
+    node_size = sizes[graph.node_classroom]
+    tricodes = np.array(TRICODES, dtype=np.int64) - 1
+    out = {graph.schema['classroom']: graph.classroom_ids}
+
+    for relation in relations:
+        # 1) Undirected pairs (a < b) as sorted keys, with the direction
+        #    of their ties: 1 for a -> b, 2 for b -> a, 3 for both
+        src, dst = graph.edges(relation, within_classroom=True, unique=True, drop_self=True)
+        src, dst = src.astype(np.int64), dst.astype(np.int64)
+        ties = np.sort((np.minimum(src, dst) * n + np.maximum(src, dst)) * 4 + np.where(src < dst, 1, 2))
+        new_pair = np.ones(len(ties), dtype=bool)
+        new_pair[1:] = ties[1:] >> 2 != ties[:-1] >> 2
+        pairs = ties[new_pair] >> 2
+        direction = np.bincount(np.cumsum(new_pair) - 1, weights=ties & 3,
+                                minlength=len(pairs)).astype(np.int64)
+        a, b = pairs // n, pairs % n
+        mutual = direction == 3
+
+        pair_classroom = graph.node_classroom[a]
+        n_pairs = np.bincount(pair_classroom, minlength=graph.n_classrooms)
+        n_mutual = np.bincount(pair_classroom, weights=mutual, minlength=graph.n_classrooms)
+        out[f'dyad_mutual_{relation}'] = n_mutual.astype(np.int64)
+        out[f'dyad_asymmetric_{relation}'] = (n_pairs - n_mutual).astype(np.int64)
+        out[f'dyad_null_{relation}'] = sizes * (sizes - 1) // 2 - n_pairs
+
+        # 2) Undirected neighbourhoods
+        ends = np.concatenate([a, b])
+        order = np.argsort(ends, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(ends, minlength=n))
+        adjacent = np.concatenate([b, a])[order]
+
+        # 3) Third nodes of each pair: neighbours of a or b, once each
+        pair_a, w_a = neighbours(indptr, adjacent, a)
+        pair_b, w_b = neighbours(indptr, adjacent, b)
+        third = sorted_unique(np.concatenate([pair_a, pair_b]) * n + np.concatenate([w_a, w_b]))
+        pair, w = third // n, third % n
+        keep = (w != a[pair]) & (w != b[pair])
+        pair, w = pair[keep], w[keep]
+
+        census = np.zeros((graph.n_classrooms, len(TRIAD_TYPES)), dtype=np.int64)
+
+        # 4) Triads with a single tied pair: the pair and any node tied to neither
+        lone = node_size[a] - 2 - np.bincount(pair, minlength=len(pairs))
+        census[:, 1] = np.bincount(pair_classroom, weights=lone * ~mutual, minlength=graph.n_classrooms)
+        census[:, 2] = np.bincount(pair_classroom, weights=lone * mutual, minlength=graph.n_classrooms)
+
+        # 5) Connected triads, each visited from one of its pairs only,
+        #    coded from the directions of their three pairs (see TRICODES)
+        v, u = a[pair], b[pair]
+        vw = locate(pairs, np.minimum(v, w) * n + np.maximum(v, w))
+        first = (w > u) | ((w > v) & (w < u) & (vw < 0))
+        pair, v, u, w, vw = pair[first], v[first], u[first], w[first], vw[first]
+        uw = locate(pairs, np.minimum(u, w) * n + np.maximum(u, w))
+        # Direction bits seen from the first node of each pair
+        vw = np.where(vw >= 0, direction[vw], 0)
+        uw = np.where(uw >= 0, direction[uw], 0)
+        vw = np.where(v < w, vw, (vw & 1) << 1 | vw >> 1)
+        uw = np.where(u < w, uw, (uw & 1) << 1 | uw >> 1)
+        code = direction[pair] + vw * 4 + uw * 16
+        census += np.bincount(graph.node_classroom[v] * len(TRIAD_TYPES) + tricodes[code],
+                              minlength=graph.n_classrooms * len(TRIAD_TYPES)
+                              ).reshape(graph.n_classrooms, len(TRIAD_TYPES))
+        census[:, 0] = sizes * (sizes - 1) * (sizes - 2) // 6 - census[:, 1:].sum(axis=1)
+
+        for k, triad in enumerate(TRIAD_TYPES):
+            out[f'triad_{triad}_{relation}'] = census[:, k]
+
+        # 6) Transitivity: each closed triad holds three connected triples
+        closed = census[:, [TRIAD_TYPES.index(t) for t in
+                            ('030T', '030C', '120D', '120U', '120C', '210', '300')]].sum(axis=1)
+        open_ = census[:, [TRIAD_TYPES.index(t) for t in
+                           ('021D', '021U', '021C', '111D', '111U', '201')]].sum(axis=1)
+        triples = 3 * closed + open_
+        out[f'transitivity_{relation}'] = np.where(triples > 0, 3 * closed / np.maximum(triples, 1), 0)
+
+    return pd.DataFrame(out)
@@ -0,0 +1,273 @@
+'''
+Incremental recomputation after a correction batch.
+
+The input a set of outputs was computed from is kept as a snapshot next
+to the outputs, written by every run, batch and update that writes them
+(see sync_snapshot). On update, the new input is diffed against the snapshot
+by student key (s_merge_id when the file has it, else the student id):
+the classrooms of every changed, added or removed student, and the
+classrooms nominating one of them, are affected. Per-classroom outputs
+(METRICS entries with `per_classroom`) are recomputed on just the rows
+those classrooms depend on and patched in place; other outputs are
+recomputed in full.
+
+Usage:
+    python py-files/roc_network.py update --wave follow_up
+'''
+
+import io
+import os
+
+import pandas as pd
+
+from ingest import read_wave
+from metric_cache import metric_cache_disabled
+from nomination_graph import build_nomination_graph, detect_schema, nomination_columns
+from roc_network import METRICS, output_names, process_file, variant_of
+
+
+SNAPSHOT_DIR = '.roc_snapshot'
+
+
+def snapshot_path(input_path: str, output_dir: str) -> str:
+
+    '''
+    Snapshot of `input_path` for the outputs in `output_dir`:
+    `<output_dir>/.roc_snapshot/<input name>.arrow` (`.pkl` without pyarrow).
+    '''
+
+    try:
+        import pyarrow  # noqa: F401
+        ext = 'arrow'
+    except ImportError:
+        ext = 'pkl'
+
+    return os.path.join(output_dir, SNAPSHOT_DIR, f'{os.path.basename(input_path)}.{ext}')
+
+
+def save_snapshot(ds: pd.DataFrame, path: str):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if path.endswith('.arrow'):
+        import pyarrow.feather as feather
+        feather.write_feather(ds, tmp, compression='uncompressed')
+    else:
+        ds.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path: str) -> pd.DataFrame:
+
+    if path.endswith('.arrow'):
+        import pyarrow.feather as feather
+        return feather.read_table(path).to_pandas()
+
+    return pd.read_pickle(path)
+
+
+def sync_snapshot(input_path: str, ds: pd.DataFrame, output_dir: str, written: list):
+
+    '''
+    Keep the snapshot of `input_path` in step with the outputs in
+    `output_dir` after `written` were computed from `ds`. The snapshot is
+    replaced when every existing output of the input was just written;
+    otherwise the other outputs still reflect the snapshot, which is
+    dropped if `ds` differs from it (the next update recomputes in full).
+    '''
+
+    variant = variant_of(input_path)
+    snapshot = snapshot_path(input_path, output_dir)
+    existing = {os.path.join(output_dir, name) for m in METRICS for name in output_names(m, variant)}
+    existing = {path for path in existing if os.path.exists(path)}
+
+    if existing <= set(written):
+        save_snapshot(ds, snapshot)
+    elif os.path.exists(snapshot):
+        try:
+            stale = len(affected_classrooms(load_snapshot(snapshot), ds)) > 0
+        except ValueError:
+            stale = True
+        if stale:
+            os.remove(snapshot)
+
+
+def drop_snapshot(input_path: str, output_dir: str):
+
+    '''
+    Remove the snapshot of `input_path`, for outputs written without
+    reading the whole input (streaming).
+    '''
+
+    snapshot = snapshot_path(input_path, output_dir)
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+
+
+def student_key(columns) -> str:
+
+    '''
+    Column identifying a student row across versions of a wave file.
+    '''
+
+    return 's_merge_id' if 's_merge_id' in columns else detect_schema(columns)['student']
+
+
+def nomination_slots(ds: pd.DataFrame) -> list:
+
+    schema = detect_schema(ds.columns)
+
+    return [c for prefix in schema['relations'].values()
+            for c in nomination_columns(ds.columns, prefix)]
+
+
+def changed_keys(old: pd.DataFrame, new: pd.DataFrame, key: str) -> pd.Index:
+
+    '''
+    Student keys whose rows differ between `old` and `new` (added,
+    removed or edited). Rows are compared as multisets of row hashes per
+    key, so duplicated students are handled too.
+    '''
+
+    def row_counts(ds):
+        hashes = pd.util.hash_pandas_object(ds, index=False)
+        return pd.DataFrame({'key': ds[key].to_numpy(), 'hash': hashes.to_numpy()}) \
+                 .value_counts(dropna=False)
+
+    diff = row_counts(old).sub(row_counts(new), fill_value=0)
+
+    return diff[diff != 0].index.get_level_values('key').unique()
+
+
+def affected_classrooms(old: pd.DataFrame, new: pd.DataFrame) -> pd.Index:
+
+    '''
+    Classrooms whose per-classroom metrics can change from `old` to
+    `new`: those of changed students, before and after the change, and
+    those with a row nominating a changed student.
+    '''
+
+    if list(old.columns) != list(new.columns) or not old.dtypes.equals(new.dtypes):
+        raise ValueError('Input columns changed since the snapshot; run a full recompute.')
+
+    schema = detect_schema(new.columns)
+    key = student_key(new.columns)
+    keys = changed_keys(old, new, key)
+    slots = nomination_slots(new)
+
+    classrooms = []
+    for ds in (old, new):
+        changed = ds[key].isin(keys)
+        students = ds.loc[changed, schema['student']].dropna()
+        nominates = ds[slots].isin(students.to_numpy()).any(axis=1)
+        classrooms.append(ds.loc[changed | nominates, schema['classroom']])
+
+    return pd.Index(pd.concat(classrooms).unique())
+
+
+def classroom_rows(ds: pd.DataFrame, classrooms) -> pd.DataFrame:
+
+    '''
+    Rows the metrics of `classrooms` depend on: every row of those
+    classrooms, plus every row of their students and of the students
+    they nominate (abilities and graph membership are looked up by
+    student). Original row order is kept.
+    '''
+
+    schema = detect_schema(ds.columns)
+    in_classrooms = ds[schema['classroom']].isin(classrooms)
+    rows = ds[in_classrooms]
+    students = pd.concat([rows[schema['student']]] +
+                         [rows[c] for c in nomination_slots(ds)]).dropna().unique()
+
+    return ds[in_classrooms | ds[schema['student']].isin(students)]
+
+
+def patch_output(path: str, fresh: pd.DataFrame, classroom: str, classrooms):
+
+    '''
+    Replace the rows of `classrooms` in the output CSV `path` by the rows
+    of `fresh` for those classrooms, keeping the output sorted by classroom.
+    Cells are handled as the text of the CSV (the fresh rows go through
+    to_csv first), so the rows that are kept are written back unchanged,
+    as are ids and floats.
+    '''
+
+    def as_text(source):
+        return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+    out = as_text(path)
+    fresh = fresh[fresh[classroom].isin(classrooms)]
+    if list(fresh.columns) != list(out.columns):
+        raise ValueError(f'Columns of {os.path.basename(path)} changed; run a full recompute.')
+    fresh = as_text(io.StringIO(fresh.to_csv(index=False)))
+
+    patched = pd.to_numeric(pd.Series(classrooms), errors='coerce').dropna()
+    kept = out[~pd.to_numeric(out[classroom], errors='coerce').isin(patched)]
+    out = pd.concat([kept, fresh], ignore_index=True)
+    key = pd.to_numeric(out[classroom], errors='coerce')
+    out = out.iloc[key.sort_values(kind='mergesort', na_position='last').index]
+
+    out.to_csv(path, index=False)
+
+
+def update_outputs(input_path: str, metrics: list, output_dir: str,
+                   skip_inapplicable: bool = True, use_cache: bool = True) -> dict:
+
+    '''
+    Bring the outputs of `metrics` for `input_path` up to date with it.
+    Per-classroom outputs are patched for the affected classrooms when a
+    snapshot and the outputs exist, and nothing is rewritten when the
+    input did not change; everything else is recomputed in full.
+    Returns {output path: number of patched classrooms, or None when it
+    was recomputed in full}.
+    '''
+
+    variant = variant_of(input_path)
+    new = read_wave(input_path, use_cache)
+
+    missing = {m: [c for c in METRICS[m]['requires'] if c not in new.columns] for m in metrics}
+    if not skip_inapplicable and any(missing.values()):
+        m = next(m for m in metrics if missing[m])
+        raise ValueError(f"Metric '{m}' needs columns {missing[m]} "
+                         f"that {os.path.basename(input_path)} does not have.")
+    metrics = [m for m in metrics if not missing[m]]
+
+    snapshot = snapshot_path(input_path, output_dir)
+
+    classrooms = None
+    if os.path.exists(snapshot):
+        try:
+            classrooms = affected_classrooms(load_snapshot(snapshot), new)
+        except ValueError:
+            classrooms = None
+
+    outputs = {os.path.join(output_dir, name): m for m in metrics for name in output_names(m, variant)}
+    unchanged = classrooms is not None and len(classrooms) == 0
+    patchable = [path for path, m in outputs.items()
+                 if classrooms is not None and os.path.exists(path)
+                 and (unchanged or METRICS[m].get('per_classroom'))]
+
+    result = {}
+    if patchable and not unchanged:
+        schema = detect_schema(new.columns)
+        rows = classroom_rows(new, classrooms)
+        graph = build_nomination_graph(rows) if any(
+            'graph' in METRICS[outputs[p]]['inputs'] for p in patchable) else None
+
+        with metric_cache_disabled():
+            for path in patchable:
+                spec = METRICS[outputs[path]]
+                inputs = [rows if i == 'ds' else graph for i in spec['inputs']]
+                patch_output(path, spec['compute'](schema['wave'], *inputs),
+                             schema['classroom'], classrooms)
+    result.update({path: len(classrooms) for path in patchable})
+
+    full = list(dict.fromkeys(m for path, m in outputs.items() if path not in patchable))
+    if full:
+        process_file(input_path, full, output_dir, use_cache=use_cache)
+        result.update({path: None for path, m in outputs.items() if m in full})
+
+    sync_snapshot(input_path, new, output_dir, list(outputs))
+
+    return result
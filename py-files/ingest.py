@@ -0,0 +1,164 @@
+'''
+Typed, cached ingest of the wave files. Each wave is parsed once, its
+ID columns (school, classroom, student and every nomination slot) are
+coerced to nullable Int64 in one vectorized pass, and the typed frame is
+written as an Arrow IPC (Feather) cache next to the input, keyed by the
+input's content hash. Later loads memory-map the cache instead of
+re-parsing the CSV/XLSX.
+'''
+
+import hashlib
+import os
+
+import pandas as pd
+
+from nomination_graph import detect_schema, nomination_columns
+from profiling import profiled
+
+
+CACHE_DIR = '.roc_cache'
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+
+    '''
+    SHA-1 of the file content, read in chunks.
+    '''
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def id_columns(columns) -> list:
+
+    '''
+    ID columns of a wave: school, classroom and student ids plus every
+    nomination slot of every relation.
+    '''
+
+    schema = detect_schema(columns)
+    ids = [schema[k] for k in ('school', 'classroom', 'student') if schema[k] in columns]
+    ids += [c for prefix in schema['relations'].values()
+            for c in nomination_columns(columns, prefix)]
+
+    return ids
+
+
+def coerce_ids(ds: pd.DataFrame, columns=None) -> pd.DataFrame:
+
+    '''
+    Convert ID columns to nullable Int64 without going through float
+    (10-digit ids, NaN for missing nominations).
+    '''
+
+    columns = id_columns(ds.columns) if columns is None else columns
+    for c in columns:
+        ds[c] = pd.to_numeric(ds[c], errors='coerce').astype('Int64')
+
+    return ds
+
+
+def cache_path(path: str, digest: str) -> str:
+
+    '''
+    Location of the cache of `path`: `.roc_cache/<file name>.<hash>.arrow`
+    in the input's directory.
+    '''
+
+    directory, name = os.path.split(os.path.abspath(path))
+
+    return os.path.join(directory, CACHE_DIR, f'{name}.{digest[:16]}.arrow')
+
+
+def wave_columns(path: str) -> pd.Index:
+
+    '''
+    Columns of a wave file (CSV, XLSX or partitioned dataset) without
+    loading its rows.
+    '''
+
+    from wave_dataset import is_dataset, read_manifest
+    if is_dataset(path):
+        return pd.Index(read_manifest(path)['columns'])
+    if path.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path, nrows=0).columns
+
+    return pd.read_csv(path, nrows=0).columns
+
+
+@profiled()
+def load_wave(path: str, columns: list = None) -> pd.DataFrame:
+
+    '''
+    Load a wave as a plain pandas parse of the CSV/XLSX (what the scripts
+    in py-files/ have always used), or from a partitioned dataset
+    directory (see wave_dataset.py), optionally only some `columns`.
+    '''
+
+    from wave_dataset import is_dataset, read_dataset
+    if is_dataset(path):
+        return read_dataset(path, columns=columns)
+    if path.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path, usecols=columns)
+
+    return pd.read_csv(path, usecols=columns)
+
+
+@profiled()
+def parse_wave(path: str) -> pd.DataFrame:
+
+    '''
+    Parse a CSV or XLSX wave file and type its ID columns.
+    '''
+
+    if path.endswith(('.xlsx', '.xls')):
+        ds = pd.read_excel(path)
+    else:
+        ds = pd.read_csv(path)
+
+    return coerce_ids(ds)
+
+
+@profiled()
+def read_wave(path: str, use_cache: bool = True) -> pd.DataFrame:
+
+    '''
+    Load a wave file with typed ID columns, through the Arrow cache when
+    pyarrow is installed. A changed input gets a new content hash, so a
+    stale cache is never read; older caches of the same file are removed.
+    A partitioned dataset is already typed Arrow and is read directly.
+    '''
+
+    from wave_dataset import is_dataset, read_dataset
+    if is_dataset(path):
+        return read_dataset(path)
+
+    if not use_cache:
+        return parse_wave(path)
+
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return parse_wave(path)
+
+    cached = cache_path(path, file_digest(path))
+    if os.path.exists(cached):
+        return feather.read_table(cached, memory_map=True).to_pandas()
+
+    ds = parse_wave(path)
+
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    name = os.path.basename(path)
+    for old in os.listdir(os.path.dirname(cached)):
+        if old.startswith(f'{name}.') and old.endswith('.arrow'):
+            os.remove(os.path.join(os.path.dirname(cached), old))
+
+    tmp = f'{cached}.{os.getpid()}.tmp'
+    feather.write_feather(ds, tmp, compression='uncompressed')
+    os.replace(tmp, cached)
+
+    return ds
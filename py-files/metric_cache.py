@@ -0,0 +1,275 @@
+'''
+On-disk memoization of metric results.
+
+A decorated metric function stores each result under a key made of the
+function, its version (an explicit number plus a hash of the source of
+its module and of every py-files module it imports, directly or not,
+anywhere in the file, so editing any of them invalidates its entries)
+and a content
+fingerprint of every argument: DataFrames and arrays are hashed by
+value, so a changed input never hits a stale entry. Entries are pickles
+in a cache directory capped in size, evicting the least recently used.
+
+Re-running a script or notebook cell on the same data then loads the
+result instead of recomputing it.
+
+Environment:
+    ROC_METRIC_CACHE=0        disable the cache
+    ROC_METRIC_CACHE_DIR      cache directory (default .roc_cache/metrics at the repo root)
+    ROC_METRIC_CACHE_MB       size cap in MB (default 512)
+'''
+
+import ast
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 '.roc_cache', 'metrics')
+DEFAULT_CACHE_MB = 512
+
+
+class Unfingerprintable(TypeError):
+
+    '''
+    Raised for arguments that cannot be hashed by content; the call then
+    bypasses the cache.
+    '''
+
+
+_disabled = 0
+
+
+def cache_enabled() -> bool:
+
+    return not _disabled and os.environ.get('ROC_METRIC_CACHE', '1') not in ('0', 'false', 'no', '')
+
+
+@contextlib.contextmanager
+def metric_cache_disabled():
+
+    '''
+    Bypass the cache within the block, e.g. for one-off partial frames
+    (streamed batches, incremental patches) that would only fill it.
+    '''
+
+    global _disabled
+    _disabled += 1
+    try:
+        yield
+    finally:
+        _disabled -= 1
+
+
+def cache_dir() -> str:
+
+    return os.environ.get('ROC_METRIC_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+
+def cache_limit() -> int:
+
+    return int(float(os.environ.get('ROC_METRIC_CACHE_MB', DEFAULT_CACHE_MB)) * 2 ** 20)
+
+
+def fingerprint(value, digest=None):
+
+    '''
+    Feed a content fingerprint of `value` into `digest` (a hashlib object).
+    '''
+
+    digest = digest or hashlib.sha1()
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        digest.update(repr((type(value).__name__, list(frame.columns),
+                            [str(t) for t in frame.dtypes], frame.shape)).encode())
+        try:
+            hashes = pd.util.hash_pandas_object(value, index=True)
+        except TypeError as e:
+            raise Unfingerprintable(str(e))
+        digest.update(hashes.to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise Unfingerprintable('object array')
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}{len(value)}'.encode())
+        for v in value:
+            fingerprint(v, digest)
+    elif isinstance(value, dict):
+        digest.update(f'dict{len(value)}'.encode())
+        for k in sorted(value, key=repr):
+            digest.update(repr(k).encode())
+            fingerprint(value[k], digest)
+    elif value is None or isinstance(value, (str, bytes, bool, int, float, np.generic)):
+        digest.update(repr(value).encode())
+    else:
+        raise Unfingerprintable(type(value).__name__)
+
+    return digest
+
+
+@functools.lru_cache(maxsize=None)
+def module_digest(path: str) -> str:
+
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def local_imports(path: str) -> set:
+
+    '''
+    Paths of the modules next to `path` that it imports, at module level
+    or inside functions.
+    '''
+
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+
+    directory = os.path.dirname(path)
+    candidates = (os.path.join(directory, f'{name}.py') for name in names)
+
+    return {c for c in candidates if os.path.isfile(c)}
+
+
+@functools.lru_cache(maxsize=None)
+def source_digest(path: str) -> str:
+
+    '''
+    Hash of the source of `path` and of all the local modules it imports,
+    transitively.
+    '''
+
+    seen, pending = set(), [os.path.abspath(path)]
+    while pending:
+        current = pending.pop()
+        if current not in seen:
+            seen.add(current)
+            pending.extend(local_imports(current) - seen)
+
+    digest = hashlib.sha1()
+    for module in sorted(seen):
+        digest.update(f'{os.path.basename(module)}:{module_digest(module)}'.encode())
+
+    return digest.hexdigest()
+
+
+def metric_key(fn, version, arguments: dict) -> str:
+
+    '''
+    Cache key of calling `fn` with the bound `arguments`.
+    '''
+
+    digest = hashlib.sha1()
+    digest.update(f'{fn.__module__}.{fn.__qualname__}:{version}:'.encode())
+    digest.update(source_digest(inspect.getsourcefile(fn)).encode())
+    fingerprint(arguments, digest)
+
+    return digest.hexdigest()
+
+
+def evict(directory: str, limit: int):
+
+    '''
+    Delete least recently used entries until the cache fits in `limit` bytes.
+    '''
+
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.pkl'):
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear_metric_cache():
+
+    directory = cache_dir()
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(directory, name))
+
+
+def cached_metric(version: int = 1):
+
+    '''
+    Memoize a metric function on disk. Bump `version` when a change
+    outside py-files (e.g. a library upgrade) alters its results; edits
+    to its module or to any py-files module it imports already
+    invalidate its entries.
+    '''
+
+    def decorator(fn):
+
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not cache_enabled():
+                return fn(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            try:
+                key = metric_key(fn, version, dict(bound.arguments))
+            except Unfingerprintable:
+                return fn(*args, **kwargs)
+
+            directory = cache_dir()
+            path = os.path.join(directory, f'{fn.__module__}.{fn.__name__}.{key[:20]}.pkl')
+            try:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(path)
+                return result
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+
+            result = fn(*args, **kwargs)
+
+            try:
+                os.makedirs(directory, exist_ok=True)
+                tmp = f'{path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+                evict(directory, cache_limit())
+            except OSError:
+                # Read-only or full disk: the result is still returned
+                pass
+
+            return result
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
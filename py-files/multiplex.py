@@ -0,0 +1,144 @@
+'''
+Multiplex overlap of the relation layers of a wave (friend / support at
+endline, emot / academic at follow-up).
+
+The ties of every layer are stacked into one array of packed int64
+(src, dst) keys and sorted once. Each distinct key gets a bit mask of
+the layers it is on, and the mask of its reverse key (one search in the
+same array) tells on which layers it is reciprocated. For every pair of
+layers (A, B), per student (as nominator) and per classroom:
+
+    ties_{A}, ties_{B}                   ties on each layer
+    multiplex_{A}_{B}                    ties on both layers
+    share_{A}_in_{B}, share_{B}_in_{A}   share of a layer's ties also on the other
+    jaccard_{A}_{B}                      both / either
+    reciprocity_{A}_given_{B}            share of the A ties reciprocated on A,
+    reciprocity_{A}_given_not_{B}        among those also / not on B (same for B)
+
+Only ties within the nominator's classroom count, repeated ties are
+counted once and self-nominations are dropped, as in isolation_reciprocity.
+'''
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from graph_metrics import locate
+from nomination_graph import NominationGraph
+from profiling import profiled, step
+
+
+def layer_masks(graph: NominationGraph, layers: list) -> tuple:
+
+    '''
+    Distinct ties of all layers as sorted packed (src, dst) keys, with
+    the bit mask of the layers each tie is on (bit k for layers[k]) and
+    the mask of its reverse tie.
+    '''
+
+    n, n_layers = graph.n_nodes, len(layers)
+
+    stacked = []
+    for k, layer in enumerate(layers):
+        src, dst = graph.edges(layer, within_classroom=True, unique=True, drop_self=True)
+        stacked.append((src.astype(np.int64) * n + dst) * n_layers + k)
+    stacked = np.sort(np.concatenate(stacked))
+
+    new_key = np.ones(len(stacked), dtype=bool)
+    new_key[1:] = stacked[1:] // n_layers != stacked[:-1] // n_layers
+    keys = stacked[new_key] // n_layers
+    mask = np.bincount(np.cumsum(new_key) - 1, weights=1 << (stacked % n_layers),
+                       minlength=len(keys)).astype(np.int64)
+
+    reverse = locate(keys, (keys % n) * n + keys // n)
+    reverse_mask = np.where(reverse >= 0, mask[np.maximum(reverse, 0)], 0)
+
+    return keys, mask, reverse_mask
+
+
+def ratio(numerator, denominator):
+
+    return np.where(denominator > 0, numerator / np.maximum(denominator, 1), np.nan)
+
+
+def overlap_columns(counts: dict, a: str, b: str) -> dict:
+
+    '''
+    Overlap measures of layers a and b from their tie counts.
+    '''
+
+    both = counts['both']
+
+    return {
+        f'ties_{a}': counts['a'],
+        f'ties_{b}': counts['b'],
+        f'multiplex_{a}_{b}': both,
+        f'share_{a}_in_{b}': ratio(both, counts['a']),
+        f'share_{b}_in_{a}': ratio(both, counts['b']),
+        f'jaccard_{a}_{b}': ratio(both, counts['a'] + counts['b'] - both),
+        f'reciprocity_{a}_given_{b}': ratio(counts['a_mutual_both'], both),
+        f'reciprocity_{a}_given_not_{b}': ratio(counts['a_mutual_only'], counts['a'] - both),
+        f'reciprocity_{b}_given_{a}': ratio(counts['b_mutual_both'], both),
+        f'reciprocity_{b}_given_not_{a}': ratio(counts['b_mutual_only'], counts['b'] - both),
+    }
+
+
+def overlap_counts(graph: NominationGraph, layers=None) -> dict:
+
+    '''
+    {(a, b): {count name: per-node array}} for each pair of layers, the
+    node being the nominator.
+    '''
+
+    layers = list(layers or graph.relations)
+
+    step("1) stack and sort layer keys")
+    keys, mask, reverse_mask = layer_masks(graph, layers)
+    src = keys // graph.n_nodes
+
+    step("2) per-student counts")
+    out = {}
+    for (i, a), (j, b) in combinations(enumerate(layers), 2):
+        on_a, on_b = (mask >> i) & 1 == 1, (mask >> j) & 1 == 1
+        mutual_a, mutual_b = on_a & ((reverse_mask >> i) & 1 == 1), on_b & ((reverse_mask >> j) & 1 == 1)
+        flags = {
+            'a': on_a, 'b': on_b, 'both': on_a & on_b,
+            'a_mutual_both': mutual_a & on_b, 'a_mutual_only': mutual_a & ~on_b,
+            'b_mutual_both': mutual_b & on_a, 'b_mutual_only': mutual_b & ~on_a,
+        }
+        out[(a, b)] = {name: np.bincount(src, weights=flag, minlength=graph.n_nodes).astype(np.int64)
+                       for name, flag in flags.items()}
+
+    return out
+
+
+@profiled()
+def multiplex_students(graph: NominationGraph, layers=None) -> pd.DataFrame:
+
+    '''
+    Per student: overlap of each pair of layers among their nominations.
+    '''
+
+    out = {graph.schema['classroom']: graph.classroom_ids[graph.node_classroom],
+           graph.schema['student']: graph.student_ids}
+    for (a, b), counts in overlap_counts(graph, layers).items():
+        out.update(overlap_columns(counts, a, b))
+
+    return pd.DataFrame(out)
+
+
+@profiled()
+def multiplex_classrooms(graph: NominationGraph, layers=None) -> pd.DataFrame:
+
+    '''
+    Per classroom: overlap of each pair of layers among all the ties of
+    the classroom.
+    '''
+
+    out = {graph.schema['classroom']: graph.classroom_ids}
+    for (a, b), counts in overlap_counts(graph, layers).items():
+        totals = {name: graph.classroom_sum(values).astype(np.int64) for name, values in counts.items()}
+        out.update(overlap_columns(totals, a, b))
+
+    return pd.DataFrame(out)
@@ -0,0 +1,256 @@
+'''
+Compiled nomination-graph core shared by the metric scripts.
+Turns a wave dataset (endline or follow-up schema) into an
+integer-indexed CSR adjacency per relation type, so metrics run
+as NumPy operations instead of re-parsing the wide `friend_1..3`
+/ `emot_1..3` / `academic_1..3` columns in every script.
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+from student_index import StudentIndex, to_id_array
+
+
+# Column names per wave. The renamed follow-up file used in
+# network-stats.ipynb (`roc_network_data_follow_up2.csv`) carries the
+# endline names, so detection is done on the columns, not the file name.
+WAVE_SCHEMAS = {
+    'endline': {
+        'classroom': 'classroom_id',
+        'student': 'student_id',
+        'school': 'school_id',
+        'relations': {'friend': 'friend_', 'support': 'support_'},
+    },
+    'follow_up': {
+        'classroom': 'fs_classroom',
+        'student': 'fs_student_id',
+        'school': 'fs_school_id',
+        'relations': {'emot': 'emot_', 'academic': 'academic_'},
+    },
+}
+
+
+def detect_schema(columns) -> dict:
+
+    '''
+    Return the WAVE_SCHEMAS entry matching the given columns.
+    '''
+
+    columns = set(columns)
+    for wave, schema in WAVE_SCHEMAS.items():
+        if schema['classroom'] in columns and schema['student'] in columns:
+            return dict(schema, wave=wave)
+
+    raise ValueError("Columns do not match any known wave schema: "
+                     f"{sorted(columns)}")
+
+
+def nomination_columns(columns, prefix: str) -> list:
+
+    '''
+    Return the `{prefix}{n}` slot columns ordered by n. Works for
+    any number of nomination slots, not just 1..3.
+    '''
+
+    pattern = re.compile(rf'^{re.escape(prefix)}(\d+)$')
+    slots = [(int(m.group(1)), c) for c in columns for m in [pattern.match(c)] if m]
+
+    return [c for _, c in sorted(slots)]
+
+
+def sorted_unique(values: np.ndarray) -> np.ndarray:
+
+    '''
+    Sorted unique values of an integer array. Same result as np.unique,
+    which is hash-based for integers in recent NumPy and much slower
+    than sorting on the large key arrays used here.
+    '''
+
+    values = np.sort(values)
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+
+    return values[keep]
+
+
+class NominationGraph:
+
+    '''
+    Integer-indexed nomination graph of one wave.
+
+    Nodes are the unique students, ordered by classroom and then by
+    student id, so each classroom is a contiguous segment:
+    the nodes of classroom k are `classroom_ptr[k]:classroom_ptr[k+1]`.
+    Each relation is stored as CSR arrays `(indptr, indices)`: the
+    nominees of node i are `indices[indptr[i]:indptr[i+1]]`, in slot order.
+    Nominations of repeated student rows are all kept on the same node;
+    `edge_rows[relation][e]` is the input row tie e was written on, for
+    metrics that depend on the nominator's row (e.g. their ability).
+    Nominees that are not a known student are dropped and counted
+    in `unresolved`.
+    '''
+
+    def __init__(self, index: StudentIndex, first_row, row_node, relations,
+                 unresolved, schema, edge_rows=None):
+
+        self.index = index
+        self.student_ids = index.student_ids
+        self.classroom_ids = index.classroom_ids
+        self.classroom_ptr = index.classroom_ptr
+        self.node_classroom = index.node_classroom
+        self.first_row = first_row
+        self.row_node = row_node
+        self.relations = relations
+        self.unresolved = unresolved
+        self.schema = schema
+        self.edge_rows = {} if edge_rows is None else edge_rows
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.student_ids)
+
+    @property
+    def n_classrooms(self) -> int:
+        return len(self.classroom_ids)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.first_row, self.row_node]
+        arrays += [a for csr in self.relations.values() for a in csr]
+        arrays += list(self.edge_rows.values())
+        return self.index.nbytes + sum(a.nbytes for a in arrays)
+
+    def classroom_sizes(self) -> np.ndarray:
+        return np.diff(self.classroom_ptr)
+
+    def lookup(self, ids) -> np.ndarray:
+
+        '''
+        Map original student ids to dense node ids (-1 if unknown).
+        '''
+
+        return self.index.encode(ids)
+
+    def edges(self, relation: str, within_classroom: bool = False,
+              unique: bool = False, drop_self: bool = False):
+
+        '''
+        Return the (src, dst) node arrays of a relation. Optionally keep
+        only ties inside the nominator's classroom, drop repeated ties
+        and drop self-nominations.
+        '''
+
+        indptr, indices = self.relations[relation]
+        src = np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(indptr))
+        dst = indices
+
+        if within_classroom:
+            keep = self.node_classroom[src] == self.node_classroom[dst]
+            src, dst = src[keep], dst[keep]
+
+        if drop_self:
+            keep = src != dst
+            src, dst = src[keep], dst[keep]
+
+        if unique:
+            keys = sorted_unique(src.astype(np.int64) * self.n_nodes + dst)
+            src = (keys // self.n_nodes).astype(np.int32)
+            dst = (keys % self.n_nodes).astype(np.int32)
+
+        return src, dst
+
+    def out_degree(self, relation: str) -> np.ndarray:
+        return np.diff(self.relations[relation][0])
+
+    def in_degree(self, relation: str) -> np.ndarray:
+        return np.bincount(self.relations[relation][1], minlength=self.n_nodes)
+
+    def classroom_sum(self, values) -> np.ndarray:
+
+        '''
+        Sum a per-node array within each classroom segment.
+        '''
+
+        return np.bincount(self.node_classroom, weights=values,
+                           minlength=self.n_classrooms)
+
+
+@profiled()
+def build_nomination_graph(ds: pd.DataFrame,
+                           relations=None) -> NominationGraph:
+
+    '''
+    Build the CSR nomination graph of a wave DataFrame. `relations`
+    restricts the relation types built (default: all in the schema);
+    a dict maps relation names to column prefixes explicitly,
+    e.g. `{'friend_': 'friend_'}`.
+    '''
+
+    schema = detect_schema(ds.columns)
+    relation_prefixes = schema['relations']
+    if isinstance(relations, dict):
+        relation_prefixes = dict(relations)
+    elif relations is not None:
+        relation_prefixes = {r: relation_prefixes[r] for r in relations}
+
+    # Dense node ids: unique students sorted by (classroom, student).
+    index, first_row, row_node, order = StudentIndex.from_rows(ds[schema['student']],
+                                                               ds[schema['classroom']])
+
+    graph = NominationGraph(index=index,
+                            first_row=first_row,
+                            row_node=row_node,
+                            relations={},
+                            unresolved={},
+                            schema=schema)
+
+    # Edges are ordered by node, then by source row, then by slot.
+    row_order = order[np.argsort(row_node[order], kind='stable')]
+    n_rows = len(row_order)
+
+    for relation, prefix in relation_prefixes.items():
+        cols = nomination_columns(ds.columns, prefix)
+        targets = np.column_stack([to_id_array(ds[c].to_numpy()[row_order]) for c in cols]) \
+            if cols else np.empty((n_rows, 0), dtype=np.int64)
+        named = targets >= 0
+        dense = np.full(targets.shape, -1, dtype=np.int32)
+        dense[named] = graph.lookup(targets[named])
+        valid = dense >= 0
+
+        counts = np.bincount(row_node[row_order], weights=valid.sum(axis=1),
+                             minlength=graph.n_nodes).astype(np.int64)
+        indptr = np.zeros(graph.n_nodes + 1, dtype=np.int32)
+        indptr[1:] = np.cumsum(counts)
+
+        graph.relations[relation] = (indptr, dense[valid])
+        graph.edge_rows[relation] = np.repeat(row_order, valid.sum(axis=1)).astype(np.int32)
+        graph.unresolved[relation] = int(named.sum() - valid.sum())
+
+    return graph
+
+
+def read_nomination_graph(path: str, relations=None) -> NominationGraph:
+
+    '''
+    Read only the ID and nomination columns of a wave CSV (or partitioned
+    dataset) and build its nomination graph.
+    '''
+
+    from ingest import load_wave, wave_columns
+
+    header = wave_columns(path)
+    schema = detect_schema(header)
+    if isinstance(relations, dict):
+        prefixes = relations.values()
+    elif relations is not None:
+        prefixes = [schema['relations'][r] for r in relations]
+    else:
+        prefixes = schema['relations'].values()
+    usecols = [schema['classroom'], schema['student']]
+    usecols += [c for p in prefixes for c in nomination_columns(header, p)]
+
+    return build_nomination_graph(load_wave(path, columns=usecols), relations)
@@ -0,0 +1,124 @@
+'''
+Bit-packed per-classroom adjacency of a nomination graph.
+
+A classroom has at most a few dozen students, so the ties of a student
+fit in one or a few 64-bit words: bit j of row i is set when student i
+nominates the j-th student of their classroom (nodes are numbered
+within the classroom from `classroom_ptr`). All classrooms share one
+(n_nodes, words) uint64 array, so per-student queries over the whole
+wave are a bitwise AND and a popcount:
+
+    reciprocated ties    popcount(out[i] & in[i])
+    nominated by nobody  in[i] == 0
+
+A tie takes one bit of its classroom's matrix.
+
+Usage:
+    from nomination_graph import read_nomination_graph
+    from packed_adjacency import PackedAdjacency
+    graph = read_nomination_graph('input-files/roc_network_data_endline.csv')
+    friend = PackedAdjacency.from_graph(graph, 'friend')
+    mutual = friend.reciprocated()
+'''
+
+import numpy as np
+
+from nomination_graph import NominationGraph
+
+
+# Classrooms wider than this many words are left to the key-based metrics
+MAX_WORDS = 16
+
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+
+    '''
+    Set bits of each uint64 word.
+    '''
+
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+
+    # NumPy < 2.0: count bits byte by byte
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    return _BYTE_COUNTS[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def n_words(graph: NominationGraph) -> int:
+
+    '''
+    uint64 words per row needed for the largest classroom of the graph.
+    '''
+
+    sizes = graph.classroom_sizes()
+
+    return max(int(-(-sizes.max() // 64)), 1) if len(sizes) else 1
+
+
+def pack(graph: NominationGraph, src: np.ndarray, dst: np.ndarray, words: int) -> np.ndarray:
+
+    '''
+    (n_nodes, words) uint64 rows with bit `local(dst)` set on row `src`.
+    '''
+
+    local = dst - graph.classroom_ptr[graph.node_classroom[dst]]
+    rows = np.zeros((graph.n_nodes, words), dtype=np.uint64)
+    np.bitwise_or.at(rows, (src, local >> 6), np.left_shift(np.uint64(1), (local & 63).astype(np.uint64)))
+
+    return rows
+
+
+class PackedAdjacency:
+
+    '''
+    Out- and in-adjacency bit rows of one relation, ties within the
+    nominator's classroom only (repeated ties are one bit, self-nominations
+    are dropped).
+    '''
+
+    def __init__(self, graph: NominationGraph, out_rows: np.ndarray, in_rows: np.ndarray):
+
+        self.graph = graph
+        self.out_rows = out_rows
+        self.in_rows = in_rows
+
+    @classmethod
+    def from_graph(cls, graph: NominationGraph, relation: str) -> 'PackedAdjacency':
+
+        words = n_words(graph)
+        src, dst = graph.edges(relation, within_classroom=True, drop_self=True)
+        src, dst = src.astype(np.int64), dst.astype(np.int64)
+
+        return cls(graph, pack(graph, src, dst, words), pack(graph, dst, src, words))
+
+    @property
+    def words(self) -> int:
+        return self.out_rows.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.out_rows.nbytes + self.in_rows.nbytes
+
+    def out_degree(self) -> np.ndarray:
+        return popcount(self.out_rows).sum(axis=1, dtype=np.int64)
+
+    def in_degree(self) -> np.ndarray:
+        return popcount(self.in_rows).sum(axis=1, dtype=np.int64)
+
+    def reciprocated(self) -> np.ndarray:
+
+        '''
+        Reciprocated ties of each student.
+        '''
+
+        return popcount(self.out_rows & self.in_rows).sum(axis=1, dtype=np.int64)
+
+    def in_isolated(self) -> np.ndarray:
+
+        '''
+        True for the students nominated by nobody in their classroom.
+        '''
+
+        return ~self.in_rows.any(axis=1)
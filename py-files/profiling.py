@@ -0,0 +1,325 @@
+'''
+Opt-in per-stage profiling of the pipeline.
+
+Named stages (reading a wave, building the graph, each metric and its
+numbered steps, writing the outputs) record their wall time, CPU time,
+the process peak RSS when they end and the rows they take in and give
+out. The trace is written as JSON when the process exits, either as a
+list of stages or in Chrome trace format (open it in chrome://tracing
+or https://ui.perfetto.dev).
+
+Enable it with the environment or the CLI:
+
+    ROC_PROFILE=trace.json python py-files/homophily-indegree.py
+    ROC_PROFILE=trace.json ROC_PROFILE_FORMAT=chrome python py-files/coleman-homophily.py
+    python py-files/roc_network.py run --wave all --profile trace.json --profile-format chrome
+
+When disabled, `stage` returns a shared no-op object and `step` and the
+`profiled` wrappers return after checking one module flag.
+
+Usage in code:
+
+    @profiled()
+    def some_metric(df): ...
+        step("1) melt", rows=len(df))     # ends the previous step of the enclosing stage
+        ...
+
+    with stage("to_csv", rows=len(result)):
+        result.to_csv(path)
+
+Worker processes inherit the environment and write their own trace next
+to it (trace.<pid>.json).
+'''
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+
+FORMATS = ('json', 'chrome')
+
+_events = None      # list of finished stages while enabled
+_path = None
+_format = 'json'
+_origin = time.perf_counter()
+_local = threading.local()
+
+
+def peak_rss_mb() -> float:
+
+    '''
+    Peak resident set size of the process so far, None where the
+    resource module is not available (Windows).
+    '''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def n_rows(value):
+
+    '''
+    Rows of a DataFrame, Series or array (or of the first item of a
+    tuple of them), None for anything else.
+    '''
+
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    shape = getattr(value, 'shape', None)
+
+    return int(shape[0]) if shape else None
+
+
+class Stage:
+
+    '''
+    A running stage. Use as a context manager; `rows_out` can be set
+    before it ends, and `step` splits it into consecutive sub-stages.
+    '''
+
+    def __init__(self, name: str, rows=None, is_step: bool = False):
+        self.name = name
+        self.rows_in = rows
+        self.rows_out = None
+        self.current = None
+        self.is_step = is_step
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def step(self, name: str, rows=None):
+        self.end_step()
+        self.current = Stage(name, rows, is_step=True).__enter__()
+
+    def end_step(self):
+        if self.current is not None:
+            self.current.__exit__(None, None, None)
+            self.current = None
+
+    def __exit__(self, *exc):
+        self.end_step()
+        end, cpu = time.perf_counter(), time.thread_time()
+        _local.stack.remove(self)
+        if _events is not None:
+            _events.append({
+                'name': self.name,
+                'parent': self.parent,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'start_s': self.start - _origin,
+                'wall_s': end - self.start,
+                'cpu_s': cpu - self.cpu,
+                'peak_rss_mb': peak_rss_mb(),
+                'rows_in': self.rows_in,
+                'rows_out': self.rows_out,
+            })
+        return False
+
+
+class NullStage:
+
+    '''
+    What `stage` returns when profiling is disabled.
+    '''
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+    def step(self, name: str, rows=None):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+def enabled() -> bool:
+
+    return _events is not None
+
+
+def stage(name: str, rows=None):
+
+    '''
+    Context manager timing the block as stage `name` (`rows` taken in).
+    '''
+
+    if _events is None:
+        return NULL_STAGE
+
+    return Stage(name, rows)
+
+
+def step(name: str, rows=None):
+
+    '''
+    Start step `name` of the innermost running stage of this thread,
+    ending its previous step.
+    '''
+
+    if _events is None:
+        return
+    for running in reversed(getattr(_local, 'stack', None) or []):
+        if not running.is_step:
+            running.step(name, rows)
+            return
+
+
+def profiled(name: str = None):
+
+    '''
+    Run each call of the decorated function as a stage (by default named
+    after the function), recording the rows of its first argument and of
+    its result.
+    '''
+
+    def decorator(fn):
+
+        stage_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return fn(*args, **kwargs)
+            with Stage(stage_name, n_rows(args[0]) if args else None) as s:
+                result = fn(*args, **kwargs)
+                s.rows_out = n_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def traced(fn, name: str):
+
+    '''
+    `fn` run as stage `name`, or `fn` itself when profiling is disabled.
+    '''
+
+    if _events is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with Stage(name) as s:
+            result = fn(*args, **kwargs)
+            s.rows_out = n_rows(result)
+        return result
+
+    return wrapper
+
+
+def trace_path() -> str:
+
+    '''
+    Where this process writes its trace: the configured path, or a
+    per-process variant of it in worker processes.
+    '''
+
+    if os.environ.get('ROC_PROFILE_PID', str(os.getpid())) == str(os.getpid()):
+        return _path
+    root, ext = os.path.splitext(_path)
+
+    return f'{root}.{os.getpid()}{ext}'
+
+
+def write_trace(path: str = None, fmt: str = None) -> str:
+
+    '''
+    Write the stages recorded so far. Returns the written path.
+    '''
+
+    path = path or trace_path()
+    fmt = fmt or _format
+    events = sorted(_events or [], key=lambda e: e['start_s'])
+
+    if fmt == 'chrome':
+        trace = {
+            'traceEvents': [
+                {'name': e['name'], 'ph': 'X', 'pid': e['pid'], 'tid': e['tid'],
+                 'ts': e['start_s'] * 1e6, 'dur': e['wall_s'] * 1e6,
+                 'args': {k: e[k] for k in ('cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out')}}
+                for e in events
+            ],
+            'displayTimeUnit': 'ms',
+        }
+    else:
+        trace = {'argv': sys.argv, 'stages': events}
+
+    with open(path, 'w') as f:
+        json.dump(trace, f, indent=1)
+
+    return path
+
+
+def flush():
+
+    '''
+    Write the trace now (worker processes of a pool exit without running
+    atexit handlers).
+    '''
+
+    if _events is not None and _path:
+        write_trace()
+
+
+def enable(path: str, fmt: str = 'json'):
+
+    '''
+    Start recording stages, written to `path` at exit. Sets ROC_PROFILE
+    so worker processes record too.
+    '''
+
+    global _events, _path, _format
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown profile format '{fmt}'. Choose from: {', '.join(FORMATS)}")
+
+    first = _events is None
+    _events = [] if first else _events
+    _path, _format = os.path.abspath(path), fmt
+    os.environ['ROC_PROFILE'] = _path
+    os.environ['ROC_PROFILE_FORMAT'] = fmt
+    os.environ.setdefault('ROC_PROFILE_PID', str(os.getpid()))
+    if first:
+        atexit.register(flush)
+
+
+def _after_fork():
+
+    # A forked worker starts with its own, empty trace
+    if _events is not None:
+        _events.clear()
+    _local.__dict__.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+if os.environ.get('ROC_PROFILE'):
+    enable(os.environ['ROC_PROFILE'], os.environ.get('ROC_PROFILE_FORMAT', 'json'))
@@ -0,0 +1,586 @@
+'''
+Single entry point for the metrics in py-files/.
+
+Each input file is parsed once (CSV read + nomination graph) and the
+parsed wave is shared by all the metric tasks that need it. Tasks form a
+small dependency graph (read -> graph -> metric) and independent tasks
+run concurrently, so a run takes about as long as its slowest metric.
+
+The batch command fans a glob of input files out over worker
+processes, one file per worker, and writes each output as soon as its
+file is done.
+
+Usage:
+    python py-files/roc_network.py list
+    python py-files/roc_network.py run --wave follow_up --metrics homophily_in,coleman,segregation
+    python py-files/roc_network.py run --wave all
+    python py-files/roc_network.py batch "input-files/roc_network_data_*.csv" --workers 4
+    python py-files/roc_network.py update --wave follow_up
+    python py-files/roc_network.py stream --wave follow_up --chunksize 200000
+    python py-files/roc_network.py partition input-files/roc_network_data_follow_up.csv
+
+Add --profile trace.json to run, batch, update or stream to record the
+time, CPU, peak memory and rows of every stage (see profiling.py).
+'''
+
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed, wait)
+
+import ability_metrics
+import graph_metrics
+import multiplex
+import profiling
+import segregation_null
+import sparse_network
+from ingest import read_wave, wave_columns
+from nomination_graph import build_nomination_graph, detect_schema
+from wave_dataset import FORMATS, dataset_path, is_dataset, write_dataset
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_DIR = os.path.join(ROOT_DIR, 'input-files')
+OUTPUT_DIR = os.path.join(ROOT_DIR, 'output-files')
+
+WAVE_FILE = 'roc_network_data_{wave}.csv'
+# Run tasks that do not write a metric output
+RUN_TASKS = ('read:', 'graph:', 'snapshot:')
+WAVES = ['endline', 'endline_low_ability', 'endline_high_ability',
+         'follow_up', 'follow_up_low_ability', 'follow_up_high_ability']
+
+FOLLOW_UP_ABILITY_COLUMNS = ['fs_classroom', 'fs_student_id', 'high_math',
+                             'emot_1', 'emot_2', 'emot_3',
+                             'academic_1', 'academic_2', 'academic_3']
+
+# Per metric:
+#   inputs:   parsed objects passed to compute ('ds' DataFrame, 'graph')
+#   compute:  function(wave schema name, *inputs) -> DataFrame, or a tuple
+#             of DataFrames when `output` lists several files
+#   requires: columns the input file must have
+#   output:   output-files/ name; {variant} is the input file suffix and
+#             {suffix} is '' for the full follow-up file, '_{variant}' otherwise
+#   outputs:  output names that do not follow the template
+#   per_classroom: one output row per classroom (wave classroom column),
+#             so `update` can patch corrections in (see incremental.py)
+METRICS = {
+    'isolation_reciprocity': {
+        'inputs': ('graph',),
+        'compute': lambda wave, graph: graph_metrics.isolation_reciprocity(
+            graph, relations={'endline': ['friend', 'support'],
+                              'follow_up': ['academic', 'emot']}[wave]),
+        'requires': [],
+        'output': 'roc_isolation_reciprocity_{variant}.csv',
+        'per_classroom': True,
+    },
+    'isolatedness': {
+        'inputs': ('ds', 'graph'),
+        'compute': lambda wave, ds, graph: graph_metrics.isolatedness(
+            ds, graph, relations={'endline': ['friend', 'support'],
+                                  'follow_up': ['emot', 'academic']}[wave]),
+        'requires': [],
+        'output': 'roc_isolatedness_{variant}.csv',
+        'outputs': {'follow_up': 'roc_isolatedness_followup.csv'},
+    },
+    'triad_census': {
+        'inputs': ('graph',),
+        'compute': lambda wave, graph: graph_metrics.triad_census(graph),
+        'requires': [],
+        'output': 'roc_triad_census_{variant}.csv',
+        'per_classroom': True,
+    },
+    'multiplex': {
+        'inputs': ('graph',),
+        'compute': lambda wave, graph: multiplex.multiplex_classrooms(graph),
+        'requires': [],
+        'output': 'roc_multiplex_{variant}.csv',
+        'per_classroom': True,
+    },
+    'multiplex_students': {
+        'inputs': ('graph',),
+        'compute': lambda wave, graph: multiplex.multiplex_students(graph),
+        'requires': [],
+        'output': 'roc_multiplex_students_{variant}.csv',
+    },
+    'network_algebra': {
+        'inputs': ('ds', 'graph'),
+        'compute': lambda wave, ds, graph: sparse_network.network_algebra(graph, ds),
+        'requires': [],
+        'output': 'roc_network_algebra_{variant}.csv',
+        'per_classroom': True,
+    },
+    'homophily_in': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.in_degree_homophily(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': 'homophily-indegree{suffix}.csv',
+    },
+    'homophily_out': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.same_ability_homophily(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': 'homophily-outdegree{suffix}.csv',
+    },
+    'coleman': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.coleman_homophily(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': 'coleman-homophily{suffix}.csv',
+        'per_classroom': True,
+    },
+    'segregation_actual': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.cross_ability_ratio(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': 'classroom_segregation_actual{suffix}.csv',
+        'per_classroom': True,
+    },
+    'segregation_actual_all': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.cross_ability_ratios(ds),
+        'requires': ['high_math'],
+        'output': 'classroom_segregation_actual_all{suffix}.csv',
+        'per_classroom': True,
+    },
+    'segregation_theoretical': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.segregation_theoretical(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': 'classroom_segregation_theoretical{suffix}.csv',
+        'per_classroom': True,
+    },
+    'segregation_null': {
+        'inputs': ('ds',),
+        # Fixed seed for reproducible outputs; the run itself is already parallel.
+        'compute': lambda wave, ds: segregation_null.simulate_cross_ability_null(ds, seed=0, workers=1),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': 'classroom_segregation_null{suffix}.csv',
+    },
+    'high_nominations': {
+        'inputs': ('ds',),
+        # One pass for both tables
+        'compute': lambda wave, ds: ability_metrics.high_nomination_tables(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS,
+        'output': ['high_nomination_counts{suffix}.csv', 'high_nomination_counts-v2{suffix}.csv'],
+    },
+    'inter_ability': {
+        'inputs': ('ds',),
+        'compute': lambda wave, ds: ability_metrics.lowhigh_inter_ability(ds),
+        'requires': FOLLOW_UP_ABILITY_COLUMNS + ['high_raven', 'high_bangla', 'high_eyes'],
+        'output': 'follow_up_inter_ability{suffix}.csv',
+    },
+}
+
+METRIC_GROUPS = {
+    'segregation': ['segregation_actual', 'segregation_actual_all', 'segregation_theoretical',
+                    'segregation_null'],
+    'homophily': ['homophily_in', 'homophily_out', 'coleman'],
+}
+
+
+def output_names(metric: str, variant: str) -> list:
+
+    '''
+    File names in output-files/ of a metric computed on an input variant,
+    one per table the metric returns.
+    '''
+
+    spec = METRICS[metric]
+    if variant in spec.get('outputs', {}):
+        return [spec['outputs'][variant]]
+    suffix = '' if variant == 'follow_up' else f'_{variant}'
+    templates = spec['output'] if isinstance(spec['output'], list) else [spec['output']]
+
+    return [t.format(variant=variant, suffix=suffix) for t in templates]
+
+
+def output_name(metric: str, variant: str) -> str:
+
+    '''
+    File name in output-files/ of a single-output metric.
+    '''
+
+    names = output_names(metric, variant)
+    if len(names) != 1:
+        raise ValueError(f"Metric '{metric}' writes {len(names)} outputs.")
+
+    return names[0]
+
+
+def expand_metrics(names: list) -> list:
+
+    '''
+    Resolve metric names and groups (e.g. 'segregation') into metric names.
+    '''
+
+    metrics = []
+    for name in names:
+        if name == 'all':
+            metrics += list(METRICS)
+        elif name in METRIC_GROUPS:
+            metrics += METRIC_GROUPS[name]
+        elif name in METRICS:
+            metrics.append(name)
+        else:
+            raise ValueError(f"Unknown metric '{name}'. Choose from: "
+                             f"{', '.join(list(METRICS) + list(METRIC_GROUPS))}")
+
+    return list(dict.fromkeys(metrics))
+
+
+def check_inputs(paths: list, metrics: list, requested: bool) -> bool:
+
+    '''
+    Whether metrics are skipped on the input files that lack their
+    columns: always with 'all', and for `requested` metrics (named on the
+    command line) when several inputs are selected, with a notice for
+    each skip. Raises ValueError for a requested metric no input supports;
+    with a single input, the run itself raises for a missing column.
+    '''
+
+    if not requested:
+        return True
+    if len(paths) < 2:
+        return False
+
+    columns = {path: wave_columns(path) for path in paths}
+    for metric in metrics:
+        missing = {path: [c for c in METRICS[metric]['requires'] if c not in cols]
+                   for path, cols in columns.items()}
+        if all(missing.values()):
+            raise ValueError(f"Metric '{metric}' needs columns that none of the selected inputs have: "
+                             f"{', '.join(dict.fromkeys(c for m in missing.values() for c in m))}.")
+        for path, cols in missing.items():
+            if cols:
+                print(f"Skipped. {metric} on {os.path.basename(path)}: needs columns {cols}")
+
+    return True
+
+
+def plan_run(input_paths: dict, metrics: list, output_dir: str,
+             skip_inapplicable: bool, use_cache: bool = True) -> dict:
+
+    '''
+    Build the task graph of a run: one read and one graph build per input
+    file, then one task per (metric, input) computing and writing the
+    metric, and one snapshot task per input once its outputs are written
+    (see incremental.sync_snapshot). Returns {task name: (function, dependency task names)}.
+    '''
+
+    tasks = {}
+    for variant, path in input_paths.items():
+        columns = wave_columns(path)
+        wave = detect_schema(columns)['wave']
+
+        read_task, graph_task = f'read:{variant}', f'graph:{variant}'
+        tasks[read_task] = (lambda path=path: read_wave(path, use_cache), [])
+        tasks[graph_task] = (build_nomination_graph, [read_task])
+
+        for metric in metrics:
+            spec = METRICS[metric]
+            missing = [c for c in spec['requires'] if c not in columns]
+            if missing:
+                if skip_inapplicable:
+                    continue
+                raise ValueError(f"Metric '{metric}' needs columns {missing} "
+                                 f"that {os.path.basename(path)} does not have.")
+
+            deps = [read_task if i == 'ds' else graph_task for i in spec['inputs']]
+            output_csvs = [os.path.join(output_dir, name) for name in output_names(metric, variant)]
+
+            def compute_and_write(*inputs, spec=spec, wave=wave, output_csvs=output_csvs):
+                results = spec['compute'](wave, *inputs)
+                if len(output_csvs) == 1:
+                    results = [results]
+                for result, output_csv in zip(results, output_csvs):
+                    with profiling.stage('to_csv', rows=len(result)):
+                        result.to_csv(output_csv, index=False)
+                return output_csvs
+
+            tasks[f'{metric}:{variant}'] = (compute_and_write, deps)
+
+        # Snapshot of the input the outputs now reflect, for `update`
+        written = [name for name in tasks if name.endswith(f':{variant}')
+                   and not name.startswith(RUN_TASKS)]
+
+        def write_snapshot(ds, *outputs, path=path):
+            from incremental import sync_snapshot
+            sync_snapshot(path, ds, output_dir, [p for paths in outputs for p in paths])
+
+        tasks[f'snapshot:{variant}'] = (write_snapshot, [read_task] + written)
+
+    return tasks
+
+
+def run_tasks(tasks: dict, workers: int = None) -> dict:
+
+    '''
+    Run a task graph {name: (function, deps)}. A task starts as soon as all
+    its dependencies are done and receives their results as arguments;
+    independent tasks run concurrently. Returns {name: result}.
+    '''
+
+    results, running = {}, {}
+    pending = dict(tasks)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            ready = [name for name, (_, deps) in pending.items()
+                     if all(d in results for d in deps)]
+            for name in ready:
+                fn, deps = pending.pop(name)
+                running[pool.submit(profiling.traced(fn, name), *[results[d] for d in deps])] = name
+
+            if not running:
+                raise ValueError(f"Unresolvable task dependencies: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    return results
+
+
+def variant_of(path: str) -> str:
+
+    '''
+    Input variant of a wave file, e.g. 'endline_low_ability' for
+    roc_network_data_endline_low_ability.csv.
+    '''
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    prefix = WAVE_FILE.split('{')[0]
+
+    return stem[len(prefix):] if stem.startswith(prefix) else stem
+
+
+def process_file(path: str, metrics: list, output_dir: str,
+                 skip_inapplicable: bool = True, use_cache: bool = True) -> list:
+
+    '''
+    Compute the metrics of one input file in the current process.
+    Returns the written output paths.
+    '''
+
+    tasks = plan_run({variant_of(path): path}, metrics, output_dir,
+                     skip_inapplicable, use_cache)
+    results = run_tasks(tasks, workers=1)
+    # Batch workers exit without running atexit handlers
+    profiling.flush()
+
+    return [p for name in tasks if not name.startswith(RUN_TASKS) for p in results[name]]
+
+
+def run_batch(paths: list, metrics: list, output_dir: str,
+              workers: int = None, skip_inapplicable: bool = True,
+              use_cache: bool = True):
+
+    '''
+    Process each input file in its own worker process and yield
+    (path, written outputs) as files complete.
+    '''
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, path, metrics, output_dir,
+                               skip_inapplicable, use_cache): path
+                   for path in paths}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def resolve_waves(waves: list, input_dir: str) -> dict:
+
+    '''
+    Map wave variants (or 'all') to their input file paths. A wave with no
+    CSV but a partitioned dataset (see wave_dataset.py) maps to the dataset.
+    '''
+
+    if 'all' in waves:
+        waves = WAVES
+
+    paths = {}
+    for wave in waves:
+        path = os.path.join(input_dir, WAVE_FILE.format(wave=wave))
+        if not os.path.exists(path) and is_dataset(dataset_path(path)):
+            path = dataset_path(path)
+        paths[wave] = path
+
+    return paths
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='roc-network', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help='list the available metrics')
+
+    run = commands.add_parser('run', help='compute metrics on one or more waves')
+    run.add_argument('--wave', default='follow_up',
+                     help=f"comma-separated input variants or 'all' ({', '.join(WAVES)})")
+    run.add_argument('--metrics', default='all',
+                     help="comma-separated metric names, groups or 'all'")
+    run.add_argument('--input-dir', default=INPUT_DIR)
+    run.add_argument('--output-dir', default=OUTPUT_DIR)
+    run.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='number of concurrent tasks')
+    run.add_argument('--no-cache', action='store_true',
+                     help='parse the input files instead of using their Arrow cache, '
+                          'and recompute metrics instead of using the metric cache')
+
+    batch = commands.add_parser('batch', help='process a glob of wave files in parallel worker processes')
+    batch.add_argument('inputs', nargs='+', help='wave files or glob patterns')
+    batch.add_argument('--metrics', default='all',
+                       help="comma-separated metric names, groups or 'all'")
+    batch.add_argument('--output-dir', default=OUTPUT_DIR)
+    batch.add_argument('--workers', type=int, default=os.cpu_count(),
+                       help='number of worker processes (default: all cores)')
+    batch.add_argument('--no-cache', action='store_true',
+                       help='parse the input files instead of using their Arrow cache, '
+                            'and recompute metrics instead of using the metric cache')
+
+    update = commands.add_parser('update', help='patch the per-classroom outputs after a correction '
+                                                'batch, recomputing only the affected classrooms')
+    update.add_argument('--wave', default='follow_up',
+                        help=f"comma-separated input variants or 'all' ({', '.join(WAVES)})")
+    update.add_argument('--metrics', default='all',
+                        help="comma-separated metric names, groups or 'all'")
+    update.add_argument('--input-dir', default=INPUT_DIR)
+    update.add_argument('--output-dir', default=OUTPUT_DIR)
+    update.add_argument('--no-cache', action='store_true',
+                        help='parse the input files instead of using their Arrow cache, '
+                             'and recompute metrics instead of using the metric cache')
+
+    stream = commands.add_parser('stream', help='compute the per-classroom metrics in bounded memory, '
+                                                'reading the input in chunks of complete classrooms')
+    stream.add_argument('--wave', default='follow_up',
+                        help=f"comma-separated input variants or 'all' ({', '.join(WAVES)})")
+    stream.add_argument('--metrics', default='all',
+                        help="comma-separated per-classroom metric names, groups or 'all'")
+    stream.add_argument('--input-dir', default=INPUT_DIR)
+    stream.add_argument('--output-dir', default=OUTPUT_DIR)
+    stream.add_argument('--chunksize', type=int, default=100_000,
+                        help='rows read at a time (default: 100000)')
+    stream.add_argument('--spill-dir', default=None,
+                        help='directory for the temporary classroom buckets of ungrouped inputs')
+
+    partition = commands.add_parser('partition', help='rewrite wave files as datasets partitioned '
+                                                      'by school and classroom')
+    partition.add_argument('inputs', nargs='+', help='wave CSV files or glob patterns')
+    partition.add_argument('--format', choices=list(FORMATS), default='parquet')
+    partition.add_argument('--chunksize', type=int, default=100_000,
+                           help='rows read at a time (default: 100000)')
+
+    for command in (run, batch, update, stream):
+        command.add_argument('--profile', metavar='TRACE',
+                             help='write per-stage time, CPU, peak memory and rows to this JSON file')
+        command.add_argument('--profile-format', choices=profiling.FORMATS, default='json',
+                             help="'chrome' for chrome://tracing / Perfetto (default: json)")
+
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'profile', None):
+        # Inherited by worker processes, which write their own trace
+        profiling.enable(args.profile, args.profile_format)
+
+    if getattr(args, 'no_cache', False):
+        # Inherited by batch worker processes too
+        os.environ['ROC_METRIC_CACHE'] = '0'
+
+    if args.command == 'list':
+        for name, spec in METRICS.items():
+            output = spec['output'] if isinstance(spec['output'], list) else [spec['output']]
+            print(f"{name:<25} -> {', '.join(output)}")
+        for name, members in METRIC_GROUPS.items():
+            print(f"{name:<25} = {', '.join(members)}")
+        return
+
+    if args.command == 'batch':
+        try:
+            metrics = expand_metrics(args.metrics.split(','))
+        except ValueError as e:
+            parser.error(str(e))
+        paths = sorted({p for pattern in args.inputs for p in glob.glob(pattern)})
+        if not paths:
+            parser.error(f"No input file matches {args.inputs}")
+        try:
+            skip = check_inputs(paths, metrics, requested=args.metrics != 'all')
+            for path, outputs in run_batch(paths, metrics, args.output_dir, args.workers,
+                                           skip_inapplicable=skip,
+                                           use_cache=not args.no_cache):
+                for output_csv in outputs:
+                    print(f"Done. {os.path.basename(path)} -> {output_csv}")
+        except ValueError as e:
+            parser.error(str(e))
+        return
+
+    if args.command == 'partition':
+        paths = sorted({p for pattern in args.inputs for p in glob.glob(pattern)})
+        if not paths:
+            parser.error(f"No input file matches {args.inputs}")
+        for path in paths:
+            print(f"Done. {path} -> {write_dataset(path, fmt=args.format, chunksize=args.chunksize)}")
+        return
+
+    if args.command == 'stream':
+        from incremental import drop_snapshot
+        from streaming import stream_metrics
+        try:
+            metrics = expand_metrics(args.metrics.split(','))
+            if args.metrics == 'all' or all(m in METRIC_GROUPS for m in args.metrics.split(',')):
+                metrics = [m for m in metrics if METRICS[m].get('per_classroom')]
+            paths = list(resolve_waves(args.wave.split(','), args.input_dir).values())
+            skip = check_inputs(paths, metrics, requested=args.metrics != 'all')
+            for path in paths:
+                columns = wave_columns(path)
+                applicable = [m for m in metrics if not skip
+                              or all(c in columns for c in METRICS[m]['requires'])]
+                for output_csv in stream_metrics(path, applicable, args.output_dir,
+                                                 args.chunksize, args.spill_dir):
+                    print(f"Done. {os.path.basename(path)} -> {output_csv}")
+                drop_snapshot(path, args.output_dir)
+        except (ValueError, FileNotFoundError) as e:
+            parser.error(str(e))
+        return
+
+    if args.command == 'update':
+        from incremental import update_outputs
+        try:
+            metrics = expand_metrics(args.metrics.split(','))
+            paths = list(resolve_waves(args.wave.split(','), args.input_dir).values())
+            skip = check_inputs(paths, metrics, requested=args.metrics != 'all')
+            for path in paths:
+                outputs = update_outputs(path, metrics, args.output_dir,
+                                         skip_inapplicable=skip,
+                                         use_cache=not args.no_cache)
+                for output_csv, n in outputs.items():
+                    how = ('recomputed' if n is None else
+                           'up to date' if n == 0 else f'patched {n} classroom(s)')
+                    print(f"Done. {output_csv} {how}")
+        except (ValueError, FileNotFoundError) as e:
+            parser.error(str(e))
+        return
+
+    try:
+        metrics = expand_metrics(args.metrics.split(','))
+        input_paths = resolve_waves(args.wave.split(','), args.input_dir)
+        skip = check_inputs(list(input_paths.values()), metrics, requested=args.metrics != 'all')
+        tasks = plan_run(input_paths, metrics, args.output_dir,
+                         skip_inapplicable=skip,
+                         use_cache=not args.no_cache)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+
+    results = run_tasks(tasks, workers=args.workers)
+
+    for name in tasks:
+        if not name.startswith(RUN_TASKS):
+            for output_csv in results[name]:
+                print(f"Done. {name} saved to {output_csv}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+'''
+Monte Carlo null model for the classroom cross-ability ratio of
+classroom-segregation-actual.py (ability_metrics.cross_ability_ratio).
+
+Under the null every student keeps their classroom and their number of
+emotional nominations (0-3) and redraws that many distinct classmates at
+random. The number of cross-ability picks of one student is then a
+hypergeometric draw (classmates of the other ability vs. the rest), so a
+classroom's null cross count is a sum of independent hypergeometric
+draws, sampled for all draws and students of a classroom in one call.
+Classrooms are simulated in parallel worker processes, each with its own
+child seed, so results only depend on `seed`.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ability_metrics import cross_ability_ratio
+from profiling import profiled
+
+
+NOMINATION_COLUMNS = ["emot_1", "emot_2", "emot_3"]
+
+
+def classroom_null_inputs(df: pd.DataFrame) -> pd.DataFrame:
+
+    '''
+    One row per nominator: classroom, number of nominations and the number
+    of classmates whose pick would / would not count as cross-ability.
+    As in cross_ability_ratio, a nominator of unknown ability counts any
+    classmate of known ability as cross-ability. Rows without a classroom
+    or student id are skipped, as in the nomination graph.
+    '''
+
+    df = df[["fs_classroom", "fs_student_id", "high_math"] + NOMINATION_COLUMNS]
+    df = df[df["fs_classroom"].notna() & df["fs_student_id"].notna()].copy()
+    df["high_math"] = df["high_math"].map({"yes": 1, "no": 0})
+    df["degree"] = df[NOMINATION_COLUMNS].notna().sum(axis=1)
+
+    # Classmates: unique students of the classroom, with their first listed ability.
+    students = df.drop_duplicates("fs_student_id")
+    map_high = dict(zip(students["fs_student_id"], students["high_math"]))
+    ability = df["fs_student_id"].map(map_high)
+    members = df.drop_duplicates(["fs_classroom", "fs_student_id"])
+    members = members.assign(self_high=members["fs_student_id"].map(map_high))
+    counts = members.groupby("fs_classroom").agg(
+        n_students=("fs_student_id", "size"),
+        n_high=("self_high", lambda x: (x == 1).sum()),
+        n_low=("self_high", lambda x: (x == 0).sum()))
+    counts = counts.reindex(df["fs_classroom"]).to_numpy(dtype=np.int64)
+    n_students, n_high, n_low = counts[:, 0], counts[:, 1], counts[:, 2]
+
+    # Other classmates (the nominator cannot pick themself).
+    others = n_students - 1
+    high_others = n_high - (ability == 1).to_numpy()
+    low_others = n_low - (ability == 0).to_numpy()
+
+    own = df["high_math"].to_numpy()
+    n_cross = np.where(own == 1, low_others,
+                       np.where(own == 0, high_others, high_others + low_others))
+
+    return pd.DataFrame({
+        "fs_classroom": df["fs_classroom"].to_numpy(),
+        "degree": np.minimum(df["degree"].to_numpy(), np.maximum(others, 0)),
+        "n_cross": n_cross.astype(np.int64),
+        "n_other": others - n_cross,
+        "total_nominations": df["degree"].to_numpy(),
+    })
+
+
+def simulate_classrooms(inputs: list, n_draws: int, quantiles: tuple) -> list:
+
+    '''
+    Simulate the null cross-ability ratio of several classrooms.
+    `inputs` holds (observed ratio, n_cross, n_other, degree, total, seed)
+    per classroom. Returns (mean, quantiles, p_lower, p_upper) per classroom.
+    '''
+
+    out = []
+    for observed, n_cross, n_other, degree, total, seed in inputs:
+        rng = np.random.default_rng(seed)
+        draws = rng.hypergeometric(n_cross, n_other, degree,
+                                   size=(n_draws, len(degree))).sum(axis=1) / total
+
+        # Add-one permutation p-values, with a tolerance for float ties.
+        tol = 1e-12
+        p_lower = (1 + np.sum(draws <= observed + tol)) / (1 + n_draws)
+        p_upper = (1 + np.sum(draws >= observed - tol)) / (1 + n_draws)
+        out.append((draws.mean(), np.quantile(draws, quantiles), p_lower, p_upper))
+
+    return out
+
+
+@profiled()
+def simulate_cross_ability_null(df: pd.DataFrame,
+                                n_draws: int = 10000,
+                                seed: int = None,
+                                quantiles: tuple = (0.025, 0.5, 0.975),
+                                workers: int = None) -> pd.DataFrame:
+
+    '''
+    Per classroom: observed cross_ability_ratio, mean and quantiles of its
+    null distribution (`null_q{q}`), and permutation p-values for a ratio
+    at most (`p_lower`, segregation) or at least (`p_upper`) the observed
+    one, plus `p_two_sided`.
+    '''
+
+    observed = cross_ability_ratio(df).set_index("fs_classroom")["cross_ability_ratio"]
+    nominators = classroom_null_inputs(df)
+    nominators = nominators[nominators["fs_classroom"].isin(observed.index)]
+
+    grouped = {c: g for c, g in nominators[nominators["degree"] > 0].groupby("fs_classroom")}
+    totals = nominators.groupby("fs_classroom")["total_nominations"].sum()
+
+    classrooms = [c for c in observed.index if c in grouped]
+    seeds = np.random.SeedSequence(seed).spawn(len(classrooms))
+    inputs = [(observed[c],
+               grouped[c]["n_cross"].to_numpy(), grouped[c]["n_other"].to_numpy(),
+               grouped[c]["degree"].to_numpy(), totals[c], s)
+              for c, s in zip(classrooms, seeds)]
+
+    workers = workers or os.cpu_count()
+    if workers <= 1 or len(inputs) <= 1:
+        results = simulate_classrooms(inputs, n_draws, quantiles)
+    else:
+        chunks = [inputs[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunk_results = list(pool.map(simulate_classrooms, chunks,
+                                          [n_draws] * workers, [quantiles] * workers))
+        results = [None] * len(inputs)
+        for i, chunk in enumerate(chunk_results):
+            results[i::workers] = chunk
+
+    out = pd.DataFrame({"fs_classroom": classrooms,
+                        "cross_ability_ratio": [observed[c] for c in classrooms],
+                        "null_mean": [r[0] for r in results]})
+    for i, q in enumerate(quantiles):
+        out[f"null_q{q:g}"] = [r[1][i] for r in results]
+    out["p_lower"] = [r[2] for r in results]
+    out["p_upper"] = [r[3] for r in results]
+    out["p_two_sided"] = np.minimum(1, 2 * np.minimum(out["p_lower"], out["p_upper"]))
+
+    return out
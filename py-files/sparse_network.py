@@ -0,0 +1,139 @@
+'''
+Block-diagonal sparse adjacency of a whole wave.
+
+Nominations stay within a classroom and the nodes of the nomination
+graph are ordered by classroom, so the adjacency of a relation over all
+students is block diagonal: classroom k is the block
+`classroom_ptr[k]:classroom_ptr[k+1]`. With one scipy.sparse CSR matrix
+per relation, network algebra over every classroom is a single sparse
+operation instead of a loop over classrooms:
+
+    degree             A.sum(axis=1), A.sum(axis=0)
+    reciprocity        A.multiply(A.T)          (mutual ties)
+    two-step reach     A @ A                    (stays block diagonal)
+    mixing counts      1[a] * (A @ 1[b])        (1[x]: group indicator)
+
+and per-classroom totals are bincounts over the node's classroom.
+
+Usage:
+    from nomination_graph import read_nomination_graph
+    from sparse_network import wave_matrices
+    graph = read_nomination_graph('input-files/roc_network_data_endline.csv')
+    A = wave_matrices(graph)['friend']
+'''
+
+import numpy as np
+import pandas as pd
+
+from ability_metrics import ability_codes, lookup_ability
+from nomination_graph import NominationGraph
+from profiling import profiled
+
+
+def relation_matrix(graph: NominationGraph, relation: str):
+
+    '''
+    n_nodes x n_nodes CSR adjacency of a relation: 1 where the row
+    student nominates the column student. Repeated ties count once and
+    self-nominations and ties leaving the classroom are dropped, so the
+    matrix has an empty diagonal and is block diagonal on
+    `graph.classroom_ptr`.
+    '''
+
+    import scipy.sparse as sp
+
+    src, dst = graph.edges(relation, within_classroom=True, unique=True, drop_self=True)
+    indptr = np.zeros(graph.n_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=graph.n_nodes))
+
+    return sp.csr_matrix((np.ones(len(dst), dtype=np.int32), dst, indptr),
+                         shape=(graph.n_nodes, graph.n_nodes))
+
+
+def wave_matrices(graph: NominationGraph, relations=None) -> dict:
+
+    '''
+    {relation: CSR adjacency} for the relations of the graph (or `relations`).
+    '''
+
+    return {r: relation_matrix(graph, r) for r in (relations or graph.relations)}
+
+
+def node_groups(graph: NominationGraph, ds: pd.DataFrame, column: str = 'high_math') -> np.ndarray:
+
+    '''
+    Group code of each node from its first row: 1 for "yes", 0 for "no",
+    -1 if missing.
+    '''
+
+    codes = lookup_ability(ability_codes(ds, [column])[:, 0], graph.first_row)
+
+    return np.where(np.isnan(codes), -1, codes).astype(np.int8)
+
+
+def mixing_counts(graph: NominationGraph, matrix, groups: np.ndarray, n_groups: int = 2) -> np.ndarray:
+
+    '''
+    Ties from group a to group b in each classroom, as an
+    (n_classrooms, n_groups, n_groups) array. Nodes of group -1 are left
+    out.
+    '''
+
+    out = np.zeros((graph.n_classrooms, n_groups, n_groups))
+    for b in range(n_groups):
+        # Ties of each node to group-b nominees: A @ 1[group b]
+        to_b = matrix @ (groups == b).astype(np.int64)
+        for a in range(n_groups):
+            out[:, a, b] = graph.classroom_sum(np.where(groups == a, to_b, 0))
+
+    return out
+
+
+@profiled()
+def network_algebra(graph: NominationGraph, ds: pd.DataFrame = None,
+                    relations=None) -> pd.DataFrame:
+
+    '''
+    Per classroom and relation, from sparse operations over all classrooms:
+      - ties_{r}: distinct ties within the classroom
+      - mean_degree_{r}: ties per student
+      - mutual_dyads_{r}, reciprocity_share_{r}: reciprocated pairs and
+        share of ties that are reciprocated (A.multiply(A.T))
+      - mean_two_step_reach_{r}: students reachable in one or two steps,
+        per student (A + A @ A, self excluded)
+      - mixing_{r}_{low|high}_{low|high}: ties between math abilities,
+        when `ds` with a high_math column is given
+    '''
+
+    relations = list(relations or graph.relations)
+    sizes = graph.classroom_sizes()
+    groups = node_groups(graph, ds) if ds is not None and 'high_math' in ds.columns else None
+
+    out = {graph.schema['classroom']: graph.classroom_ids}
+    for relation in relations:
+        A = relation_matrix(graph, relation)
+        out_degree = np.asarray(A.sum(axis=1)).ravel()
+        ties = graph.classroom_sum(out_degree)
+
+        mutual = A.multiply(A.T)
+        reciprocated = graph.classroom_sum(np.asarray(mutual.sum(axis=1)).ravel())
+
+        reach = (A + A @ A).tocoo()
+        beyond_self = reach.row != reach.col
+        reach_count = np.bincount(reach.row[beyond_self], minlength=graph.n_nodes)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[f'ties_{relation}'] = ties.astype(np.int64)
+            out[f'mean_degree_{relation}'] = np.where(sizes > 0, ties / np.maximum(sizes, 1), np.nan)
+            out[f'mutual_dyads_{relation}'] = (reciprocated // 2).astype(np.int64)
+            out[f'reciprocity_share_{relation}'] = np.where(ties > 0, reciprocated / ties, 0)
+            out[f'mean_two_step_reach_{relation}'] = np.where(
+                sizes > 0, graph.classroom_sum(reach_count) / np.maximum(sizes, 1), np.nan)
+
+        if groups is not None:
+            mixing = mixing_counts(graph, A, groups)
+            for a, a_name in enumerate(('low', 'high')):
+                for b, b_name in enumerate(('low', 'high')):
+                    out[f'mixing_{relation}_{a_name}_{b_name}'] = mixing[:, a, b].astype(np.int64)
+
+    return pd.DataFrame(out)
@@ -0,0 +1,214 @@
+'''
+Streaming, chunked computation of the per-classroom metrics for wave
+files too large to load at once.
+
+Nominations stay within a classroom (a student id starts with the
+classroom id), so a per-classroom metric only needs the rows of one
+classroom at a time. The input is read in chunks and cut into batches
+of complete classrooms; each batch is computed and appended to the
+outputs, so memory is bounded by the chunk size and the largest
+classroom rather than the file:
+
+  - a first pass reads only the classroom column, to check whether each
+    classroom's rows are contiguous in the file;
+  - if they are, chunks are streamed directly and a classroom is
+    processed as soon as the next one starts;
+  - otherwise rows are first spilled to hash buckets of complete
+    classrooms (about one chunk each) on disk, then each bucket is
+    processed in turn.
+
+Per-classroom outputs are written in batch order, not sorted by
+classroom as `run` writes them.
+
+Usage:
+    python py-files/roc_network.py stream --wave follow_up --chunksize 200000
+'''
+
+import os
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ingest import coerce_ids, wave_columns
+from metric_cache import metric_cache_disabled
+from nomination_graph import build_nomination_graph, detect_schema, nomination_columns
+from profiling import stage
+
+
+def scan_classrooms(path: str, classroom: str, chunksize: int) -> tuple:
+
+    '''
+    Read only the classroom column of `path`. Returns (rows per classroom,
+    True if every classroom's rows are contiguous).
+    '''
+
+    counts = {}
+    grouped, last = True, None
+    for chunk in pd.read_csv(path, usecols=[classroom], chunksize=chunksize):
+        values = chunk[classroom].fillna(-1).to_numpy()
+        starts = np.ones(len(values), dtype=bool)
+        starts[1:] = values[1:] != values[:-1]
+        if len(values) and values[0] == last:
+            starts[0] = False
+
+        for value in values[starts]:
+            if value in counts:
+                grouped = False
+            counts.setdefault(value, 0)
+        for value, n in pd.Series(values).value_counts().items():
+            counts[value] += n
+        if len(values):
+            last = values[-1]
+
+    return counts, grouped
+
+
+def cross_classroom_nominations(chunk: pd.DataFrame, schema: dict) -> int:
+
+    '''
+    Number of nominations in `chunk` whose nominee id does not start with
+    the nominator's classroom id. Those nominees may not be in the same
+    batch, so they can be seen as unknown in streaming mode.
+    '''
+
+    classrooms = chunk[schema['classroom']].to_numpy(dtype='float64', na_value=np.nan)
+    students = chunk[schema['student']].to_numpy(dtype='float64', na_value=np.nan)
+    valid = ~np.isnan(classrooms) & ~np.isnan(students) & (classrooms > 0)
+    if not valid.any():
+        return 0
+
+    # Student ids are the classroom id followed by a fixed number of digits
+    digits = len(str(int(students[valid][0]))) - len(str(int(classrooms[valid][0])))
+    divisor = 10 ** max(digits, 0)
+
+    count = 0
+    for prefix in schema['relations'].values():
+        for c in nomination_columns(chunk.columns, prefix):
+            nominees = chunk[c].to_numpy(dtype='float64', na_value=np.nan)
+            known = ~np.isnan(nominees)
+            count += int((np.floor(nominees[known] / divisor) != classrooms[known]).sum())
+
+    return count
+
+
+def read_chunks(path: str, chunksize: int, row_column: str = None):
+
+    '''
+    Read `path` in chunks, numbering rows in `row_column` if given.
+    '''
+
+    offset = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        if row_column:
+            chunk[row_column] = np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def iter_classroom_batches(path: str, chunksize: int = 100_000,
+                           spill_dir: str = None, row_column: str = None):
+
+    '''
+    Yield DataFrames of complete classrooms of `path`, each about
+    `chunksize` rows (or one classroom, if larger), with typed ID columns.
+    With `row_column`, each row's position in the file is kept in that
+    column. A partitioned dataset (see wave_dataset.py) is read a few
+    classroom files at a time.
+    '''
+
+    from wave_dataset import is_dataset, iter_dataset_batches
+    if is_dataset(path):
+        yield from iter_dataset_batches(path, chunksize, row_column)
+        return
+
+    schema = detect_schema(pd.read_csv(path, nrows=0).columns)
+    classroom = schema['classroom']
+    counts, grouped = scan_classrooms(path, classroom, chunksize)
+
+    if grouped:
+        pending = []
+        n_pending = 0
+        for chunk in read_chunks(path, chunksize, row_column):
+            chunk = coerce_ids(chunk)
+            values = chunk[classroom]
+            # Everything before the chunk's last classroom is complete
+            last = values.iloc[-1]
+            tail = (values == last) if pd.notna(last) else values.isna()
+            cut = len(chunk) - int(tail[::-1].cummin().sum())
+            pending.append(chunk.iloc[:cut])
+            n_pending += cut
+            if n_pending >= chunksize:
+                yield pd.concat(pending, ignore_index=True)
+                pending, n_pending = [], 0
+            pending.append(chunk.iloc[cut:])
+            n_pending += len(chunk) - cut
+        if n_pending:
+            yield pd.concat(pending, ignore_index=True)
+        return
+
+    n_buckets = max(1, -(-sum(counts.values()) // chunksize))
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp:
+        buckets = set()
+        for chunk in read_chunks(path, chunksize, row_column):
+            ids = pd.to_numeric(chunk[classroom], errors='coerce').fillna(0).astype(np.int64)
+            for bucket, rows in chunk.groupby(ids.to_numpy() % n_buckets):
+                spill = os.path.join(tmp, f'{bucket}.csv')
+                rows.to_csv(spill, mode='a', header=bucket not in buckets, index=False)
+                buckets.add(bucket)
+
+        for bucket in sorted(buckets):
+            yield coerce_ids(pd.read_csv(os.path.join(tmp, f'{bucket}.csv')))
+
+
+def stream_metrics(path: str, metrics: list, output_dir: str,
+                   chunksize: int = 100_000, spill_dir: str = None) -> list:
+
+    '''
+    Compute per-classroom `metrics` (METRICS entries with `per_classroom`)
+    on `path` batch by batch, appending each batch's rows to the outputs.
+    Returns the written output paths.
+    '''
+
+    from roc_network import METRICS, output_name, variant_of
+
+    columns = wave_columns(path)
+    schema = detect_schema(columns)
+    for metric in metrics:
+        spec = METRICS[metric]
+        if not spec.get('per_classroom'):
+            raise ValueError(f"Metric '{metric}' is not per classroom and cannot be streamed.")
+        missing = [c for c in spec['requires'] if c not in columns]
+        if missing:
+            raise ValueError(f"Metric '{metric}' needs columns {missing} "
+                             f"that {os.path.basename(path)} does not have.")
+
+    outputs = {m: os.path.join(output_dir, output_name(m, variant_of(path))) for m in metrics}
+    partial = {m: f'{out}.{os.getpid()}.tmp' for m, out in outputs.items()}
+    needs_graph = any('graph' in METRICS[m]['inputs'] for m in metrics)
+
+    cross, first = 0, True
+    with metric_cache_disabled():
+        for batch in iter_classroom_batches(path, chunksize, spill_dir):
+            with stage('batch', rows=len(batch)):
+                cross += cross_classroom_nominations(batch, schema)
+                graph = build_nomination_graph(batch) if needs_graph else None
+                for metric in metrics:
+                    spec = METRICS[metric]
+                    inputs = [batch if i == 'ds' else graph for i in spec['inputs']]
+                    spec['compute'](schema['wave'], *inputs).to_csv(
+                        partial[metric], mode='w' if first else 'a', header=first, index=False)
+            first = False
+
+    if first:
+        raise ValueError(f"{os.path.basename(path)} has no rows.")
+
+    if cross:
+        warnings.warn(f"{cross} nominations in {os.path.basename(path)} point outside the "
+                      "nominator's classroom; streamed metrics may see those nominees as unknown.")
+
+    for metric in metrics:
+        os.replace(partial[metric], outputs[metric])
+
+    return list(outputs.values())
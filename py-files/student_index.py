@@ -0,0 +1,246 @@
+'''
+Dense, reversible integer encoding of the student ids of a wave.
+
+Student ids are 10-digit numbers (often parsed as float64) made of the
+classroom id followed by a 3-digit number. A StudentIndex assigns each
+unique student a contiguous int32 index, ordered by classroom and then
+by student id, so the students of classroom k are the indices
+`classroom_ptr[k]:classroom_ptr[k+1]`. Joins on student ids then become
+array indexing: arrays of nominees hold int32 indices instead of
+float64 ids, and per-student counts are bincounts.
+
+Encoding uses the classroom prefix: the classroom of an id is found
+among the few classroom ids, and its number within the classroom
+indexes a small per-classroom slot table. Ids that do not follow the
+prefix structure fall back to a binary search over the sorted ids.
+
+The mapping table (index, classroom_id, student_id) can be saved next to
+outputs that carry indices, so they can be decoded back to original ids.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def to_id_array(values) -> np.ndarray:
+
+    '''
+    Coerce an ID column (int, float with NaN, or str) into int64.
+    Missing or unparsable values become -1.
+    '''
+
+    values = pd.to_numeric(pd.Series(values), errors='coerce')
+    if pd.api.types.is_integer_dtype(values.dtype):
+        # int64 / nullable Int64 ids: no float round-trip.
+        return values.astype('Int64').fillna(-1).to_numpy(dtype=np.int64)
+
+    values = values.to_numpy(dtype='float64', na_value=np.nan)
+    out = np.full(values.shape, -1, dtype=np.int64)
+    valid = ~np.isnan(values)
+    out[valid] = values[valid].astype(np.int64)
+
+    return out
+
+
+def prefix_divisor(student_ids: np.ndarray, classrooms: np.ndarray) -> int:
+
+    '''
+    10**k if every student id is its classroom id followed by k digits,
+    else 0.
+    '''
+
+    if len(student_ids) == 0 or (classrooms <= 0).any():
+        return 0
+
+    digits = len(str(int(student_ids[0]))) - len(str(int(classrooms[0])))
+    if digits <= 0 or digits > 6:
+        return 0
+    divisor = 10 ** digits
+
+    return divisor if (student_ids // divisor == classrooms).all() else 0
+
+
+class StudentIndex:
+
+    '''
+    Student id <-> int32 index mapping of one wave (see the module
+    docstring). `student_ids[i]` is the original id of index i.
+    '''
+
+    def __init__(self, student_ids, classroom_ids, node_classroom):
+
+        self.student_ids = np.asarray(student_ids, dtype=np.int64)
+        self.classroom_ids = np.asarray(classroom_ids, dtype=np.int64)
+        self.node_classroom = np.asarray(node_classroom, dtype=np.int32)
+        self.classroom_ptr = np.zeros(len(self.classroom_ids) + 1, dtype=np.int32)
+        self.classroom_ptr[1:] = np.cumsum(np.bincount(self.node_classroom,
+                                                       minlength=len(self.classroom_ids)))
+
+        self._classroom_sorter = np.argsort(self.classroom_ids, kind='stable')
+        self._sorted_classrooms = self.classroom_ids[self._classroom_sorter]
+        self.divisor = 0
+        sorted_ids = np.sort(self.student_ids)
+        if (sorted_ids[1:] != sorted_ids[:-1]).all():
+            self.divisor = prefix_divisor(self.student_ids, self.classroom_ids[self.node_classroom])
+
+        if self.divisor:
+            # Slot table: classroom k covers the numbers lo[k]..hi[k]
+            local = self.student_ids - self.classroom_ids[self.node_classroom] * self.divisor
+            n = len(self.classroom_ids)
+            lo = np.full(n, self.divisor, dtype=np.int64)
+            hi = np.full(n, -1, dtype=np.int64)
+            np.minimum.at(lo, self.node_classroom, local)
+            np.maximum.at(hi, self.node_classroom, local)
+            width = np.maximum(hi - lo + 1, 0)
+            if width.sum() > 8 * len(self.student_ids) + 4096:
+                # Sparse numbering within classrooms: not worth a table
+                self.divisor = 0
+            else:
+                self._lo, self._hi = lo, hi
+                self._base = np.concatenate([[0], np.cumsum(width)[:-1]])
+                self._slots = np.full(int(width.sum()), -1, dtype=np.int32)
+                self._slots[self._base[self.node_classroom] + local - lo[self.node_classroom]] = \
+                    np.arange(len(self.student_ids), dtype=np.int32)
+
+        if not self.divisor:
+            self._sorter = np.argsort(self.student_ids, kind='stable')
+            self._sorted_ids = self.student_ids[self._sorter]
+
+    @classmethod
+    def from_rows(cls, row_students, row_classrooms) -> tuple:
+
+        '''
+        Index of the students of wave rows (id columns or arrays, missing
+        ids skipped). A student listed on several rows gets one index.
+        Returns (index, first row of each index, index of each row or -1,
+        rows with a student sorted by classroom and student).
+        '''
+
+        row_students = to_id_array(row_students)
+        row_classrooms = to_id_array(row_classrooms)
+        rows = np.flatnonzero((row_students >= 0) & (row_classrooms >= 0))
+
+        # Unique students sorted by (classroom, student)
+        order = rows[np.lexsort((row_students[rows], row_classrooms[rows]))]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = row_students[order[1:]] != row_students[order[:-1]]
+        first_row = order[keep]
+
+        classroom_ids, node_classroom = np.unique(row_classrooms[first_row], return_inverse=True)
+        index = cls(row_students[first_row], classroom_ids, node_classroom)
+
+        row_node = np.full(len(row_students), -1, dtype=np.int32)
+        row_node[order] = index.encode(row_students[order])
+
+        return index, first_row.astype(np.int64), row_node, order
+
+    @classmethod
+    def from_table(cls, table: pd.DataFrame) -> 'StudentIndex':
+
+        '''
+        Rebuild an index from its mapping table (see `table`).
+        '''
+
+        table = table.sort_values('index')
+        classroom_ids, node_classroom = np.unique(table['classroom_id'].to_numpy(dtype=np.int64),
+                                                  return_inverse=True)
+
+        return cls(table['student_id'].to_numpy(dtype=np.int64), classroom_ids, node_classroom)
+
+    @property
+    def n_students(self) -> int:
+        return len(self.student_ids)
+
+    @property
+    def n_classrooms(self) -> int:
+        return len(self.classroom_ids)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.student_ids, self.classroom_ids, self.node_classroom, self.classroom_ptr]
+        arrays += [self._slots, self._base, self._lo, self._hi] if self.divisor else [self._sorter]
+        return sum(a.nbytes for a in arrays)
+
+    def classroom_index(self, classroom_ids) -> np.ndarray:
+
+        '''
+        Position of classroom ids in `classroom_ids` (-1 if unknown).
+        '''
+
+        classroom_ids = np.asarray(classroom_ids)
+        if classroom_ids.dtype != np.int64:
+            classroom_ids = to_id_array(classroom_ids)
+        if self.n_classrooms == 0:
+            return np.full(classroom_ids.shape, -1, dtype=np.int32)
+
+        pos = np.minimum(np.searchsorted(self._sorted_classrooms, classroom_ids), self.n_classrooms - 1)
+        found = (self._sorted_classrooms[pos] == classroom_ids) & (classroom_ids >= 0)
+
+        return np.where(found, self._classroom_sorter[pos], -1).astype(np.int32)
+
+    def encode(self, ids) -> np.ndarray:
+
+        '''
+        Map original student ids (any shape) to int32 indices, -1 for
+        missing or unknown ids.
+        '''
+
+        if isinstance(ids, pd.DataFrame):
+            ids = np.column_stack([to_id_array(ids[c]) for c in ids.columns])
+        elif isinstance(ids, np.ndarray) and ids.dtype == np.int64:
+            # Already parsed ids (-1 for missing)
+            pass
+        elif isinstance(ids, pd.Series) or np.ndim(ids) == 1:
+            ids = to_id_array(ids)
+        else:
+            ids = to_id_array(np.ravel(ids)).reshape(np.shape(ids))
+        if self.n_students == 0:
+            return np.full(ids.shape, -1, dtype=np.int32)
+
+        if self.divisor:
+            classrooms = ids // self.divisor
+            c = self.classroom_index(classrooms)
+            local = ids - classrooms * self.divisor
+            cc = np.maximum(c, 0)
+            offset = local - self._lo[cc]
+            inside = (c >= 0) & (ids >= 0) & (offset >= 0) & (local <= self._hi[cc])
+            return np.where(inside, self._slots[np.where(inside, self._base[cc] + offset, 0)], -1)
+
+        pos = np.minimum(np.searchsorted(self._sorted_ids, ids), self.n_students - 1)
+        found = (self._sorted_ids[pos] == ids) & (ids >= 0)
+
+        return np.where(found, self._sorter[pos], -1).astype(np.int32)
+
+    def decode(self, indices, missing=-1) -> np.ndarray:
+
+        '''
+        Original student ids of int32 indices; `missing` for negative
+        indices.
+        '''
+
+        indices = np.asarray(indices)
+        if self.n_students == 0:
+            return np.full(indices.shape, missing)
+
+        ids = self.student_ids[np.maximum(indices, 0)]
+
+        return np.where(indices >= 0, ids, missing)
+
+    def table(self) -> pd.DataFrame:
+
+        '''
+        Mapping table: one row per index with its classroom and student id.
+        '''
+
+        return pd.DataFrame({'index': np.arange(self.n_students, dtype=np.int32),
+                             'classroom_id': self.classroom_ids[self.node_classroom],
+                             'student_id': self.student_ids})
+
+    def save(self, path: str):
+
+        self.table().to_csv(path, index=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'StudentIndex':
+
+        return cls.from_table(pd.read_csv(path))
@@ -0,0 +1,179 @@
+'''
+Synthetic waves in the exact schema of roc_network_data_endline.csv and
+roc_network_data_follow_up.csv, for benchmarks and scale tests.
+
+Ids follow the real structure: school ids are 6 digits, a classroom id
+is its school id plus a section digit and a student id is its classroom
+id plus 3 digits. Every student nominates 0-3 distinct classmates per
+relation; a share of the students returns one of the nominations they
+received (reciprocity), and a share of the nominated classmates has no
+row of their own (absent on the survey day), as in the real files.
+Everything is generated with vectorized numpy (about 4 s per million
+students).
+
+Usage:
+    from synthetic_waves import generate_wave
+    ds = generate_wave('follow_up', n_students=100_000, seed=1)
+'''
+
+import numpy as np
+import pandas as pd
+
+from nomination_graph import WAVE_SCHEMAS
+
+
+def classroom_layout(n_students: int, rng, class_size=(25, 60), sections=(1, 4)) -> tuple:
+
+    '''
+    Classroom of every student: returns (school id, classroom id, local
+    index within the classroom, classroom size) per student.
+    '''
+
+    mean_size = (class_size[0] + class_size[1]) / 2
+    n_classrooms = max(1, int(np.ceil(n_students / mean_size * 1.2)))
+    sizes = rng.integers(class_size[0], class_size[1] + 1, size=n_classrooms)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), n_students) + 1]
+    sizes[-1] -= sizes.sum() - n_students
+    if sizes[-1] < 5 and len(sizes) > 1:
+        sizes[-2] += sizes[-1]
+        sizes = sizes[:-1]
+
+    # Schools with 1-3 sections each; classroom = school * 10 + section
+    per_school = rng.integers(sections[0], sections[1], size=len(sizes))
+    per_school = per_school[:np.searchsorted(np.cumsum(per_school), len(sizes)) + 1]
+    school_of_class = np.repeat(np.arange(len(per_school)), per_school)[:len(sizes)]
+    section = np.arange(len(sizes)) - np.repeat(np.cumsum(per_school) - per_school, per_school)[:len(sizes)] + 1
+    schools = 100_000 + school_of_class
+    classrooms = schools * 10 + section
+
+    classroom_of = np.repeat(np.arange(len(sizes)), sizes)
+    local = np.arange(n_students) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    return schools[classroom_of], classrooms[classroom_of], local, sizes[classroom_of]
+
+
+def distinct_offsets(sizes: np.ndarray, k: int, rng) -> np.ndarray:
+
+    '''
+    For each student, k distinct offsets in 1..size-1 (classmates other
+    than the student itself), drawn uniformly without replacement.
+    '''
+
+    offsets = np.zeros((len(sizes), k), dtype=np.int64)
+    for j in range(k):
+        # Uniform over the size-1-j offsets not drawn yet: draw a rank and
+        # skip past the already drawn offsets in increasing order.
+        value = rng.integers(0, np.maximum(sizes - 1 - j, 1)) + 1
+        for previous in np.sort(offsets[:, :j], axis=1).T:
+            value += value >= previous
+        offsets[:, j] = value
+
+    return offsets
+
+
+def nominations(local: np.ndarray, sizes: np.ndarray, rng, slots: int = 3,
+                degree_p=(0.05, 0.1, 0.15, 0.7), reciprocity: float = 0.3) -> np.ndarray:
+
+    '''
+    Local index of the nominated classmates, (students, slots), -1 for an
+    empty slot. With probability `reciprocity`, a student's first
+    nomination goes back to one of the classmates who nominated them.
+    '''
+
+    n = len(local)
+    degree = rng.choice(len(degree_p), size=n, p=degree_p)
+    degree = np.minimum(degree, sizes - 1)
+    targets = (local[:, None] + distinct_offsets(sizes, slots, rng)) % sizes[:, None]
+    targets[np.arange(slots)[None, :] >= degree[:, None]] = -1
+
+    if reciprocity > 0:
+        start = np.arange(n) - local                      # first student of the classroom
+        src, slot = np.nonzero(targets >= 0)
+        dst = start[src] + targets[src, slot]
+        # One random nominator per nominated student (last write wins)
+        order = rng.permutation(len(dst))
+        nominator_of = np.full(n, -1)
+        nominator_of[dst[order]] = src[order]
+        nominated = np.flatnonzero(nominator_of >= 0)
+        nominator = nominator_of[nominated]
+
+        back = (rng.random(len(nominated)) < reciprocity) & (degree[nominated] > 0)
+        nominated, nominator = nominated[back], nominator[back]
+        back_local = local[nominator]
+        fresh = ~(targets[nominated] == back_local[:, None]).any(axis=1)
+        targets[nominated[fresh], 0] = back_local[fresh]
+
+    return targets
+
+
+def ability(n: int, rng, high_share: float, missing_share: float) -> np.ndarray:
+
+    values = np.where(rng.random(n) < high_share, 'yes', 'no').astype(object)
+    values[rng.random(n) < missing_share] = np.nan
+
+    return values
+
+
+def generate_wave(wave: str = 'follow_up', n_students: int = 10_000, seed: int = None,
+                  class_size=(25, 60), high_share: float = 0.5, missing_share: float = 0.02,
+                  reciprocity: float = 0.3, absent_share: float = 0.1,
+                  degree_p=(0.05, 0.1, 0.15, 0.7)) -> pd.DataFrame:
+
+    '''
+    A synthetic wave ('endline' or 'follow_up') of about `n_students`
+    rows, in the column order of the real file. The follow-up wave also
+    gets the s_merge_id and high_raven/high_bangla/high_eyes columns the
+    ability metrics use.
+
+    high_share:    share of high-ability students, per ability
+    missing_share: share of missing abilities
+    reciprocity:   share of nominated students returning a nomination
+    absent_share:  share of students nominated but without a row
+    '''
+
+    if wave not in WAVE_SCHEMAS:
+        raise ValueError(f"Unknown wave '{wave}'. Choose from: {', '.join(WAVE_SCHEMAS)}")
+
+    rng = np.random.default_rng(seed)
+    roster = int(np.ceil(n_students / (1 - absent_share)))
+    schools, classrooms, local, sizes = classroom_layout(roster, rng, class_size)
+    student_ids = classrooms * 1000 + 100 + local
+    start = np.arange(roster) - local
+
+    schema = WAVE_SCHEMAS[wave]
+    columns = {}
+    for relation, prefix in schema['relations'].items():
+        targets = nominations(local, sizes, rng, degree_p=degree_p, reciprocity=reciprocity)
+        ids = np.where(targets >= 0, student_ids[start[:, None] + np.maximum(targets, 0)], np.nan)
+        for j in range(ids.shape[1]):
+            columns[f'{prefix}{j + 1}'] = ids[:, j]
+
+    present = np.sort(rng.choice(roster, size=min(n_students, roster), replace=False))
+    merge_id = (pd.Series(schools[present]).astype(str) + '_'
+                + pd.Series(student_ids[present] % 1000).astype(str)).to_numpy()
+
+    if wave == 'endline':
+        ds = pd.DataFrame({
+            's_merge_id': merge_id,
+            'classroom_id': classrooms[present],
+            'student_id': student_ids[present],
+            **{c: v[present] for c, v in columns.items() if c.startswith('friend_')},
+            **{c: v[present] for c, v in columns.items() if c.startswith('support_')},
+            'el': np.where(rng.random(len(present)) < 0.9, 'yes', 'no'),
+            'high_math': ability(len(present), rng, high_share, missing_share),
+        })
+    else:
+        ds = pd.DataFrame({
+            'fs_classroom': classrooms[present],
+            'fs_school_id': schools[present],
+            'fl': (rng.random(len(present)) < 0.9).astype(int),
+            'fs_student_id': student_ids[present],
+            'high_math': ability(len(present), rng, high_share, missing_share),
+            **{c: v[present] for c, v in columns.items() if c.startswith('emot_')},
+            **{c: v[present] for c, v in columns.items() if c.startswith('academic_')},
+            's_merge_id': merge_id,
+            **{f'high_{a}': ability(len(present), rng, high_share, missing_share)
+               for a in ('raven', 'bangla', 'eyes')},
+        })
+
+    return ds
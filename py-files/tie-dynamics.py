@@ -0,0 +1,28 @@
+import sys
+
+from ingest import load_wave
+from profiling import stage
+from tie_dynamics import tie_dynamics, transition_matrix
+
+# 1) Load both waves. Students are linked on s_merge_id, which both files
+#    must have: endline and follow-up number students differently, so
+#    their student_id / fs_student_id are not linked.
+endline = load_wave("/workspaces/ROC-network-analysis/input-files/roc_network_data_endline.csv")
+follow_up = load_wave("/workspaces/ROC-network-analysis/input-files/roc_network_data_follow_up.csv")
+
+# 2) Persisted / dissolved / formed ties, Jaccard stability and isolation
+#    transitions, friend -> emot and support -> academic
+try:
+    students, classrooms = tie_dynamics(endline, follow_up)
+except ValueError as e:
+    sys.exit(f"Tie dynamics not computed. {e}")
+
+# 3) Write to CSV
+with stage("to_csv", rows=len(students)):
+    students.to_csv("/workspaces/ROC-network-analysis/output-files/roc_tie_dynamics_students.csv", index=False)
+with stage("to_csv", rows=len(classrooms)):
+    classrooms.to_csv("/workspaces/ROC-network-analysis/output-files/roc_tie_dynamics_classrooms.csv", index=False)
+
+print("Done. 'roc_tie_dynamics_students.csv' and 'roc_tie_dynamics_classrooms.csv' saved.")
+print("Isolation transitions, friend -> emot:")
+print(transition_matrix(classrooms, "friend_emot"))
@@ -0,0 +1,299 @@
+'''
+Tie dynamics between waves (endline -> follow-up, and any later waves).
+
+Students are aligned across waves on s_merge_id, which every wave must
+have, or on an explicit id mapping (`id_map`: one row per student, one
+column per wave's student id column, e.g. `student_id` and
+`fs_student_id`). The waves number students differently, so their raw
+ids are never linked unless asked for (`allow_student_id=True`, which
+warns): equal ids in two waves are mostly different children. Each
+student gets one code shared by all waves, and each tie becomes a packed int64 key
+`nominator code * n_students + nominee code`. Comparing two waves is
+then a join of two sorted key arrays:
+
+    persisted   ties of both waves
+    dissolved   ties of the earlier wave only
+    formed      ties of the later wave only
+
+Only ties whose two students are in both waves are compared (a tie to a
+student who left cannot persist). Relations are paired across the
+schema rename, by default friend -> emot and support -> academic.
+
+Per student (in both waves) and per classroom (of the earlier wave):
+persisted, dissolved and formed ties, Jaccard stability of the tie sets
+(persisted / (persisted + dissolved + formed)) and the transitions
+between isolated (nominated by nobody) and connected.
+
+Usage:
+    from ingest import read_wave
+    from tie_dynamics import tie_dynamics
+    students, classrooms = tie_dynamics(read_wave('input-files/roc_network_data_endline.csv'),
+                                        read_wave('input-files/roc_network_data_follow_up.csv'))
+'''
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from graph_metrics import contains
+from nomination_graph import build_nomination_graph, detect_schema, sorted_unique
+from profiling import profiled, step
+from student_index import to_id_array
+
+
+# Relations compared across waves of different schemas: (earlier, later).
+# Waves of the same schema compare each relation with itself.
+RELATION_PAIRS = {
+    ('endline', 'follow_up'): [('friend', 'emot'), ('support', 'academic')],
+}
+
+TRANSITIONS = ('isolated_to_isolated', 'isolated_to_connected',
+               'connected_to_isolated', 'connected_to_connected')
+
+
+def linking_key(datasets: list, allow_student_id: bool = False) -> list:
+
+    '''
+    Column linking students across the waves, one per wave: s_merge_id.
+    Without it in every wave, raise, or with `allow_student_id` link on
+    the waves' own student ids with a warning.
+    '''
+
+    if all('s_merge_id' in ds.columns for ds in datasets):
+        return ['s_merge_id'] * len(datasets)
+
+    if not allow_student_id:
+        raise ValueError("Cannot link students across waves: not every wave has s_merge_id. "
+                         "Pass an id_map, or allow_student_id=True to link on raw student ids.")
+
+    keys = [detect_schema(ds.columns)['student'] for ds in datasets]
+    warnings.warn(f"Linking students on raw ids ({', '.join(keys)}): the waves number "
+                  "students differently, so equal ids may be different children.")
+
+    return keys
+
+
+def mapped_codes(graph, id_map: pd.DataFrame) -> np.ndarray:
+
+    '''
+    Row of `id_map` of each node of a wave (NaN if not in the mapping),
+    looked up on the wave's student id column.
+    '''
+
+    column = graph.schema['student']
+    if column not in id_map.columns:
+        raise ValueError(f"id_map has no '{column}' column to link {graph.schema['wave']} students.")
+
+    ids = to_id_array(id_map[column])
+    known = ids >= 0
+    rows = pd.Series(np.flatnonzero(known).astype(float), index=ids[known])
+    if rows.index.duplicated().any():
+        raise ValueError(f"id_map lists some '{column}' ids more than once.")
+
+    return rows.reindex(graph.student_ids).to_numpy()
+
+
+def relation_pairs(before: dict, after: dict) -> list:
+
+    '''
+    (earlier relation, later relation) pairs of two wave schemas.
+    '''
+
+    if before['wave'] == after['wave']:
+        return [(r, r) for r in before['relations']]
+    if (after['wave'], before['wave']) in RELATION_PAIRS:
+        return [(r1, r0) for r0, r1 in RELATION_PAIRS[(after['wave'], before['wave'])]]
+
+    return RELATION_PAIRS[(before['wave'], after['wave'])]
+
+
+class AlignedWaves:
+
+    '''
+    Nomination graphs of several waves with a shared student code:
+    `codes[t][i]` is the code of node i of wave t (-1 if it has no
+    linking key or is not in `id_map`) and `nodes[t][c]` the node of
+    code c in wave t (-1 if absent). `keys` names the linking column of
+    each wave explicitly; by default it is s_merge_id (see linking_key).
+    '''
+
+    def __init__(self, datasets: list, keys=None, id_map: pd.DataFrame = None,
+                 allow_student_id: bool = False):
+
+        self.datasets = datasets
+        self.graphs = [build_nomination_graph(ds) for ds in datasets]
+        self.schemas = [g.schema for g in self.graphs]
+
+        # 1) One code per student over all waves
+        if id_map is not None:
+            values = [pd.Series(mapped_codes(g, id_map)) for g in self.graphs]
+        else:
+            values = self.key_values(keys or linking_key(datasets, allow_student_id))
+        codes, uniques = pd.factorize(pd.concat(values, ignore_index=True))
+        self.n_students = len(uniques)
+
+        # 2) Split back per wave and invert
+        bounds = np.cumsum([0] + [g.n_nodes for g in self.graphs])
+        self.codes, self.nodes = [], []
+        for t, graph in enumerate(self.graphs):
+            wave_codes = codes[bounds[t]:bounds[t + 1]].astype(np.int64)
+            nodes = np.full(self.n_students, -1, dtype=np.int64)
+            known = wave_codes >= 0
+            nodes[wave_codes[known]] = np.flatnonzero(known)
+            self.codes.append(wave_codes)
+            self.nodes.append(nodes)
+
+    def key_values(self, keys: list) -> list:
+
+        '''
+        Linking key of each node, per wave, from its first row.
+        '''
+
+        values = []
+        for ds, graph, key in zip(self.datasets, self.graphs, keys):
+            column = ds[key].to_numpy()[graph.first_row]
+            if key != 's_merge_id':
+                column = to_id_array(column).astype(float)
+                column[column < 0] = np.nan
+            values.append(pd.Series(column, dtype=object if key == 's_merge_id' else float))
+
+        return values
+
+    def tie_keys(self, t: int, relation: str) -> np.ndarray:
+
+        '''
+        Sorted packed (nominator code, nominee code) keys of the ties of
+        wave t, repeated ties once and self-nominations dropped.
+        '''
+
+        src, dst = self.graphs[t].edges(relation, drop_self=True)
+        src, dst = self.codes[t][src], self.codes[t][dst]
+        linked = (src >= 0) & (dst >= 0)
+
+        return sorted_unique(src[linked] * self.n_students + dst[linked])
+
+
+def compare_ties(before: np.ndarray, after: np.ndarray, in_before: np.ndarray,
+                 in_after: np.ndarray, n_students: int) -> tuple:
+
+    '''
+    Persisted, dissolved and formed ties as per-student (nominator code)
+    counts, from the sorted tie keys of two waves. `in_before` /
+    `in_after` flag the student codes present in each wave.
+    '''
+
+    def counts(keys, mask):
+        return np.bincount(keys[mask] // n_students, minlength=n_students).astype(np.int64)
+
+    comparable_before = in_after[before // n_students] & in_after[before % n_students]
+    comparable_after = in_before[after // n_students] & in_before[after % n_students]
+    kept = contains(after, before)
+
+    return (counts(before, comparable_before & kept),
+            counts(before, comparable_before & ~kept),
+            counts(after, comparable_after & ~contains(before, after)))
+
+
+@profiled()
+def compare_waves(waves: AlignedWaves, t_before: int, t_after: int, pairs=None) -> tuple:
+
+    '''
+    Tie dynamics from wave `t_before` to wave `t_after` of `waves`.
+    Returns (per-student DataFrame, per-classroom DataFrame).
+    '''
+
+    g0, g1 = waves.graphs[t_before], waves.graphs[t_after]
+    s0, s1 = waves.schemas[t_before], waves.schemas[t_after]
+    pairs = pairs or relation_pairs(s0, s1)
+    nodes0, nodes1 = waves.nodes[t_before], waves.nodes[t_after]
+    in_before, in_after = nodes0 >= 0, nodes1 >= 0
+
+    # Students of both waves, in the earlier wave's node order
+    both = np.flatnonzero(in_before & in_after)
+    both = both[np.argsort(nodes0[both], kind='stable')]
+    node0, node1 = nodes0[both], nodes1[both]
+    classroom = g0.node_classroom[node0]
+
+    students = {s0['classroom']: g0.classroom_ids[classroom],
+                s0['student']: g0.student_ids[node0]}
+    if s1['student'] != s0['student']:
+        students[s1['student']] = g1.student_ids[node1]
+    classrooms = {s0['classroom']: g0.classroom_ids,
+                  'n_students': np.bincount(classroom, minlength=g0.n_classrooms)}
+
+    for r0, r1 in pairs:
+        name = r0 if r0 == r1 else f'{r0}_{r1}'
+
+        step(f"1) tie keys {name}")
+        before, after = waves.tie_keys(t_before, r0), waves.tie_keys(t_after, r1)
+
+        step(f"2) join {name}")
+        persisted, dissolved, formed = compare_ties(before, after, in_before, in_after,
+                                                    waves.n_students)
+
+        step(f"3) per student and classroom {name}")
+        persisted, dissolved, formed = persisted[both], dissolved[both], formed[both]
+        union = persisted + dissolved + formed
+        isolated0 = g0.in_degree(r0)[node0] == 0
+        isolated1 = g1.in_degree(r1)[node1] == 0
+
+        students[f'persisted_{name}'] = persisted
+        students[f'dissolved_{name}'] = dissolved
+        students[f'formed_{name}'] = formed
+        students[f'jaccard_{name}'] = np.where(union > 0, persisted / np.maximum(union, 1), np.nan)
+        students[f'isolated_before_{name}'] = isolated0.astype(int)
+        students[f'isolated_after_{name}'] = isolated1.astype(int)
+
+        totals = {}
+        for label, values in (('persisted', persisted), ('dissolved', dissolved), ('formed', formed)):
+            totals[label] = np.bincount(classroom, weights=values, minlength=g0.n_classrooms).astype(np.int64)
+            classrooms[f'{label}_{name}'] = totals[label]
+        union = totals['persisted'] + totals['dissolved'] + totals['formed']
+        classrooms[f'jaccard_{name}'] = np.where(union > 0, totals['persisted'] / np.maximum(union, 1), np.nan)
+
+        # Isolation transition matrix, flattened in TRANSITIONS order
+        transition = (~isolated0) * 2 + (~isolated1)
+        matrix = np.bincount(classroom * 4 + transition, minlength=g0.n_classrooms * 4
+                             ).reshape(g0.n_classrooms, 4)
+        for k, label in enumerate(TRANSITIONS):
+            classrooms[f'{label}_{name}'] = matrix[:, k]
+
+    return pd.DataFrame(students), pd.DataFrame(classrooms)
+
+
+def tie_dynamics(before: pd.DataFrame, after: pd.DataFrame, pairs=None, keys=None,
+                 id_map: pd.DataFrame = None, allow_student_id: bool = False) -> tuple:
+
+    '''
+    Tie dynamics between two waves (see the module docstring). Returns
+    (per-student DataFrame, per-classroom DataFrame).
+    '''
+
+    return compare_waves(AlignedWaves([before, after], keys, id_map, allow_student_id), 0, 1, pairs)
+
+
+def wave_sequence_dynamics(datasets: list, keys=None, id_map: pd.DataFrame = None,
+                           allow_student_id: bool = False) -> list:
+
+    '''
+    Tie dynamics between each wave and the next, for waves in time order.
+    Students are aligned once over all waves.
+    '''
+
+    waves = AlignedWaves(datasets, keys, id_map, allow_student_id)
+
+    return [compare_waves(waves, t, t + 1) for t in range(len(datasets) - 1)]
+
+
+def transition_matrix(classrooms: pd.DataFrame, name: str) -> pd.DataFrame:
+
+    '''
+    2x2 isolation transition matrix of all classrooms for relation (pair)
+    `name`: rows the earlier status, columns the later one.
+    '''
+
+    counts = [int(classrooms[f'{label}_{name}'].sum()) for label in TRANSITIONS]
+
+    return pd.DataFrame([counts[:2], counts[2:]],
+                        index=['isolated', 'connected'], columns=['isolated', 'connected'])
@@ -10,23 +10,32 @@ import os
 
 def get_dataframe_into_ds(path: str,
                           file_name: str,
-                          is_xlsx: bool) -> pd.DataFrame:
+                          is_xlsx: bool,
+                          use_cache: bool = False) -> pd.DataFrame:
 
     '''
-    Import dataframe
+    Import dataframe. With use_cache, the file goes through the typed
+    Arrow cache of ingest.read_wave (ID columns as nullable Int64).
+    `file_name` may also be a partitioned dataset directory (see
+    wave_dataset.py).
     '''
 
-    os.chdir(path)
+    full_path = os.path.join(path, file_name)
+
+    from wave_dataset import is_dataset, read_dataset
+    if is_dataset(full_path):
+        return read_dataset(full_path)
+
+    if use_cache:
+        from ingest import read_wave
+        return read_wave(full_path)
 
     if is_xlsx:
-        ds = pd.read_excel(file_name)
+        ds = pd.read_excel(full_path)
     else:
-        ds = pd.read_csv(file_name)
+        ds = pd.read_csv(full_path)
     final_ds = pd.DataFrame(ds)
 
-    os.chdir("/workspaces/ROC-network-analysis")
-    ##os.chdir("/Users/andrealunghini/network-analysis/")
-
     return final_ds
 
 
@@ -46,14 +55,15 @@ def assure_data_quality(ds: pd.DataFrame,
     '''
     Problem: mix of data types: IDs should be string or float
     globally.
-    Solution: for all the ID variables to be float.
+    Solution: for all the ID variables to be nullable Int64
+    (ingest.coerce_ids): 10-digit IDs stay exact and missing IDs are
+    <NA>. Values that are not numbers become <NA> too.
     '''
 
-    for tg in target_variables:
-        ds[tg] = ds[tg].apply(lambda x: float(x))
-        ds = pd.DataFrame(ds)
+    from ingest import coerce_ids
+
+    return coerce_ids(ds, target_variables)
 
-    return ds
 
 #def get_peers_outside_class_warning(ds: pd.DataFrame):
 
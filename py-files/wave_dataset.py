@@ -0,0 +1,242 @@
+'''
+Partitioned on-disk layout of a wave file: one Parquet (or Arrow IPC)
+file per classroom, grouped in a directory per school, plus a
+manifest.json index.
+
+    roc_network_data_follow_up.dataset/
+        manifest.json
+        school=112543/classroom=1125431.parquet
+        ...
+
+Every metric works per classroom, so a worker (or an ad-hoc query for
+one school) reads only the files it needs. ID columns are stored typed
+(nullable Int64, as ingest.read_wave produces them) and each row keeps
+its position in the source file, so loading the whole dataset gives the
+source rows back in their original order.
+
+Usage:
+    python py-files/roc_network.py partition input-files/roc_network_data_follow_up.csv
+'''
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from nomination_graph import detect_schema
+
+
+MANIFEST = 'manifest.json'
+DATASET_SUFFIX = '.dataset'
+ROW_COLUMN = 'source_row'
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def is_dataset(path: str) -> bool:
+
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST))
+
+
+def dataset_path(path: str) -> str:
+
+    '''
+    Default dataset directory of a wave file: next to it, named after it.
+    '''
+
+    return os.path.splitext(path)[0] + DATASET_SUFFIX
+
+
+def read_manifest(path: str) -> dict:
+
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def school_of(ds: pd.DataFrame, schema: dict) -> pd.Series:
+
+    '''
+    School of each row: the school id column when the wave has one,
+    otherwise the classroom id without its last (section) digit.
+    '''
+
+    if schema['school'] in ds.columns:
+        return ds[schema['school']]
+
+    return ds[schema['classroom']] // 10
+
+
+def write_partition(ds: pd.DataFrame, path: str, fmt: str):
+
+    import pyarrow as pa
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pandas(ds, preserve_index=False), path)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(ds.reset_index(drop=True), path, compression='uncompressed')
+
+
+def read_partition(path: str, fmt: str, columns: list = None) -> pd.DataFrame:
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns).to_pandas()
+
+    import pyarrow.feather as feather
+    return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+def common_dtype(dtypes: set) -> str:
+
+    '''
+    Dtype a column is restored to when its partitions were parsed with
+    different dtypes (e.g. a column that is empty in some classrooms).
+    '''
+
+    if len(dtypes) == 1:
+        return next(iter(dtypes))
+    if all(d in ('Int64', 'int64', 'float64') for d in dtypes):
+        return 'float64' if 'float64' in dtypes and 'Int64' not in dtypes else 'Int64'
+
+    return 'object'
+
+
+def write_dataset(path: str, out_dir: str = None, fmt: str = 'parquet',
+                  chunksize: int = 100_000) -> str:
+
+    '''
+    Rewrite the wave file `path` as a dataset partitioned by school and
+    classroom (in `out_dir`, by default next to the input). The input is
+    read a batch of complete classrooms at a time. Returns the dataset
+    directory.
+    '''
+
+    from ingest import file_digest
+    from streaming import iter_classroom_batches
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown dataset format '{fmt}'. Choose from: {', '.join(FORMATS)}")
+
+    out_dir = out_dir or dataset_path(path)
+    tmp = f'{out_dir}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    columns = pd.read_csv(path, nrows=0).columns
+    schema = detect_schema(columns)
+    partitions, dtypes = [], {}
+    for batch in iter_classroom_batches(path, chunksize, row_column=ROW_COLUMN):
+        for c in columns:
+            dtypes.setdefault(c, set()).add(str(batch[c].dtype))
+
+        schools = school_of(batch, schema)
+        keys = pd.DataFrame({'school': schools, 'classroom': batch[schema['classroom']]})
+        for (school, classroom), rows in batch.groupby([keys['school'], keys['classroom']],
+                                                       dropna=False, sort=True):
+            school = None if pd.isna(school) else int(school)
+            classroom = None if pd.isna(classroom) else int(classroom)
+            name = os.path.join(f'school={"NA" if school is None else school}',
+                                f'classroom={"NA" if classroom is None else classroom}.{FORMATS[fmt]}')
+            os.makedirs(os.path.join(tmp, os.path.dirname(name)), exist_ok=True)
+            write_partition(rows, os.path.join(tmp, name), fmt)
+            partitions.append({'school': school, 'classroom': classroom,
+                               'path': name, 'rows': len(rows)})
+
+    partitions.sort(key=lambda p: (p['school'] is None, p['school'] or 0,
+                                   p['classroom'] is None, p['classroom'] or 0))
+    manifest = {
+        'source': os.path.basename(path),
+        'digest': file_digest(path),
+        'wave': schema['wave'],
+        'format': fmt,
+        'columns': list(columns),
+        'dtypes': {c: common_dtype(d) for c, d in dtypes.items()},
+        'rows': sum(p['rows'] for p in partitions),
+        'partitions': partitions,
+    }
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp, out_dir)
+
+    return out_dir
+
+
+def select_partitions(manifest: dict, schools=None, classrooms=None) -> list:
+
+    '''
+    Manifest entries of the given schools and/or classrooms (all if None).
+    '''
+
+    partitions = manifest['partitions']
+    if schools is not None:
+        schools = {int(s) for s in np.atleast_1d(schools)}
+        partitions = [p for p in partitions if p['school'] in schools]
+    if classrooms is not None:
+        classrooms = {int(c) for c in np.atleast_1d(classrooms)}
+        partitions = [p for p in partitions if p['classroom'] in classrooms]
+
+    return partitions
+
+
+def load_partitions(path: str, manifest: dict, partitions: list,
+                    columns: list = None, row_column: str = None) -> pd.DataFrame:
+
+    '''
+    Read and concatenate `partitions`, restoring the manifest dtypes and
+    the source row order.
+    '''
+
+    columns = [c for c in manifest['columns'] if columns is None or c in columns]
+    frames = [read_partition(os.path.join(path, p['path']), manifest['format'],
+                             columns + [ROW_COLUMN])
+              for p in partitions]
+    if not frames:
+        return pd.DataFrame({c: pd.Series(dtype=manifest['dtypes'][c]) for c in columns})
+
+    ds = pd.concat(frames, ignore_index=True).sort_values(ROW_COLUMN, kind='mergesort')
+    for c in columns:
+        if str(ds[c].dtype) != manifest['dtypes'][c]:
+            ds[c] = ds[c].astype(manifest['dtypes'][c])
+
+    if row_column:
+        ds = ds.rename(columns={ROW_COLUMN: row_column})
+    else:
+        ds = ds.drop(columns=ROW_COLUMN)
+
+    return ds.reset_index(drop=True)
+
+
+def read_dataset(path: str, schools=None, classrooms=None,
+                 columns: list = None) -> pd.DataFrame:
+
+    '''
+    Load a partitioned wave, or only some schools / classrooms / columns
+    of it, in source row order. Only the matching partition files are read.
+    '''
+
+    manifest = read_manifest(path)
+
+    return load_partitions(path, manifest, select_partitions(manifest, schools, classrooms),
+                           columns)
+
+
+def iter_dataset_batches(path: str, chunksize: int = 100_000, row_column: str = None):
+
+    '''
+    Yield the dataset a few classroom files at a time, each batch about
+    `chunksize` rows (or one classroom, if larger).
+    '''
+
+    manifest = read_manifest(path)
+    batch, n = [], 0
+    for partition in manifest['partitions']:
+        batch.append(partition)
+        n += partition['rows']
+        if n >= chunksize:
+            yield load_partitions(path, manifest, batch, row_column=row_column)
+            batch, n = [], 0
+    if batch:
+        yield load_partitions(path, manifest, batch, row_column=row_column)
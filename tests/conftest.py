@@ -0,0 +1,9 @@
+'''
+The modules live in the flat py-files/ folder (run as scripts from
+there), so the tests import them from it.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'py-files'))
@@ -0,0 +1,133 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from graph_metrics import TRIAD_TYPES, TRICODES, triad_census
+from nomination_graph import build_nomination_graph
+from synthetic_waves import generate_wave
+
+
+def classify_triad(ties: set, i, j, k) -> str:
+
+    '''
+    Holland-Leinhardt type of the triad (i, j, k) of a set of directed
+    ties, from its mutual / asymmetric / null dyads and, for the types
+    that share those counts, the direction of the asymmetric ties.
+    '''
+
+    nodes = (i, j, k)
+    pairs = [(i, j), (i, k), (j, k)]
+    mutual = [p for p in pairs if p in ties and p[::-1] in ties]
+    asym = [p if p in ties else p[::-1] for p in pairs
+            if (p in ties) != (p[::-1] in ties)]
+    name = f'{len(mutual)}{len(asym)}{3 - len(mutual) - len(asym)}'
+
+    if name == '021':
+        senders, receivers = {a for a, _ in asym}, {b for _, b in asym}
+        return name + ('D' if len(senders) == 1 else 'U' if len(receivers) == 1 else 'C')
+    if name == '111':
+        # Asymmetric tie towards the mutual pair: D, away from it: U
+        return name + ('D' if asym[0][1] in mutual[0] else 'U')
+    if name == '030':
+        out_degree = [sum(a == n for a, _ in asym) for n in nodes]
+        return name + ('C' if out_degree == [1, 1, 1] else 'T')
+    if name == '120':
+        third = ({i, j, k} - set(mutual[0])).pop()
+        sends = sum(a == third for a, _ in asym)
+        return name + ('D' if sends == 2 else 'U' if sends == 0 else 'C')
+
+    return name
+
+
+def brute_force_census(graph, relation: str, c: int) -> dict:
+
+    '''
+    Triad census of classroom `c` (position in graph.classroom_ids) by
+    classifying every triad of its students.
+    '''
+
+    src, dst = graph.edges(relation)
+    start, end = graph.classroom_ptr[c], graph.classroom_ptr[c + 1]
+    ties = {(a, b) for a, b in zip(src.tolist(), dst.tolist())
+            if start <= a < end and start <= b < end and a != b}
+    expected = dict.fromkeys(TRIAD_TYPES, 0)
+    for triad in combinations(range(start, end), 3):
+        expected[classify_triad(ties, *triad)] += 1
+
+    return expected
+
+
+def assert_census_matches(graph, classrooms=None):
+
+    census = triad_census(graph)
+    for relation in graph.relations:
+        for c in range(graph.n_classrooms) if classrooms is None else classrooms:
+            found = {t: census[f'triad_{t}_{relation}'].iloc[c] for t in TRIAD_TYPES}
+            assert found == brute_force_census(graph, relation, c), \
+                f"classroom {graph.classroom_ids[c]}, {relation}"
+
+
+def endline(rows: list) -> pd.DataFrame:
+
+    '''
+    Endline wave from (classroom, student, friends) rows, no support ties.
+    '''
+
+    return pd.DataFrame({
+        'classroom_id': [r[0] for r in rows],
+        'student_id':   [r[1] for r in rows],
+        **{f'friend_{k + 1}': [r[2][k] if k < len(r[2]) else np.nan for r in rows] for k in range(3)},
+        'support_1':    [np.nan] * len(rows),
+    })
+
+
+def test_tricodes_agree_with_classification():
+
+    # Every 6-bit code of a triad (v, u, w), see graph_metrics.TRICODES
+    bits = [(0, 1), (1, 0), (0, 2), (2, 0), (1, 2), (2, 1)]
+    for code in range(64):
+        ties = {tie for b, tie in enumerate(bits) if code >> b & 1}
+        assert classify_triad(ties, 0, 1, 2) == TRIAD_TYPES[TRICODES[code] - 1], code
+
+
+def test_self_nomination_is_not_a_tie():
+
+    # 3 students, one names themself and one names them: 1 asymmetric
+    # dyad, 2 null dyads, one 012 triad
+    graph = build_nomination_graph(endline([(1001, 1001001, [1001001]),
+                                            (1001, 1001002, [1001001]),
+                                            (1001, 1001003, [])]))
+
+    census = triad_census(graph)
+    assert census['triad_012_friend'].tolist() == [1]
+    assert census['dyad_asymmetric_friend'].tolist() == [1]
+    assert census['dyad_null_friend'].tolist() == [2]
+    assert_census_matches(graph)
+
+
+def test_small_classrooms():
+
+    graph = build_nomination_graph(endline([
+        # 1: a cycle
+        (1, 11, [12]), (1, 12, [13]), (1, 13, [11]),
+        # 2: transitive, plus a tie repeated in two slots
+        (2, 21, [22, 23]), (2, 22, [23, 23]), (2, 23, []),
+        # 3: a mutual pair, a tie to a student of classroom 1 and an isolate
+        (3, 31, [32, 11]), (3, 32, [31]), (3, 33, [32]), (3, 34, []),
+    ]))
+
+    census = triad_census(graph)
+    assert census['triad_030C_friend'].tolist() == [1, 0, 0]
+    assert census['triad_030T_friend'].tolist() == [0, 1, 0]
+    assert census['triad_111D_friend'].tolist() == [0, 0, 1]
+    assert census['triad_102_friend'].tolist() == [0, 0, 1]
+    assert_census_matches(graph)
+
+
+@pytest.mark.parametrize('wave', ['endline', 'follow_up'])
+def test_synthetic_waves(wave):
+
+    graph = build_nomination_graph(generate_wave(wave, 2000, seed=0))
+    assert_census_matches(graph, sorted(set(np.linspace(0, graph.n_classrooms - 1, 10).astype(int))))
@@ -0,0 +1,44 @@
+import filecmp
+import os
+
+from incremental import update_outputs
+from metric_cache import metric_cache_disabled
+from roc_network import METRICS, process_file
+from synthetic_waves import generate_wave
+
+
+PER_CLASSROOM = [m for m, spec in METRICS.items() if spec.get('per_classroom')]
+
+
+def write_wave(ds, directory):
+
+    path = os.path.join(directory, 'roc_network_data_follow_up.csv')
+    ds.to_csv(path, index=False)
+
+    return path
+
+
+def test_patched_outputs_are_byte_identical_to_a_full_run(tmp_path):
+
+    ds = generate_wave('follow_up', 600, seed=3)
+    inputs, patched, full = (tmp_path / d for d in ('in', 'patched', 'full'))
+    for d in (inputs, patched, full):
+        d.mkdir()
+
+    with metric_cache_disabled():
+        path = write_wave(ds, inputs)
+        process_file(path, PER_CLASSROOM, patched, use_cache=False)
+
+        # Two correction batches, each patched into the outputs
+        for row in (5, 300):
+            ds.loc[row, 'emot_1'] = ds.loc[row + 1, 'fs_student_id']
+            ds.loc[row + 2, 'high_math'] = 'yes' if ds.loc[row + 2, 'high_math'] == 'no' else 'no'
+            write_wave(ds, inputs)
+            result = update_outputs(path, PER_CLASSROOM, patched, use_cache=False)
+            assert result and all(n is not None for n in result.values())
+
+        written = process_file(path, PER_CLASSROOM, full, use_cache=False)
+
+    for output in written:
+        name = os.path.basename(output)
+        assert filecmp.cmp(patched / name, full / name, shallow=False), name
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from roc_network import WAVE_FILE, main
+from synthetic_waves import generate_wave
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+
+    for variant, wave in [('endline', 'endline'), ('endline_low_ability', 'endline'),
+                          ('follow_up', 'follow_up')]:
+        generate_wave(wave, 300, seed=1).to_csv(tmp_path / WAVE_FILE.format(wave=variant), index=False)
+
+    return tmp_path
+
+
+def test_requested_metric_skips_waves_without_its_columns(input_dir, tmp_path, capsys):
+
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    main(['run', '--wave', 'endline,follow_up', '--metrics', 'coleman,triad_census',
+          '--input-dir', str(input_dir), '--output-dir', str(output_dir), '--no-cache'])
+
+    assert 'Skipped. coleman on roc_network_data_endline.csv' in capsys.readouterr().out
+    assert sorted(os.listdir(output_dir)) == ['.roc_snapshot', 'coleman-homophily.csv',
+                                              'roc_triad_census_endline.csv',
+                                              'roc_triad_census_follow_up.csv']
+
+
+@pytest.mark.parametrize('waves', ['endline', 'endline,endline_low_ability'])
+def test_requested_metric_no_wave_supports(input_dir, tmp_path, waves):
+
+    with pytest.raises(SystemExit):
+        main(['run', '--wave', waves, '--metrics', 'coleman',
+              '--input-dir', str(input_dir), '--output-dir', str(tmp_path), '--no-cache'])
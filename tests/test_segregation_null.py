@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segregation_null import classroom_null_inputs, simulate_cross_ability_null
+
+
+def small_wave(id_dtype='Int64') -> pd.DataFrame:
+
+    '''
+    Two classrooms of four students: 10 (two high, two low) and 20 (one
+    high, three low), emotional nominations within the classroom.
+    '''
+
+    ds = pd.DataFrame({
+        'fs_classroom':  [10, 10, 10, 10, 20, 20, 20, 20],
+        'fs_student_id': [11, 12, 13, 14, 21, 22, 23, 24],
+        'high_math':     ['yes', 'yes', 'no', 'no', 'yes', 'no', 'no', 'no'],
+        'emot_1':        [12, 13, 14, 11, 22, 23, 24, 21],
+        'emot_2':        [13, None, None, None, 23, None, None, None],
+        'emot_3':        [None] * 8,
+    })
+
+    return ds.astype({c: id_dtype for c in ds.columns if c != 'high_math'})
+
+
+def test_null_inputs_count_classmates():
+
+    inputs = classroom_null_inputs(small_wave())
+
+    assert inputs['degree'].tolist() == [2, 1, 1, 1, 2, 1, 1, 1]
+    # High students of classroom 10 have two low classmates, low ones two high
+    assert inputs['n_cross'].tolist() == [2, 2, 2, 2, 3, 1, 1, 1]
+    assert inputs['n_other'].tolist() == [1, 1, 1, 1, 0, 2, 2, 2]
+
+
+@pytest.mark.parametrize('id_dtype', ['Int64', 'float64'])
+def test_rows_without_classroom_are_skipped(id_dtype):
+
+    ds = small_wave(id_dtype)
+    with_missing = pd.concat([ds, pd.DataFrame({'fs_classroom': [None], 'fs_student_id': [31],
+                                                'high_math': ['no'], 'emot_1': [11]})],
+                             ignore_index=True).astype({'fs_classroom': id_dtype})
+
+    inputs = classroom_null_inputs(with_missing)
+    pd.testing.assert_frame_equal(inputs, classroom_null_inputs(ds))
+
+    out = simulate_cross_ability_null(with_missing, n_draws=200, seed=0, workers=1)
+    expected = simulate_cross_ability_null(ds, n_draws=200, seed=0, workers=1)
+    assert out['fs_classroom'].tolist() == [10, 20]
+    np.testing.assert_allclose(out['null_mean'], expected['null_mean'])